@@ -4,4 +4,18 @@ __author__ = """James Ian Mitchell-White"""
 __email__ = 'jamesjimitchell@gmail.com'
 __version__ = '0.1.0'
 
-from fcs_functions import calibration, fcs_objects, raw_functions, models
\ No newline at end of file
+import importlib
+from fcs_functions.jit import warmup
+
+_submodules = ['calibration', 'fcs_objects', 'raw_functions', 'models', 'batch', 'cache', 'fitting', 'bootstrap', 'jit', 'indexer']
+
+__all__ = _submodules + ['warmup']
+
+def __getattr__(name):
+    # Submodules are imported when first used, so e.g. fcs_functions.calibration does not import the others
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
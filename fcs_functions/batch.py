@@ -0,0 +1,142 @@
+"""Batch
+Processing many ConfoCor3 raw files at once, e.g. every file from a plate run
+Values:
+    - metadata_fields
+Functions:
+    - process_raw_file
+    - process_raw_files
+    - stack_results
+"""
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import cache, jit, raw_functions
+
+# The header values from each raw file that are returned with its results
+metadata_fields = ['measurement_id', 'measurement_pos', 'kinetic_index', 'repetition_number', 'sampling_frequency']
+
+def process_raw_file(path: str, acf_kwargs: dict = None, pch_kwargs: dict = None) -> dict:
+    """Computes the ACF and PCH of one raw file
+
+    Any error is caught and returned, so one bad file does not stop a batch
+
+    Parameters
+    ----------
+    path: str
+        The path leading to the raw file
+    acf_kwargs: dict
+        Keyword arguments for RawConfoCor3.make_acf
+    pch_kwargs: dict
+        Keyword arguments for RawConfoCor3.make_pch
+
+    Returns
+    -------
+    A dictionary of the file's metadata, acf and PhotonCountHistogram, with an error entry holding the traceback if the file could not be processed
+    """
+    result = {'path': path, 'error': None}
+    try:
+        raw = raw_functions.RawConfoCor3(path)
+        for field in metadata_fields:
+            result[field] = getattr(raw, field)
+        raw.make_acf(**(acf_kwargs or {}))
+        raw.make_pch(**(pch_kwargs or {}))
+        result['acf'] = raw.acf
+        result['PhotonCountHistogram'] = raw.PhotonCountHistogram
+    except Exception:
+        result['error'] = traceback.format_exc()
+    return result
+
+def _start_worker(cache_settings: tuple) -> None:
+    """Starts a process_raw_files worker with the parent's result cache, then loads the compiled kernels"""
+    if cache_settings is None:
+        cache.disable()
+    else:
+        cache.enable(*cache_settings)
+    jit.warmup(['raw_functions'])
+
+def process_raw_files(paths: list, acf_kwargs: dict = None, pch_kwargs: dict = None, max_workers: int = None) -> dict:
+    """Computes the ACFs and PCHs of many raw files in a pool of processes
+
+    Results are returned in the same order as paths. Files that fail have rows of NaN in the ACF array and zeros in the PCH array, and their traceback in errors.
+    The workers use the same result cache as the calling process (see the cache module).
+    An error in a file only fails that file, but a worker process dying, e.g. when it is killed for running out of memory, breaks the pool:
+    the file it was processing and every file not yet finished fail with a BrokenProcessPool error, and can be processed again by passing their paths to another call
+
+    Parameters
+    ----------
+    paths: list
+        The paths leading to the raw files
+    acf_kwargs: dict
+        Keyword arguments for RawConfoCor3.make_acf, shared by every file
+    pch_kwargs: dict
+        Keyword arguments for RawConfoCor3.make_pch, shared by every file
+    max_workers: int
+        The largest number of processes to use. Defaults to the number of CPUs
+
+    Returns
+    -------
+    A dictionary with
+        tau: the time delays of the ACFs
+        acf: a files x time delays array of the ACFs
+        acf_sigma: a files x time delays array of the ACF standard errors, if make_acf was given segments
+        pch_bins: the bin edges of the PCHs
+        pch: a files x bins array of the PCHs
+        metadata: a list of dictionaries of each file's path and header values
+        errors: a list of each file's traceback, or None if it was processed
+    """
+    paths = list(paths)
+    max_workers = min(max_workers or os.cpu_count() or 1, max(len(paths), 1))
+    results = []
+    # Spawned workers start without the parent's cache, so it is passed to them to enable
+    result_cache = cache.get_cache()
+    cache_settings = None if result_cache is None else (result_cache.directory, result_cache.max_bytes, result_cache.hash_contents)
+    # Workers are spawned rather than forked, as a fork of a process that has run a parallel kernel can hang on exit.
+    # Each worker loads the compiled kernels before its first file, rather than compiling them part way through
+    with ProcessPoolExecutor(max_workers = max_workers, mp_context = multiprocessing.get_context('spawn'), initializer = _start_worker, initargs = (cache_settings,)) as executor:
+        futures = [executor.submit(process_raw_file, path, acf_kwargs, pch_kwargs) for path in paths]
+        for path, future in zip(paths, futures):
+            # process_raw_file catches errors in a file, so this is a worker dying, which breaks the pool and fails every unfinished file
+            try:
+                results.append(future.result())
+            except Exception:
+                results.append({'path': path, 'error': traceback.format_exc()})
+    return stack_results(results)
+
+def stack_results(results: list) -> dict:
+    """Stacks the results of process_raw_file for many files into arrays
+
+    Parameters
+    ----------
+    results: list
+        Dictionaries from process_raw_file
+
+    Returns
+    -------
+    A dictionary in the layout returned by process_raw_files. If every file failed, tau and pch_bins are empty, and acf and pch have no columns
+    """
+    processed = [result for result in results if result['error'] is None]
+    stacked = {
+        'metadata': [dict([('path', result['path'])] + [(field, result.get(field)) for field in metadata_fields]) for result in results],
+        'errors': [result['error'] for result in results]
+    }
+    if processed:
+        acf_rows = processed[0]['acf'].shape[0]
+        stacked['tau'] = processed[0]['acf'][0]
+        stacked['pch_bins'] = processed[0]['PhotonCountHistogram'][1]
+    else:
+        acf_rows = 2
+        stacked['tau'] = np.zeros(0)
+        stacked['pch_bins'] = np.zeros(0)
+    stacked['acf'] = np.full((len(results), len(stacked['tau'])), np.nan)
+    stacked['pch'] = np.zeros((len(results), max(len(stacked['pch_bins']) - 1, 0)), dtype = np.int64)
+    if acf_rows > 2:
+        stacked['acf_sigma'] = np.full((len(results), len(stacked['tau'])), np.nan)
+    for index, result in enumerate(results):
+        if result['error'] is None:
+            stacked['acf'][index] = result['acf'][1]
+            stacked['pch'][index] = result['PhotonCountHistogram'][0]
+            if acf_rows > 2:
+                stacked['acf_sigma'][index] = result['acf'][2]
+    return stacked
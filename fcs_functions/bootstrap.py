@@ -0,0 +1,165 @@
+"""Bootstrap
+Bootstrap uncertainties for fitted parameters, and the concentrations and hydrodynamic radii calculated from them
+
+Resampled curves are refitted together with fitting.fit_curves, in a pool of processes, starting from the point estimate
+
+Values:
+    - default_resamples
+Functions:
+    - bootstrap_fit
+    - bootstrap_fcs
+    - derived_distributions
+"""
+import warnings
+from typing import Callable
+import numpy as np
+from . import calibration, fcs_objects, fitting
+
+# The number of resampled fits used if none is given
+default_resamples = 200
+
+def bootstrap_fit(model: Callable, t: 'np.array', curves: 'np.array', p0: 'np.array', n_resamples: int = default_resamples, resample: str = 'repeats', sigma: 'np.array' = None, confidence: float = 0.95, seed: int = None, **kwargs) -> dict:
+    """Bootstrap distributions of the parameters of a model fitted to a stack of curves
+
+    Parameters
+    ----------
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    t: numpy array
+        The time delays shared by every curve
+    curves: numpy array
+        A curves x time delays array, e.g. every repeat of a Confocor3FCS
+    p0: numpy array
+        The starting parameters of the point estimate
+    n_resamples: int
+        The number of resampled fits
+    resample: str
+        Either
+            'repeats': the mean of the curves is fitted, and each resample is the mean of curves drawn with replacement
+        Or
+            'residuals': each curve is fitted, and each resample adds residuals drawn with replacement to its fit
+    sigma: numpy array
+        The uncertainty of each point. Residuals are resampled relative to it
+    confidence: float
+        The coverage of the returned intervals
+    seed: int
+        Seeds the random resampling
+    kwargs
+        Passed to fitting.fit_curves, e.g. bounds, jacobian and max_workers
+
+    Returns
+    -------
+    A dictionary with
+        parameters: the point estimate, one row for 'repeats' or one row per curve for 'residuals'
+        samples: the resampled parameters, resamples x parameters for 'repeats' or curves x resamples x parameters for 'residuals'
+        stderr: the standard deviation of the samples whose fits converged
+        interval: the lower and upper percentiles of the samples whose fits converged, for the confidence
+        converged: the fraction of resampled fits that converged
+        used: the number of samples that stderr and interval are calculated from, one per curve for 'residuals'
+    """
+    curves = np.atleast_2d(np.asarray(curves, dtype = np.float64))
+    rng = np.random.default_rng(seed)
+    if resample == 'repeats':
+        n_curves = curves.shape[0]
+        mean_sigma = None if sigma is None else np.sqrt(np.mean(np.broadcast_to(np.asarray(sigma, dtype = np.float64)**2, curves.shape), axis = 0)/n_curves)
+        point = fitting.fit_curves(model, t, curves.mean(axis = 0), p0, sigma = mean_sigma, **kwargs)
+        # How many times each curve is drawn in each resample
+        draws = rng.multinomial(n_curves, np.full(n_curves, 1/n_curves), size = n_resamples)
+        resampled = draws@curves/n_curves
+        refits = fitting.fit_curves(model, t, resampled, point['parameters'][0], sigma = mean_sigma, **kwargs)
+        samples = refits['parameters']
+        sample_converged = refits['converged']
+    elif resample == 'residuals':
+        n_curves, n_times = curves.shape
+        scale = np.ones_like(curves) if sigma is None else np.broadcast_to(np.asarray(sigma, dtype = np.float64), curves.shape)
+        point = fitting.fit_curves(model, t, curves, p0, sigma = sigma, **kwargs)
+        fitted = model(t, *point['parameters'].T[:, :, np.newaxis])
+        scaled_residuals = (curves - fitted)/scale
+        draws = rng.integers(0, n_times, size = (n_curves, n_resamples, n_times))
+        resampled = fitted[:, np.newaxis] + np.take_along_axis(scaled_residuals[:, np.newaxis], draws, axis = 2)*scale[:, np.newaxis]
+        starting = np.repeat(point['parameters'], n_resamples, axis = 0)
+        resampled_sigma = None if sigma is None else np.repeat(scale, n_resamples, axis = 0)
+        refits = fitting.fit_curves(model, t, resampled.reshape(-1, n_times), starting, sigma = resampled_sigma, **kwargs)
+        samples = refits['parameters'].reshape(n_curves, n_resamples, -1)
+        sample_converged = refits['converged'].reshape(n_curves, n_resamples)
+    else:
+        raise ValueError(f'Unknown resampling {resample}, expected repeats or residuals')
+    tail = 50*(1 - confidence)
+    # Fits that did not converge, e.g. of a resample that is not finite, are left out of the spread rather than making it NaN
+    converged_samples = np.where(sample_converged[..., np.newaxis], samples, np.nan)
+    with warnings.catch_warnings():
+        # Too few converged samples give NaN, without warning
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stderr = np.nanstd(converged_samples, axis = -2, ddof = 1)
+        interval = np.nanpercentile(converged_samples, [tail, 100 - tail], axis = -2)
+    return {
+        'parameters': point['parameters'],
+        'samples': samples,
+        'stderr': stderr,
+        'interval': interval,
+        'converged': np.mean(refits['converged']),
+        'used': np.sum(sample_converged, axis = -1)
+    }
+
+def bootstrap_fcs(fcs: 'fcs_objects.Confocor3FCS', model: Callable, p0: 'np.array', label: str = 'CorrelationArray', **kwargs) -> dict:
+    """Bootstrap distributions of the parameters of a model fitted to the repeats of a Confocor3FCS
+
+    Parameters
+    ----------
+    fcs: Confocor3FCS
+        The file to fit
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    p0: numpy array
+        The starting parameters of the point estimate
+    label: str
+        The array to fit
+    kwargs
+        Passed to bootstrap_fit
+
+    Returns
+    -------
+    The dictionary from bootstrap_fit, with the ids of the repeats
+    """
+    t, curves, ids = fitting.stack_curves(fcs.data, label)
+    result = bootstrap_fit(model, t, curves, p0, **kwargs)
+    result['ids'] = ids
+    return result
+
+def derived_distributions(samples: 'np.array', model: Callable, confocal_volume: float, confocal_widths: tuple, units: str = 'nM', viscosity: float = calibration.mu_water, temperature: float = 297.15) -> dict:
+    """Propagates bootstrap samples through the calibration, giving distributions of concentrations, diffusion coefficients and hydrodynamic radii
+
+    Parameters
+    ----------
+    samples: numpy array
+        The samples from bootstrap_fit, with parameters as the last axis
+    model: function
+        The fitted model, to find the number of molecules and diffusion times among the parameters
+    confocal_volume: float
+        The calibrated confocal volume
+    confocal_widths: tuple
+        The calibrated widths of the confocal volume
+    units: str
+        A key of calibration.conc_units
+    viscosity: float
+        The viscosity of the solvent
+    temperature: float
+        The temperature of the measurement in kelvin
+
+    Returns
+    -------
+    A dictionary of arrays shaped like the samples without the parameter axis, with
+        concentration: from the number of molecules, if it was fitted
+        diffusion_coefficient: a dictionary by diffusion time parameter, e.g. 't_d'
+        hydrodynamic_radius: a dictionary by diffusion time parameter
+    """
+    names = fitting.model_parameters(model)
+    derived = {'diffusion_coefficient': {}, 'hydrodynamic_radius': {}}
+    if 'n' in names:
+        derived['concentration'] = calibration.calibrated_conc(samples[..., names.index('n')], confocal_volume, units)
+    for index, name in enumerate(names):
+        if name.startswith('t_d'):
+            diffusion_coefficient = calibration.calc_coeff(confocal_widths[0], samples[..., index])
+            derived['diffusion_coefficient'][name] = diffusion_coefficient
+            derived['hydrodynamic_radius'][name] = calibration.calc_hydrodynamic_radius(diffusion_coefficient, viscosity, temperature)
+    return derived
@@ -0,0 +1,231 @@
+"""Cache
+A persistent on-disk cache for results computed from raw files, so re-running e.g. make_acf on the same file with the same parameters loads the previous result
+
+The cache is off until enable is called, or the FCS_FUNCTIONS_CACHE environment variable is set to a directory. Once enabled, RawConfoCor3 uses it without any other changes.
+Results are keyed by the raw file (its size and modification time, or a hash of its contents) and the computation's parameters, and stored as compressed .npz files.
+When the cache is larger than its size limit, the least recently used results are deleted
+
+Classes:
+    - ResultCache
+Values:
+    - default_max_bytes
+Functions:
+    - enable
+    - disable
+    - get_cache
+"""
+import hashlib
+import os
+from typing import Callable
+import numpy as np
+
+# The default size limit of the cache, in bytes
+default_max_bytes = 2*1024**3
+
+_cache = None
+
+
+class ResultCache(object):
+    """
+        A directory of computed results, keyed by source file and parameters
+
+        ...
+
+        Attributes
+        ----------
+        directory : str
+            The directory the results are stored in
+        max_bytes : int
+            The size limit of the cache, in bytes
+        hash_contents : bool
+            Whether files are identified by a hash of their contents rather than their size and modification time
+
+        Methods
+        -------
+        key(path, name, parameters):
+            Returns the key of a result computed from a file
+        load(key):
+            Returns a stored result, or None
+        save(key, result):
+            Stores a result, evicting the least recently used results if the cache is too large
+        clear():
+            Deletes every stored result
+    """
+
+    def __init__(self, directory: str, max_bytes: int = default_max_bytes, hash_contents: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory to store results in. It is created if it does not exist
+        max_bytes: int
+            The size limit of the cache, in bytes
+        hash_contents: bool
+            Identify files by a hash of their contents. This survives copying files, but reads every file in full
+        """
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        self.hash_contents = hash_contents
+        os.makedirs(self.directory, exist_ok = True)
+
+    def _file_identity(self, path: str) -> bytes:
+        """Identifies a file by its contents, or by its path, size and modification time"""
+        if self.hash_contents:
+            file_hash = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(2**24), b''):
+                    file_hash.update(block)
+            return file_hash.digest()
+        stat = os.stat(path)
+        return f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'.encode()
+
+    def key(self, path: str, name: str, parameters: dict) -> str:
+        """Returns the key of a result computed from a file
+
+        Parameters
+        ----------
+        path: str
+            The path of the file the result is computed from
+        name: str
+            The name of the computation, e.g. 'acf'
+        parameters: dict
+            The parameters of the computation. numpy arrays are keyed by their contents
+
+        Returns
+        -------
+        A hex string key
+        """
+        key_hash = hashlib.sha256(self._file_identity(path))
+        key_hash.update(name.encode())
+        for parameter, value in sorted(parameters.items()):
+            key_hash.update(parameter.encode())
+            if isinstance(value, np.ndarray):
+                key_hash.update(str(value.dtype).encode())
+                key_hash.update(np.ascontiguousarray(value).tobytes())
+            else:
+                key_hash.update(repr(value).encode())
+        return key_hash.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key: str) -> dict:
+        """Returns a stored result
+
+        Parameters
+        ----------
+        key: str
+            The key of the result, from the key method
+
+        Returns
+        -------
+        A dictionary of the stored numpy arrays, or None if there is no stored result
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                result = dict(stored)
+        except (OSError, ValueError):
+            return None
+        # The modification time records when a result was last used, for eviction
+        os.utime(path)
+        return result
+
+    def save(self, key: str, result: dict) -> None:
+        """Stores a result, then evicts the least recently used results while the cache is over its size limit
+
+        Parameters
+        ----------
+        key: str
+            The key of the result, from the key method
+        result: dict
+            A dictionary of numpy arrays
+        """
+        path = self._path(key)
+        # Writing to a temporary file then renaming stops other processes reading a half written result
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            np.savez_compressed(f, **result)
+        os.replace(temporary, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Deletes the least recently used results until the cache is within its size limit"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        """Deletes every stored result"""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
+
+    def cached(self, path: str, name: str, parameters: dict, compute: Callable[[], dict]) -> dict:
+        """Loads a result if it is stored, otherwise computes and stores it
+
+        Parameters
+        ----------
+        path: str
+            The path of the file the result is computed from
+        name: str
+            The name of the computation
+        parameters: dict
+            The parameters of the computation
+        compute: function
+            A function with no arguments returning the result as a dictionary of numpy arrays
+
+        Returns
+        -------
+        A dictionary of numpy arrays
+        """
+        key = self.key(path, name, parameters)
+        result = self.load(key)
+        if result is None:
+            result = compute()
+            self.save(key, result)
+        return result
+
+
+def enable(directory: str = '~/.cache/fcs_functions', max_bytes: int = default_max_bytes, hash_contents: bool = False) -> ResultCache:
+    """Turns on the cache used by RawConfoCor3
+
+    Parameters
+    ----------
+    directory: str
+        The directory to store results in
+    max_bytes: int
+        The size limit of the cache, in bytes
+    hash_contents: bool
+        Identify files by a hash of their contents rather than their size and modification time
+
+    Returns
+    -------
+    The ResultCache now in use
+    """
+    global _cache
+    _cache = ResultCache(directory, max_bytes, hash_contents)
+    return _cache
+
+def disable() -> None:
+    """Turns off the cache used by RawConfoCor3. Stored results are kept"""
+    global _cache
+    _cache = None
+
+def get_cache() -> ResultCache:
+    """Returns the ResultCache in use, or None if the cache is off"""
+    return _cache
+
+if os.environ.get('FCS_FUNCTIONS_CACHE'):
+    enable(os.environ['FCS_FUNCTIONS_CACHE'])
@@ -1,6 +1,8 @@
 '''Calibration
 This module contains the basic functions for calibrating FCS experiments with a standard
 
+The functions take single values, apart from calibrate_arrays, which calibrates arrays of fits at once and propagates their uncertainties
+
 Examples:
 
 Attributes:
@@ -10,7 +12,8 @@ Attributes:
     mu_water: Viscosity of water
 '''
 
-from math import pi, sqrt
+from math import pi
+import numpy as np
 
 # The values for the diffusion coefficients of Rhodamine 6G and Cy5 used at the UoN
 given_d = {
@@ -48,7 +51,8 @@ def confocal_widths(td: float, d: float, sp: float) -> tuple:
     -------
     A tuple with the first and second widths of the confocal volume
     """
-    w1 = sqrt(4*td*d)
+    # np.sqrt, so arrays of fits can be calibrated at once
+    w1 = np.sqrt(4*td*d)
     w2 = w1*sp
     return (w1, w2)
 
@@ -145,4 +149,90 @@ def calc_hydrodynamic_radius(diff_co: float, viscosity: float, temperature: floa
     temperature: float
         The temperature of the measurement in kelvin
     """
-    return (k_b*temperature)/(6*pi*viscosity*diff_co)
\ No newline at end of file
+    return (k_b*temperature)/(6*pi*viscosity*diff_co)
+
+def _lookup(values, table: dict) -> 'np.array':
+    """Looks up each element of values in table, passing through elements that are already numbers"""
+    values = np.asarray(values)
+    if values.dtype.kind not in 'US':
+        return values.astype(np.float64)
+    keys, inverse = np.unique(values, return_inverse = True)
+    return np.array([table[key] for key in keys], dtype = np.float64)[inverse].reshape(values.shape)
+
+def calibrate_arrays(measured_n: 'np.array', measured_td: 'np.array', calibration_td: 'np.array', calibration_sp: 'np.array', calibration_label = 'Rhodamine 6G', units = 'nM', viscosity = mu_water, temperature = 297.15, uncertainties: dict = None) -> dict:
+    """Calibrates arrays of fits at once, giving concentrations, diffusion coefficients and hydrodynamic radii
+
+    Every argument is broadcast against the others, so each fit can have its own calibration, units, viscosity and temperature.
+    Uncertainties are propagated to first order, assuming the arguments are independent
+
+    Parameters
+    ----------
+    measured_n: numpy array
+        The measured numbers of molecules in the confocal volume
+    measured_td: numpy array
+        The measured dwell times
+    calibration_td: numpy array
+        The dwell times recorded for the calibration species
+    calibration_sp: numpy array
+        The structural parameters recorded for the calibration species
+    calibration_label
+        Keys of given_d, or the calibration species' diffusion coefficients
+    units
+        Keys of conc_units
+    viscosity
+        The viscosities of the solvent
+    temperature
+        The temperatures of the measurements in kelvin
+    uncertainties: dict
+        Standard deviations of any of measured_n, measured_td, calibration_td, calibration_sp, calibration_d, viscosity and temperature, by argument name
+
+    Returns
+    -------
+    A dictionary of arrays of the confocal_widths (w1 and w2), confocal_volume, concentration, diffusion_coefficient and hydrodynamic_radius.
+    With uncertainties, each also has a standard deviation, e.g. concentration_sigma
+    """
+    measured_n = np.asarray(measured_n, dtype = np.float64)
+    measured_td = np.asarray(measured_td, dtype = np.float64)
+    calibration_td = np.asarray(calibration_td, dtype = np.float64)
+    calibration_sp = np.asarray(calibration_sp, dtype = np.float64)
+    calibration_d = _lookup(calibration_label, given_d)
+    viscosity = np.asarray(viscosity, dtype = np.float64)
+    temperature = np.asarray(temperature, dtype = np.float64)
+
+    w1, w2 = confocal_widths(calibration_td, calibration_d, calibration_sp)
+    volume = confocal_volume(w1, w2)
+    # calibrated_conc takes one unit, so each fit's units are applied as factors of molar
+    concentration = calibrated_conc(measured_n, volume, 'M')*_lookup(units, conc_units)
+    diff_co = calc_coeff(w1, measured_td)
+    radius = calc_hydrodynamic_radius(diff_co, viscosity, temperature)
+    calibrated = {
+        'w1': w1,
+        'w2': w2,
+        'confocal_volume': volume,
+        'concentration': concentration,
+        'diffusion_coefficient': diff_co,
+        'hydrodynamic_radius': radius
+    }
+    if uncertainties:
+        values = {
+            'measured_n': measured_n,
+            'measured_td': measured_td,
+            'calibration_td': calibration_td,
+            'calibration_sp': calibration_sp,
+            'calibration_d': calibration_d,
+            'viscosity': viscosity,
+            'temperature': temperature
+        }
+        # The squared relative uncertainty of each argument
+        relative = dict([(name, (np.asarray(uncertainties.get(name, 0.0), dtype = np.float64)/value)**2) for name, value in values.items()])
+        # Each result is a product of powers of the arguments, so its squared relative uncertainty is the sum of the squared exponent times the argument's
+        w1_relative = (relative['calibration_td'] + relative['calibration_d'])/4
+        volume_relative = 9*w1_relative + relative['calibration_sp']
+        diff_co_relative = 4*w1_relative + relative['measured_td']
+        calibrated['w1_sigma'] = w1*np.sqrt(w1_relative)
+        calibrated['w2_sigma'] = w2*np.sqrt(w1_relative + relative['calibration_sp'])
+        calibrated['confocal_volume_sigma'] = volume*np.sqrt(volume_relative)
+        calibrated['concentration_sigma'] = concentration*np.sqrt(relative['measured_n'] + volume_relative)
+        calibrated['diffusion_coefficient_sigma'] = diff_co*np.sqrt(diff_co_relative)
+        calibrated['hydrodynamic_radius_sigma'] = radius*np.sqrt(diff_co_relative + relative['viscosity'] + relative['temperature'])
+    return calibrated
@@ -1,61 +1,107 @@
 '''FCS Objects
 
 Classes
+    - ArraySpan
+    - LazyData
     - FcsData
     - FcsFit
     - Confocor3Fcs
+    - Experiment
 Values
     - numeric_parameters
+    - snapshot_version
 Functions
+    - tokenize
     - break_tab
     - gen_field
     - create_fields
     - make_array
+    - parse_rows
     - average_time_series
+    - read_fcs_header
 
 TODO:
-    - Add raw file integration
     - implement a class for fits (FcsFit)
 '''
+import json
+import os
+import re
+from collections.abc import MutableMapping
 import numpy as np
-import matplotlib.pyplot as plt
 from . import calibration
 from . import raw_functions
 
-def break_tab(field: str) -> list:
+# Matches the indentation at the start of a line
+_leading_tabs = re.compile('\t*')
+# Matches the header of an array block, giving its number of rows and columns
+_array_header = re.compile(r'\w*Array = (\d+) (\d+)')
+
+def tokenize(lines: list, array_spans: bool = False) -> list:
+    """Breaks the lines of a ConfoCor3 fcs file into fields by their indentation
+
+    ConfoCor3 fcs files are broken into fields by indentation, with a BEGIN line opening each nested block.
+    This reads the lines once, keeping a stack of the open blocks, and removes each line's indentation with a single slice.
+    Where a field holds further indented fields, it is a list of [line] or [line, subfields] items. Where it does not, it is a list of str, as break_tab always gave
+
+    Parameters
+    ----------
+    lines: list
+        The lines of the file
+    array_spans: bool
+        If True, the rows after an array header (e.g. 'CorrelationArray = 176 2') are skipped, and the header's item is [line, ArraySpan] recording where they are
+
+    Returns
+    -------
+    A list of fields
+    """
+    root = []
+    # open_blocks[depth] is the list of children for lines at that depth
+    open_blocks = [root]
+    index = 0
+    n_lines = len(lines)
+    while index < n_lines:
+        line = lines[index]
+        index += 1
+        depth = _leading_tabs.match(line).end()
+        if depth == len(open_blocks):
+            # The previous line opens a block
+            children = []
+            open_blocks[-1][-1][1] = children
+            open_blocks.append(children)
+        elif depth < len(open_blocks) - 1:
+            del open_blocks[depth + 1:]
+        node = [line[depth:], None]
+        open_blocks[depth].append(node)
+        if array_spans:
+            header = _array_header.match(line, depth)
+            if header:
+                n_rows = int(header.group(1))
+                node.append(ArraySpan(lines, index, index + n_rows, int(header.group(2))))
+                index += n_rows
+    return _as_fields(root)
+
+def _as_fields(nodes: list) -> list:
+    """Converts [line, children] and [line, None, ArraySpan] nodes from tokenize into nested field lists"""
+    if any(node[1] or len(node) > 2 for node in nodes):
+        return [[node[0], _as_fields(node[1])] if node[1] else [node[0]] + node[2:] for node in nodes]
+    return [node[0] for node in nodes]
+
+def break_tab(field: list) -> list:
     """Break a field by its tabs
     
-    ConfoCor3 fcs files are broken into fields by indentation. This is a recursive function that will break a string down by indentation level.
-    Each run, a 'field' will be broken by lines. Each time there's a further indentation level, the field will be broken into sub-fields. Anything else will be a str
+    ConfoCor3 fcs files are broken into fields by indentation. Each time there's a further indentation level, the field will be broken into sub-fields. Anything else will be a str.
+    This is kept for compatibility, and uses tokenize
     
     Parameters
     ----------
-    field: str
-        A string to be broken by indentation
+    field: list
+        A list of lines to be broken by indentation
         
     Returns
     -------
     A list of fields
     """
-    tabs = [len(x) - len(x.lstrip('\t')) for x in field]
-    if any(map(lambda x: x > 0, tabs)):
-        subfields = []
-        indented = []
-        for index, indent in enumerate(tabs):
-            if indent == 0:
-                if indented:
-                    tab_removed = [x[1:] for x in indented]
-                    subfields[-1].append(break_tab(tab_removed))
-                    indented = []
-                subfields.append([field[index]])
-            else:
-                indented.append(field[index])
-        if indented:
-            tab_removed = [x[1:] for x in indented]
-            subfields[-1].append(break_tab(tab_removed))
-        return subfields
-    else:
-        return field
+    return tokenize(field)
 
 def gen_field(field_string: str, field_dict: dict) -> None:
     """Generates a dictionary entry from a string
@@ -95,61 +141,238 @@ def create_fields(field_list: str) -> dict:
                 gen_field(item[0], fields)
     return fields
 
-def make_array(array_list: list) -> 'np.array':
+def make_array(array_list: list, n_columns: int = None) -> 'np.array':
     """Converts a list of strings into an array
     
+    The rows are joined and converted in one call to np.fromstring, into an array sized up front from the number of rows and columns
+
     Parameters
     ----------
     array_list: list
         A list of strings where each string is a row of an array, with values, separated by tabs, convertible to floats
+    n_columns: int
+        The number of values in each row, as given in the array's header. If not given, it is counted from the first row
     
     Returns
     -------
     A numpy array with a row for each item of the original list
     """
-    out = []
-    for item in array_list:
-        item_str = item[0][:-3].split('\t')
-        item_flt = [float(x) for x in item_str]
-        out.append(item_flt)
-    return np.array(out)
-
-def average_time_series(data):
+    return parse_rows([item[0] for item in array_list], n_columns)
+
+def parse_rows(rows: list, n_columns: int = None) -> 'np.array':
+    """Converts the rows of an array block into an array with one call to np.fromstring
+
+    Parameters
+    ----------
+    rows: list
+        The lines of the array block, with values separated by tabs. Leading tabs are ignored and the last three characters of each row are not values
+    n_columns: int
+        The number of values in each row. If not given, it is counted from the first row
+
+    Returns
+    -------
+    A numpy array with a row for each row of the block
+    """
+    if n_columns is None:
+        n_columns = rows[0][:-3].strip('\t').count('\t') + 1 if rows else 0
+    if not rows:
+        return np.zeros((0, n_columns))
+    size = len(rows)*n_columns
+    values = np.fromstring('\t'.join([row[:-3] for row in rows]), sep = '\t', count = size)
+    if values.size != size:
+        raise ValueError(f'Expected {len(rows)} rows of {n_columns} values')
+    return values.reshape(len(rows), n_columns)
+
+
+class ArraySpan(object):
     """
+        The location of an array block's rows in the lines of an fcs file, so it can be parsed later
+
+        Attributes
+        ----------
+        lines : list
+            The lines of the file
+        start : int
+            The index of the first row
+        stop : int
+            The index after the last row
+        n_columns : int
+            The number of values in each row
+
+        Methods
+        -------
+        parse():
+            Returns the rows as a numpy array
     """
-    all_times = [set(rep[:,0]) for rep in data]
-    times = all_times[0]
-    for rep in all_times[1:]:
-        times = times.intersection(rep)
-    times_array = np.array(sorted(times))
-    new_times = []
-    for rep in data:
-        new_times.append(rep[np.isin(rep[:, 0], times_array), 1])
-    
-    new_times = np.array(new_times)
 
+    def __init__(self, lines: list, start: int, stop: int, n_columns: int) -> None:
+        self.lines = lines
+        self.start = start
+        self.stop = stop
+        self.n_columns = n_columns
+
+    def parse(self) -> 'np.array':
+        return parse_rows(self.lines[self.start:self.stop], self.n_columns)
+
+
+class LazyData(MutableMapping):
+    """
+        A dictionary of an entry's fields and arrays where each array is parsed from its ArraySpan the first time it is accessed
+    """
+
+    def __init__(self, data: dict) -> None:
+        self._data = data
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        if isinstance(value, ArraySpan):
+            value = value.parse()
+            self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self._data[key] = value
+
+    def __delitem__(self, key) -> None:
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f'LazyData({self._data!r})'
+
+def average_time_series(data: list, weights: 'np.array' = None, include: 'np.array' = None, rtol: float = 1e-9) -> dict:
+    """Averages repeats of a time series, e.g. the CorrelationArray of every repeat, at the times they share
+
+    When every repeat has the same times, as repeats of one measurement do, the repeats are stacked and averaged directly.
+    Otherwise the times found in every repeat are matched by a merge of the sorted times
+
+    Parameters
+    ----------
+    data: list
+        Arrays with the times as the first column and the values as the second
+    weights: numpy array
+        A weight for each repeat. Defaults to equal weights
+    include: numpy array
+        True for each repeat to average. Defaults to every repeat
+    rtol: float
+        The relative difference below which two times are the same
+
+    Returns
+    -------
+    A dictionary of the shared times, and the (weighted) mean and standard deviation of the repeats at those times
+    """
+    weights = np.ones(len(data)) if weights is None else np.asarray(weights, dtype = np.float64)
+    if include is not None:
+        include = np.asarray(include, dtype = bool)
+        data = [rep for rep, kept in zip(data, include) if kept]
+        weights = weights[include]
+    if len(data) == 0:
+        raise ValueError('No repeats to average')
+
+    times = data[0][:, 0]
+    if all(len(rep) == len(times) for rep in data) and all(np.allclose(rep[:, 0], times, rtol = rtol, atol = 0) for rep in data[1:]):
+        values = np.stack([rep[:, 1] for rep in data])
+        if np.any(np.diff(times) < 0):
+            order = np.argsort(times, kind = 'stable')
+            times, values = times[order], values[:, order]
+    else:
+        times, values = _merge_shared_times(data, rtol)
+
+    mean = np.average(values, axis = 0, weights = weights)
     return {
-        'time': times_array,
-        'mean': np.mean(new_times, axis = 0),
-        'stddev': np.std(new_times, axis = 0)
+        'time': times,
+        'mean': mean,
+        'stddev': np.sqrt(np.average((values - mean)**2, axis = 0, weights = weights))
     }
 
+def _merge_shared_times(data: list, rtol: float) -> tuple:
+    """The times found in every repeat, and a repeats x times array of each repeat's values at them"""
+    sorted_reps = [rep[np.argsort(rep[:, 0], kind = 'stable')] for rep in data]
+    times = sorted_reps[0][:, 0]
+    positions = [np.arange(len(times))]
+    for rep in sorted_reps[1:]:
+        rep_times = rep[:, 0] if len(rep) else np.full(1, np.nan)
+        # The nearest time in this repeat to each remaining shared time
+        right = np.minimum(np.searchsorted(rep_times, times), len(rep_times) - 1)
+        left = np.maximum(right - 1, 0)
+        nearest = np.where(np.abs(rep_times[left] - times) < np.abs(rep_times[right] - times), left, right)
+        matched = np.abs(rep_times[nearest] - times) <= rtol*np.abs(times)
+        times = times[matched]
+        positions = [position[matched] for position in positions] + [nearest[matched]]
+    values = np.array([rep[position, 1] for rep, position in zip(sorted_reps, positions)])
+    return times, values
+
+def read_fcs_header(path: str) -> dict:
+    """Reads the top level fields of a ConfoCor3 fcs file and counts its entries, without parsing the entries
+
+    Parameters
+    ----------
+    path: str
+        The path leading to the fcs file
+
+    Returns
+    -------
+    A dictionary of the Name, Comment, Average Flags and Sort Order, as in Confocor3FCS.info, and the number of repeats (the entries other than the average)
+    """
+    fields = {}
+    n_entries = 0
+    with open(path, 'r') as f:
+        if f.readline() != 'Carl Zeiss ConfoCor3 - measurement data file - version 3.0 ANSI\n':
+            raise ValueError(f'{path} is not a ConfoCor3 fcs file')
+        for line in f:
+            # Top level fields and entries are indented by one tab, everything within an entry by more
+            if line[:1] != '\t' or line[1:2] == '\t':
+                continue
+            if line.startswith('\tBEGIN'):
+                n_entries += 1
+            elif n_entries == 0 and '=' in line:
+                # Split at the first '=', as values may be empty (e.g. 'Comment = ') or contain '='
+                key, _, value = line.partition('=')
+                fields[key.strip()] = value.strip()
+    return {
+        'Name': fields.get('Name'),
+        'Comment': fields.get('Comment'),
+        'Average Flags': fields.get('AverageFlags', '').split('|'),
+        'Sort Order': fields.get('SortOrder', '').split('-'),
+        'repeats': max(n_entries - 1, 0)
+    }
+
+# The layout version of snapshots saved by Confocor3FCS.save_snapshot
+snapshot_version = 1
+
 numeric_parameters = ['UnitFactor', 'Precision', 'Minimum', 'Maximum', 'StartValue', 'LinkIndex', 'ResultValid', 'Result', 'StandardDeviation']
 
 class FcsData(object):
-    def __init__(self, entry: list) -> None:
-        entry_data_dict = create_fields(entry)
+    def __init__(self, entry: list, lazy: bool = False) -> None:
+        fields = []
+        arrays = {}
         labels = []
 
-        for index, item in enumerate(entry):
-            if len(item) == 1:
+        index = 0
+        while index < len(entry):
+            item = entry[index]
+            index += 1
+            if len(item) == 2 and isinstance(item[1], ArraySpan):
+                # tokenize has already skipped over the rows. Lazy arrays are parsed when first accessed, through LazyData
+                label = item[0].split(' ')[0]
+                arrays[label] = item[1] if lazy else item[1].parse()
+                labels.append(label[:-5])
+            elif len(item) == 1:
                 label = item[0].split(' ')[0]
                 if label[-5:] == 'Array':
-                    array_length = int(item[0].split(' ')[-2])
-                    array_list = entry[index+1:index+1+array_length]
-                    array = make_array(array_list)
-                    entry_data_dict[label] = array
+                    # The header gives the number of rows and columns, e.g. 'CorrelationArray = 176 2'
+                    array_length, n_columns = [int(x) for x in item[0].split(' ')[-2:]]
+                    # The rows follow the header, and are skipped over rather than checked as fields
+                    arrays[label] = make_array(entry[index:index+array_length], n_columns)
+                    index += array_length
                     labels.append(label[:-5])
+                else:
+                    fields.append(item)
             else:
                 if item[0][:17] == 'BEGIN Acquisition':
                     entry_acquisition_dict = create_fields(item[1][0][1])
@@ -157,9 +380,9 @@ class FcsData(object):
                 elif item[0][:9] == 'BEGIN Fit':
                     entry_fit_dict = create_fields(item[1][0][1])
                     parameters_dict = {}
-                    for entry in item[1][0][1]:
-                        if entry[0][:15] == 'BEGIN Parameter':
-                            listified = [[x] for x in entry[1]]
+                    for fit_item in item[1][0][1]:
+                        if fit_item[0][:15] == 'BEGIN Parameter':
+                            listified = [[x] for x in fit_item[1]]
                             parameter = create_fields(listified)
                             parameters_dict[parameter['Identifier']] = parameter
                     for id, par in parameters_dict.items():
@@ -168,11 +391,23 @@ class FcsData(object):
                                 parameters_dict[id][numeric] = float(parameters_dict[id][numeric])
                     entry_fit_dict['Parameters'] = parameters_dict
         
-        self.data = entry_data_dict
+        entry_data_dict = create_fields(fields)
+        entry_data_dict.update(arrays)
+        self.data = LazyData(entry_data_dict) if lazy else entry_data_dict
         self.datalabels = labels
         self.acquisition = entry_acquisition_dict
         self.fit = entry_fit_dict
     
+    @classmethod
+    def from_parts(cls, data: dict, datalabels: list, acquisition: dict, fit: dict) -> 'FcsData':
+        """Creates an FcsData from already parsed values, e.g. from a snapshot"""
+        fcs_data = cls.__new__(cls)
+        fcs_data.data = data
+        fcs_data.datalabels = datalabels
+        fcs_data.acquisition = acquisition
+        fcs_data.fit = fit
+        return fcs_data
+
     def get_fit_parameters(self):
         if self.fit['Parameters']:
             return dict([(x, y['Result']) for x,y in self.fit['Parameters'].items()])
@@ -185,6 +420,8 @@ class FcsData(object):
     ]
 
     def plot(self, axis = None, plot_type = 'CorrelationArray', **kwargs):
+        # pyplot is slow to import, so it is only imported when something is plotted
+        import matplotlib.pyplot as plt
         if plot_type in self.premade_plots:
             if plot_type == 'ACF':
                 fig, ax = plt.subplots(nrows=2, figsize = [8,6], gridspec_kw={'height_ratios': [3,1]})
@@ -203,7 +440,22 @@ class FcsData(object):
             axis.plot(plot_data[:,0], plot_data[:,1], **kwargs)
 
     def link_raw(self, path: str) -> None:
-        self.raw = raw_functions.RawFile(path)
+        """Links the raw file of this repeat. It is only opened when raw is first used
+
+        Parameters
+        ----------
+        path: str
+            The path leading to the raw file
+        """
+        self.raw_path = path
+        self._raw = None
+
+    @property
+    def raw(self) -> 'raw_functions.RawConfoCor3':
+        """The linked raw file, or None if no raw file is linked"""
+        if getattr(self, '_raw', None) is None and getattr(self, 'raw_path', None) is not None:
+            self._raw = raw_functions.RawConfoCor3(self.raw_path)
+        return getattr(self, '_raw', None)
 
 
 
@@ -211,10 +463,24 @@ class FcsFit(object):
     pass
 
 class Confocor3FCS(object):
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, lazy: bool = False, snapshot: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        path: str
+            The path leading to the fcs file to read in
+        lazy: bool
+            If True, each array (e.g. CorrelationArray) is only parsed when it is first accessed from FcsData.data, so reading the fits alone is fast
+        snapshot: bool
+            If True, the file is loaded from its binary snapshot (see save_snapshot) when the snapshot is up to date with the file.
+            Otherwise the file is parsed and a new snapshot is saved
+        """
+        self.path = path
+        if snapshot and self.load_snapshot():
+            return
         with open(path, 'r') as f:
             data_in = f.readlines()
-        tab_broken = break_tab(data_in)
+        tab_broken = tokenize(data_in, array_spans = True)
         if tab_broken[0] == ['Carl Zeiss ConfoCor3 - measurement data file - version 3.0 ANSI\n']:
             data = tab_broken[1][1]
             top_level_fields = create_fields(data)
@@ -229,17 +495,103 @@ class Confocor3FCS(object):
             entries = [x[1][0][1] for x in data if x[0][:5] == 'BEGIN']
 
             self.data = {}
-            self.average = FcsData(entries[-1])
+            self.average = FcsData(entries[-1], lazy)
 
             for entry_no, entry in enumerate(entries[:-1]):
-                self.data['Repeat ' + str(entry_no+1)] = FcsData(entry)
+                self.data['Repeat ' + str(entry_no+1)] = FcsData(entry, lazy)
             
-            self.fits = dict([(entry_id, entry.get_fit_parameters()) for entry_id, entry in self.data.items()])
-            self.fits['Average'] = self.average.get_fit_parameters()
-            self.confocal_volume = None
+            self._set_fits()
+            if snapshot:
+                self.save_snapshot()
             
         else:
             print('Not a Confocor3 FCS file')
+
+    def _set_fits(self) -> None:
+        self.fits = dict([(entry_id, entry.get_fit_parameters()) for entry_id, entry in self.data.items()])
+        self.fits['Average'] = self.average.get_fit_parameters()
+        self.confocal_volume = None
+
+    def save_snapshot(self, snapshot_path: str = None) -> None:
+        """Saves the parsed file as a binary snapshot
+
+        The snapshot is a directory holding every array of every entry back to back in one arrays.npy file, and the fields, acquisition and fit values in metadata.json.
+        The size and modification time of the fcs file are recorded, so a snapshot of a file that has since changed is not used
+
+        Parameters
+        ----------
+        snapshot_path: str
+            The directory to save the snapshot in. Defaults to the fcs file's path with .snapshot added
+        """
+        snapshot_path = snapshot_path or self.path + '.snapshot'
+        os.makedirs(snapshot_path, exist_ok = True)
+        source = os.stat(self.path)
+        metadata = {
+            'version': snapshot_version,
+            'source': {'size': source.st_size, 'mtime_ns': source.st_mtime_ns},
+            'info': self.info,
+            'entries': []
+        }
+        arrays = []
+        offset = 0
+        for entry_id, entry in list(self.data.items()) + [('Average', self.average)]:
+            fields = {}
+            array_layout = {}
+            for key, value in entry.data.items():
+                if isinstance(value, np.ndarray):
+                    array_layout[key] = [offset, *value.shape]
+                    arrays.append(np.ascontiguousarray(value, dtype = np.float64).ravel())
+                    offset += value.size
+                else:
+                    fields[key] = value
+            metadata['entries'].append({
+                'id': entry_id,
+                'fields': fields,
+                'arrays': array_layout,
+                'datalabels': entry.datalabels,
+                'acquisition': entry.acquisition,
+                'fit': entry.fit
+            })
+        np.save(os.path.join(snapshot_path, 'arrays.npy'), np.concatenate(arrays) if arrays else np.zeros(0))
+        # The metadata is written last, so a snapshot that was interrupted is never read
+        with open(os.path.join(snapshot_path, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f)
+
+    def load_snapshot(self, snapshot_path: str = None, mmap: bool = True) -> bool:
+        """Loads the parsed file from a binary snapshot made by save_snapshot
+
+        Parameters
+        ----------
+        snapshot_path: str
+            The directory of the snapshot. Defaults to the fcs file's path with .snapshot added
+        mmap: bool
+            If True, the arrays are read-only views of the memory mapped snapshot, and only read from disk when used
+
+        Returns
+        -------
+        True if the snapshot was loaded, or False if there is no snapshot or the fcs file has changed since it was saved
+        """
+        snapshot_path = snapshot_path or self.path + '.snapshot'
+        try:
+            with open(os.path.join(snapshot_path, 'metadata.json')) as f:
+                metadata = json.load(f)
+            source = os.stat(self.path)
+        except (OSError, ValueError):
+            return False
+        if metadata.get('version') != snapshot_version or metadata['source'] != {'size': source.st_size, 'mtime_ns': source.st_mtime_ns}:
+            return False
+        arrays = np.load(os.path.join(snapshot_path, 'arrays.npy'), mmap_mode = 'r' if mmap else None)
+        entries = {}
+        for entry in metadata['entries']:
+            data = dict(entry['fields'])
+            for key, (offset, *shape) in entry['arrays'].items():
+                data[key] = arrays[offset:offset + int(np.prod(shape))].reshape(shape)
+            entries[entry['id']] = FcsData.from_parts(data, entry['datalabels'], entry['acquisition'], entry['fit'])
+        self.info = metadata['info']
+        self.average = entries.pop('Average')
+        self.data = entries
+        self._set_fits()
+        return True
     
     def link_raw(self, repeat: str, path: str) -> None:
         self.data[repeat].link_raw(path)
@@ -289,7 +641,7 @@ class Confocor3FCS(object):
             for entry_id, diff_co in self.diffusion_coefficients.items():
                 if type(diff_co) == dict:
                     self.hydrodynamic_radii[entry_id] = dict([(x, calibration.calc_hydrodynamic_radius(y, viscosity, temperature)) for x,y in diff_co.items()])
-                elif type(diff_co) == float:
+                elif isinstance(diff_co, (float, np.floating)):
                     self.hydrodynamic_radii[entry_id] = calibration.calc_hydrodynamic_radius(diff_co, viscosity, temperature)
                 else:
                     self.hydrodynamic_radii[entry_id] = 'No model fit'
@@ -300,6 +652,7 @@ class Confocor3FCS(object):
 
     def plot_all_repeats(self, plot_type):
         # Add ability to omit some repeats, maybe even by filter e.g. max(rep['CorrelationArray'][:,1]) < x
+        import matplotlib.pyplot as plt
         if plot_type in self.premade_plots:
             if plot_type == 'ACF':
                 fig, ax = plt.subplots(nrows = 2, figsize = [8,6], gridspec_kw={'height_ratios': [3,1]}, dpi = 600)
@@ -323,22 +676,83 @@ class Confocor3FCS(object):
             pass
 
 class Experiment(object):
-    def __init__(self, calibration):
+    """
+        A collection of Confocor3FCS traces, with a columnar table of every repeat
+
+        ...
+
+        Attributes
+        ----------
+        calibration : Confocor3FCS
+            The measurement of the calibration species
+        data : dict
+            The traces, by name
+        runs : dict
+            The sample, condition, viscosity and temperature of each trace, by name
+        units : str
+            The units of calibrated concentrations, a key of calibration.conc_units
+        table : dict
+            One numpy array per column, with one row per repeat of every trace. See build_table
+
+        Methods
+        -------
+        add_run(trace, trace_name=None, sample=None, condition=None, viscosity=calibration.mu_water, temperature=297.15):
+            Adds a trace
+        calibrate_by(calibration_label):
+            Calibrates the confocal volume from the calibration trace
+        build_table():
+            Builds the table of every repeat
+        select(include=None, **equals):
+            Returns the rows of the table that are included and match column values
+        group_stats(columns, by=('sample', 'condition'), include=None):
+            Returns the mean and standard deviation of columns within groups of rows
+        get_average_parameters(parameters, by=('sample', 'condition'), include=None):
+            Returns the mean and standard deviation of fit parameters for each group
+        multiplot(rows, col, plot_type='CorrelationArray', include=None):
+            Plots every repeat in a grid of groups
+    """
+
+    # The columns identifying each row
+    index_columns = ['trace', 'repeat', 'sample', 'condition']
+
+    def __init__(self, calibration, units: str = 'nM'):
         self.calibration = calibration
         self.data = dict()
+        self.runs = dict()
+        self.units = units
+        self.calibration_label = None
         self._trace_count = 1
-        if type(calibration.confocal_volume) == float:
+        self._table = None
+        if isinstance(calibration.confocal_volume, (float, np.floating)):
             self.confocal_volume = calibration.confocal_volume
             self.confocal_widths = calibration.confocal_widths
 
-    def add_run(self, trace, **kwargs):
+    def add_run(self, trace, trace_name: str = None, sample: str = None, condition: str = None, viscosity: float = calibration.mu_water, temperature: float = 297.15) -> None:
+        """Adds a trace
+
+        Parameters
+        ----------
+        trace: Confocor3FCS
+            The trace to add
+        trace_name: str
+            The name of the trace. Defaults to 'trace' and a count
+        sample: str
+            The sample measured, for grouping
+        condition: str
+            The condition measured, for grouping
+        viscosity: float
+            The viscosity of the solvent
+        temperature: float
+            The temperature of the measurement in kelvin
+        """
         # Add check for trace class being appropriate
-        if 'trace_name' in kwargs:
-            self.data[kwargs.trace_name] = trace
-        else:
-            self.data['trace'+str(self._trace_count)] = trace
+        if trace_name is None:
+            trace_name = 'trace' + str(self._trace_count)
+        self.data[trace_name] = trace
+        self.runs[trace_name] = {'sample': sample, 'condition': condition, 'viscosity': viscosity, 'temperature': temperature}
         self._trace_count += 1
-    
+        self._table = None
+
     def calibrate_by(self, calibration_label):
         self.confocal_volume = calibration.calibrate_fcs(
             self.calibration.average.fit['Parameters']['Translation diffusion time species 1']['Result'],
@@ -350,11 +764,213 @@ class Experiment(object):
             calibration.given_d[calibration_label],
             self.calibration.average.fit['Parameters']['Translation structural parameter']['Result']
         )
-        # Add calibration of traces
-    
-    def multiplot(self, rows: str, col: str, plot_type: str = 'ACF', **kwargs):
-        pass
-
-    def get_average_parameters(self, parameters):
-        pass
-
+        self.calibration_label = calibration_label
+        self._table = None
+
+    @property
+    def table(self) -> dict:
+        if self._table is None:
+            self._table = self.build_table()
+        return self._table
+
+    def build_table(self) -> dict:
+        """Builds the table of every repeat of every trace
+
+        The columns are
+            trace, repeat, sample, condition, viscosity and temperature
+            each fit parameter's Result, by its Identifier
+            each acquisition field, prefixed by 'Acquisition ', as numbers where possible
+            G0 and max_G, the first and largest values of the CorrelationArray, and mean_count_rate, the mean of the CountRateArray
+            concentration, diffusion_coefficient and hydrodynamic_radius, once the experiment is calibrated (see calibrate_by)
+        Missing numbers are NaN, and missing text is None
+
+        Returns
+        -------
+        A dictionary of numpy arrays, one per column
+        """
+        rows = []
+        for trace_name, trace in self.data.items():
+            for repeat, entry in trace.data.items():
+                row = {'trace': trace_name, 'repeat': repeat}
+                row.update(self.runs[trace_name])
+                if isinstance(entry.fit, dict):
+                    for identifier, parameter in entry.fit.get('Parameters', {}).items():
+                        row[identifier] = parameter.get('Result')
+                for field, value in _flatten(entry.acquisition).items():
+                    row['Acquisition ' + field] = _as_number(value)
+                if 'CorrelationArray' in entry.data and len(entry.data['CorrelationArray']):
+                    row['G0'] = entry.data['CorrelationArray'][0, 1]
+                    row['max_G'] = entry.data['CorrelationArray'][:, 1].max()
+                if 'CountRateArray' in entry.data and len(entry.data['CountRateArray']):
+                    row['mean_count_rate'] = entry.data['CountRateArray'][:, 1].mean()
+                rows.append(row)
+
+        columns = []
+        for row in rows:
+            columns.extend(key for key in row if key not in columns)
+        table = dict([(column, _as_column([row.get(column) for row in rows])) for column in columns])
+
+        if self.calibration_label is not None and len(rows) and 'Number of molecules' in table and 'Translation diffusion time species 1' in table:
+            calibration_fit = self.calibration.average.fit['Parameters']
+            calibrated = calibration.calibrate_arrays(
+                table['Number of molecules'],
+                table['Translation diffusion time species 1'],
+                calibration_fit['Translation diffusion time species 1']['Result'],
+                calibration_fit['Translation structural parameter']['Result'],
+                self.calibration_label,
+                self.units,
+                table['viscosity'],
+                table['temperature']
+            )
+            for column in ['concentration', 'diffusion_coefficient', 'hydrodynamic_radius']:
+                table[column] = np.broadcast_to(calibrated[column], (len(rows),)).copy()
+        return table
+
+    def select(self, include: 'np.array' = None, **equals) -> dict:
+        """Returns the rows of the table that are included and match column values
+
+        e.g. experiment.select(experiment.table['max_G'] < 1.5, sample = 'A')
+
+        Parameters
+        ----------
+        include: numpy array
+            True for each row to keep. Defaults to every row
+        equals
+            Values that columns must equal
+
+        Returns
+        -------
+        A dictionary of numpy arrays, one per column, of the matching rows
+        """
+        keep = self._include(include, equals)
+        return dict([(column, values[keep]) for column, values in self.table.items()])
+
+    def _include(self, include: 'np.array', equals: dict) -> 'np.array':
+        n_rows = len(self.table['trace']) if self.table else 0
+        keep = np.ones(n_rows, dtype = bool) if include is None else np.asarray(include, dtype = bool).copy()
+        for column, value in equals.items():
+            keep &= self.table[column] == value
+        return keep
+
+    def group_stats(self, columns: list, by: tuple = ('sample', 'condition'), include: 'np.array' = None) -> dict:
+        """Returns the mean and standard deviation of columns within groups of rows
+
+        NaN values, e.g. parameters a repeat was not fitted with, are left out of their group
+
+        Parameters
+        ----------
+        columns: list
+            The numeric columns to summarise
+        by: tuple
+            The columns whose values define the groups
+        include: numpy array
+            True for each row to include
+
+        Returns
+        -------
+        A dictionary with
+            groups: a list of tuples of the values of the by columns for each group
+            count, mean and std: dictionaries by column of an array with a value for each group
+        """
+        keep = self._include(include, {})
+        if by:
+            # Each row's group is its unique combination of codes for the values of the by columns
+            by_values = [self.table[column][keep] for column in by]
+            codes = np.stack([np.unique(values.astype(str) if values.dtype == object else values, return_inverse = True)[1].reshape(-1) for values in by_values], axis = 1)
+            _, first, inverse = np.unique(codes, axis = 0, return_index = True, return_inverse = True)
+            inverse = inverse.reshape(-1)
+            groups = [tuple(values[index] for values in by_values) for index in first]
+        else:
+            inverse = np.zeros(int(keep.sum()), dtype = np.int64)
+            groups = [()]
+        stats = {'groups': groups, 'count': {}, 'mean': {}, 'std': {}}
+        for column in columns:
+            values = self.table[column][keep].astype(np.float64)
+            valid = ~np.isnan(values)
+            count = np.bincount(inverse[valid], minlength = len(groups))
+            total = np.bincount(inverse[valid], weights = values[valid], minlength = len(groups))
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                mean = total/count
+                squares = np.bincount(inverse[valid], weights = (values[valid] - mean[inverse[valid]])**2, minlength = len(groups))
+                std = np.sqrt(squares/(count - 1))
+            stats['count'][column] = count
+            stats['mean'][column] = mean
+            stats['std'][column] = std
+        return stats
+
+    def get_average_parameters(self, parameters: list, by: tuple = ('sample', 'condition'), include: 'np.array' = None) -> dict:
+        """Returns the mean and standard deviation of fit parameters (or any numeric columns) for each group
+
+        Parameters
+        ----------
+        parameters: list
+            The columns to average, e.g. ['Number of molecules', 'concentration']
+        by: tuple
+            The columns whose values define the groups
+        include: numpy array
+            True for each row to include
+
+        Returns
+        -------
+        A dictionary by group of dictionaries by parameter of (mean, standard deviation) tuples
+        """
+        stats = self.group_stats(parameters, by, include)
+        return dict([(group, dict([(parameter, (stats['mean'][parameter][index], stats['std'][parameter][index])) for parameter in parameters])) for index, group in enumerate(stats['groups'])])
+
+    def multiplot(self, rows: str, col: str, plot_type: str = 'CorrelationArray', include: 'np.array' = None, **kwargs):
+        """Plots every repeat in a grid, with one row of axes per value of the rows column and one column of axes per value of the col column
+
+        Parameters
+        ----------
+        rows: str
+            The table column whose values give the rows of axes, e.g. 'sample'
+        col: str
+            The table column whose values give the columns of axes, e.g. 'condition'
+        plot_type: str
+            The array to plot, as in FcsData.plot
+        include: numpy array
+            True for each row of the table to plot
+        kwargs
+            Passed to FcsData.plot
+        """
+        import matplotlib.pyplot as plt
+        selected = self.select(include)
+        row_values = list(dict.fromkeys(selected[rows]))
+        col_values = list(dict.fromkeys(selected[col]))
+        fig, ax = plt.subplots(nrows = len(row_values), ncols = len(col_values), figsize = [4*len(col_values), 3*len(row_values)], squeeze = False, sharex = True, sharey = True)
+        for trace_name, repeat, row_value, col_value in zip(selected['trace'], selected['repeat'], selected[rows], selected[col]):
+            axis = ax[row_values.index(row_value), col_values.index(col_value)]
+            self.data[trace_name].data[repeat].plot(axis = axis, plot_type = plot_type, **kwargs)
+        for row_index, row_value in enumerate(row_values):
+            ax[row_index, 0].set_ylabel(str(row_value))
+        for col_index, col_value in enumerate(col_values):
+            ax[0, col_index].set_title(str(col_value))
+            if plot_type == 'CorrelationArray':
+                ax[0, col_index].set_xscale('log')
+        plt.tight_layout()
+        return fig, ax
+
+def _flatten(fields: dict, prefix: str = '') -> dict:
+    """Flattens nested dictionaries of fields, joining their keys with spaces"""
+    flat = {}
+    for key, value in fields.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + ' '))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+def _as_number(value):
+    """Converts a field to a float if it is a number, otherwise leaves it as it is"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+def _as_column(values: list) -> 'np.array':
+    """Makes a column of the table: a float array if every value is a number or missing, otherwise an object array"""
+    if all(value is None or (isinstance(value, (int, float, np.number)) and not isinstance(value, bool)) for value in values):
+        return np.array([np.nan if value is None else value for value in values], dtype = np.float64)
+    column = np.empty(len(values), dtype = object)
+    column[:] = values
+    return column
@@ -0,0 +1,536 @@
+"""Fitting
+Fitting models from the models module to many autocorrelation functions at once
+
+fit_curves fits a stack of curves with one Levenberg-Marquardt loop, where every step evaluates the model for all the curves still being fitted in one vectorized call.
+Large stacks are split between processes.
+global_fit fits a stack with some parameters, e.g. the diffusion time, shared by every curve.
+refit_fcs starts each fit from the values and bounds of the fit stored by Zen in the fcs file
+
+Values:
+    - min_curves_per_worker
+    - zen_identifiers
+Functions:
+    - fit_curves
+    - stack_curves
+    - fit_fcs
+    - global_fit
+    - global_fit_fcs
+    - model_parameters
+    - zen_starting_values
+    - refit_fcs
+"""
+import inspect
+import multiprocessing
+import os
+import pickle
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable
+import numpy as np
+from . import fcs_objects
+
+# fit_curves only starts another process for at least this many curves
+min_curves_per_worker = 32
+
+# The Identifier of the Zen fit parameter matching each parameter of the models
+zen_identifiers = {
+    'n': 'Number of molecules',
+    'triplet_frac': 'Triplet state fraction',
+    'triplet_time': 'Triplet state relaxation time',
+    't_d': 'Translation diffusion time species 1',
+    't_d1': 'Translation diffusion time species 1',
+    't_d2': 'Translation diffusion time species 2',
+    'f1': 'Translation fraction species 1'
+}
+
+def fit_curves(model: Callable, t: 'np.array', curves: 'np.array', p0: 'np.array', bounds: tuple = (-np.inf, np.inf), sigma: 'np.array' = None, absolute_sigma: bool = False, jacobian: Callable = None, max_iterations: int = 200, tolerance: float = 1e-10, max_workers: int = None) -> dict:
+    """Fits a model to every curve in a stack
+
+    Each curve is fitted separately by least squares, as scipy.optimize.curve_fit would, but the model is evaluated for the whole stack at once.
+    Parameters are passed to the model as (curves, 1) columns, so any model written with numpy operations, like those in the models module, is vectorized.
+    A curve containing NaN or inf, or whose model or derivatives are not finite, is not fitted: its parameters are NaN and it has not converged
+
+    Parameters
+    ----------
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    t: numpy array
+        The time delays shared by every curve
+    curves: numpy array
+        A curves x time delays array of the data to fit
+    p0: numpy array
+        The starting parameters, either shared (parameters) or for each curve (curves x parameters)
+    bounds: tuple
+        The lower and upper bounds of the parameters, as scalars, parameters or curves x parameters arrays
+    sigma: numpy array
+        The uncertainty of each point, as time delays or curves x time delays, e.g. from RawConfoCor3.make_acf with segments
+    absolute_sigma: bool
+        If False, the covariances are scaled by the reduced chi squared of each fit, as in curve_fit
+    jacobian: function
+        jacobian(t, *parameters) giving the curves x time delays x parameters derivatives of the model. If not given, forward differences are used
+    max_iterations: int
+        The largest number of iterations for each curve
+    tolerance: float
+        The relative change in chi squared or parameters below which a fit has converged
+    max_workers: int
+        The largest number of processes to split the curves between. Defaults to the number of CPUs
+
+    Returns
+    -------
+    A dictionary with
+        parameters: a curves x parameters array of the fitted parameters
+        covariance: a curves x parameters x parameters array of their covariances
+        stderr: a curves x parameters array of their standard errors
+        chi2: the weighted sum of squared residuals of each fit
+        converged: whether each fit converged
+        iterations: the number of iterations of each fit
+    """
+    t = np.asarray(t, dtype = np.float64)
+    curves = np.atleast_2d(np.asarray(curves, dtype = np.float64))
+    n_curves = curves.shape[0]
+    p0 = np.broadcast_to(np.asarray(p0, dtype = np.float64), (n_curves, np.shape(p0)[-1])).copy()
+    lower = np.broadcast_to(np.asarray(bounds[0], dtype = np.float64), p0.shape)
+    upper = np.broadcast_to(np.asarray(bounds[1], dtype = np.float64), p0.shape)
+    weights = np.ones_like(curves) if sigma is None else np.broadcast_to(1/np.asarray(sigma, dtype = np.float64), curves.shape)
+
+    max_workers = min(max_workers or os.cpu_count() or 1, n_curves//min_curves_per_worker)
+    if max_workers > 1 and _picklable(model) and _picklable(jacobian):
+        blocks = np.array_split(np.arange(n_curves), max_workers)
+        # Workers are spawned rather than forked, as a fork of a process that has run a parallel kernel can hang on exit
+        with ProcessPoolExecutor(max_workers = max_workers, mp_context = multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_fit_block, model, jacobian, t, curves[block], weights[block], p0[block], lower[block], upper[block], absolute_sigma, max_iterations, tolerance) for block in blocks]
+            results = [future.result() for future in futures]
+        return dict([(key, np.concatenate([result[key] for result in results])) for key in results[0]])
+    return _fit_block(model, jacobian, t, curves, weights, p0, lower, upper, absolute_sigma, max_iterations, tolerance)
+
+def _picklable(value) -> bool:
+    try:
+        pickle.dumps(value)
+    except Exception:
+        return False
+    return True
+
+def _fit_block(model, jacobian, t, curves, weights, params, lower, upper, absolute_sigma, max_iterations, tolerance) -> dict:
+    """Fits every curve in a block with a vectorized Levenberg-Marquardt loop"""
+    n_curves, n_params = params.shape
+    params = np.clip(params, lower, upper)
+
+    def residuals(rows, p):
+        return _residuals(model, t, curves[rows], weights[rows], p)
+
+    def residual_jacobian(rows, p, r):
+        return _residual_jacobian(model, jacobian, t, curves[rows], weights[rows], upper[rows], p, r)
+
+    r = residuals(np.arange(n_curves), params)
+    chi2 = np.sum(r**2, axis = 1)
+    damping = np.full(n_curves, 1e-3)
+    # Curves with non-finite data, weights or starting values, or whose model or derivatives become non-finite, cannot be fitted.
+    # They are left out of every step, so they do not stop the linear algebra for the rest of the block
+    invalid = ~np.isfinite(chi2)
+    converged = chi2 == 0
+    failed = invalid.copy()
+    iterations = np.zeros(n_curves, dtype = np.int64)
+
+    for iteration in range(max_iterations):
+        active = np.flatnonzero(~(converged | failed))
+        if len(active) == 0:
+            break
+        derivatives = residual_jacobian(active, params[active], r[active])
+        finite = np.all(np.isfinite(derivatives), axis = (1, 2))
+        if not np.all(finite):
+            invalid[active[~finite]] = True
+            failed[active[~finite]] = True
+            active, derivatives = active[finite], derivatives[finite]
+            if len(active) == 0:
+                break
+        p = params[active]
+        jtj = np.einsum('clp,clq->cpq', derivatives, derivatives)
+        gradient = np.einsum('clp,cl->cp', derivatives, r[active])
+        # Marquardt's scaling: damp each parameter by its own curvature
+        curvature = np.maximum(np.diagonal(jtj, axis1 = 1, axis2 = 2), 1e-300)
+        damped = jtj + np.einsum('cp,pq->cpq', damping[active, np.newaxis]*curvature, np.eye(n_params))
+        step = -_solve(damped, gradient)
+        trial = np.clip(p + step, lower[active], upper[active])
+        trial_r = residuals(active, trial)
+        trial_chi2 = np.sum(trial_r**2, axis = 1)
+
+        better = trial_chi2 < chi2[active]
+        improved = active[better]
+        small_gain = (chi2[improved] - trial_chi2[better]) <= tolerance*chi2[improved]
+        params[improved] = trial[better]
+        r[improved] = trial_r[better]
+        chi2[improved] = trial_chi2[better]
+        damping[improved] = np.maximum(damping[improved]/10, 1e-12)
+        damping[active[~better]] *= 10
+        iterations[active] += 1
+
+        small_step = np.all(np.abs(trial - p) <= tolerance*(np.abs(p) + tolerance), axis = 1)
+        converged[improved[small_gain]] = True
+        converged[active[small_step]] = True
+        failed[active[~converged[active] & (damping[active] > 1e16)]] = True
+
+    valid = np.flatnonzero(~invalid)
+    derivatives = residual_jacobian(valid, params[valid], r[valid])
+    finite = np.all(np.isfinite(derivatives), axis = (1, 2))
+    invalid[valid[~finite]] = True
+    covariance = np.full((n_curves, n_params, n_params), np.nan)
+    covariance[valid[finite]] = np.linalg.pinv(np.einsum('clp,clq->cpq', derivatives[finite], derivatives[finite]))
+    params[invalid] = np.nan
+    chi2[invalid] = np.nan
+    converged[invalid] = False
+    if not absolute_sigma:
+        dof = max(curves.shape[1] - n_params, 1)
+        covariance = covariance*(chi2/dof)[:, np.newaxis, np.newaxis]
+    return {
+        'parameters': params,
+        'covariance': covariance,
+        'stderr': np.sqrt(np.abs(np.diagonal(covariance, axis1 = 1, axis2 = 2))),
+        'chi2': chi2,
+        'converged': converged,
+        'iterations': iterations
+    }
+
+def _residuals(model, t, curves, weights, params) -> 'np.array':
+    """The weighted residuals of every curve, with the model evaluated for all of them at once"""
+    return (model(t, *params.T[:, :, np.newaxis]) - curves)*weights
+
+def _residual_jacobian(model, jacobian, t, curves, weights, upper, params, r) -> 'np.array':
+    """The curves x time delays x parameters derivatives of the weighted residuals"""
+    if jacobian is not None:
+        return jacobian(t, *params.T[:, :, np.newaxis])*weights[:, :, np.newaxis]
+    # Forward differences, stepping away from any bound the parameter is on
+    steps = np.sqrt(np.finfo(np.float64).eps)*np.where(params != 0, np.abs(params), 1.0)
+    steps = np.where(params + steps > upper, -steps, steps)
+    derivatives = np.empty(r.shape + (params.shape[1],))
+    for index in range(params.shape[1]):
+        stepped = params.copy()
+        stepped[:, index] += steps[:, index]
+        derivatives[:, :, index] = (_residuals(model, t, curves, weights, stepped) - r)/steps[:, index, np.newaxis]
+    return derivatives
+
+def _solve(matrices: 'np.array', vectors: 'np.array') -> 'np.array':
+    """Solves a stack of linear systems, falling back to pseudo-inverses if any are singular"""
+    try:
+        return np.linalg.solve(matrices, vectors[:, :, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('cpq,cq->cp', np.linalg.pinv(matrices), vectors)
+
+def stack_curves(entries: dict, label: str = 'CorrelationArray') -> tuple:
+    """Stacks one array from many FcsData entries into a curves x time delays array
+
+    Every entry must share the same time delays, as repeats of one Zen measurement do
+
+    Parameters
+    ----------
+    entries: dict
+        FcsData objects, e.g. Confocor3FCS.data
+    label: str
+        The array to stack
+
+    Returns
+    -------
+    A tuple of the time delays, the stacked curves and the ids of the entries
+    """
+    ids = list(entries.keys())
+    arrays = [entries[entry_id].data[label] for entry_id in ids]
+    t = arrays[0][:, 0]
+    for entry_id, array in zip(ids, arrays):
+        if array.shape[0] != len(t) or not np.allclose(array[:, 0], t):
+            raise ValueError(f'{entry_id} does not share the time delays of {ids[0]}')
+    return t, np.stack([array[:, 1] for array in arrays]), ids
+
+def fit_fcs(fcs: 'fcs_objects.Confocor3FCS', model: Callable, p0: 'np.array', label: str = 'CorrelationArray', **kwargs) -> dict:
+    """Fits a model to every repeat of a Confocor3FCS
+
+    Parameters
+    ----------
+    fcs: Confocor3FCS
+        The file to fit
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    p0: numpy array
+        The starting parameters
+    label: str
+        The array to fit
+    kwargs
+        Passed to fit_curves
+
+    Returns
+    -------
+    The dictionary from fit_curves, with the ids of the repeats
+    """
+    t, curves, ids = stack_curves(fcs.data, label)
+    result = fit_curves(model, t, curves, p0, **kwargs)
+    result['ids'] = ids
+    return result
+
+def global_fit(model: Callable, t: 'np.array', curves: 'np.array', p0: 'np.array', shared: list, bounds: tuple = (-np.inf, np.inf), sigma: 'np.array' = None, absolute_sigma: bool = False, jacobian: Callable = None, max_iterations: int = 200, tolerance: float = 1e-10) -> dict:
+    """Fits a model to every curve in a stack at once, with some parameters shared by every curve
+
+    The Jacobian of a global fit is sparse: each curve depends on its own local parameters and the shared ones.
+    Each step solves the block normal equations by eliminating the local parameters curve by curve (a Schur complement), so the cost grows linearly with the number of curves
+
+    Parameters
+    ----------
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    t: numpy array
+        The time delays shared by every curve
+    curves: numpy array
+        A curves x time delays array of the data to fit, e.g. every repeat of a Confocor3FCS
+    p0: numpy array
+        The starting parameters, either shared (parameters) or for each curve (curves x parameters). Shared parameters start from their median
+    shared: list
+        The indices of the parameters shared by every curve, e.g. [3] for the diffusion time of one_component
+    bounds: tuple
+        The lower and upper bounds of the parameters, as scalars, parameters or curves x parameters arrays
+    sigma: numpy array
+        The uncertainty of each point, as time delays or curves x time delays
+    absolute_sigma: bool
+        If False, the covariances are scaled by the reduced chi squared of the fit
+    jacobian: function
+        jacobian(t, *parameters) giving the curves x time delays x parameters derivatives of the model. If not given, forward differences are used
+    max_iterations: int
+        The largest number of iterations
+    tolerance: float
+        The relative change in chi squared or parameters below which the fit has converged
+
+    Returns
+    -------
+    A dictionary with
+        parameters: a curves x parameters array of the fitted parameters, with the shared parameters repeated for every curve
+        stderr: a curves x parameters array of their standard errors
+        shared_covariance: the covariance of the shared parameters
+        local_covariance: a curves x local parameters x local parameters array of the covariances of each curve's own parameters
+        chi2: the weighted sum of squared residuals of the whole fit
+        curve_chi2: the weighted sum of squared residuals of each curve
+        converged: whether the fit converged
+        iterations: the number of iterations
+    """
+    t = np.asarray(t, dtype = np.float64)
+    curves = np.atleast_2d(np.asarray(curves, dtype = np.float64))
+    n_curves, n_times = curves.shape
+    params = np.broadcast_to(np.asarray(p0, dtype = np.float64), (n_curves, np.shape(p0)[-1])).copy()
+    n_params = params.shape[1]
+    lower = np.broadcast_to(np.asarray(bounds[0], dtype = np.float64), params.shape)
+    upper = np.broadcast_to(np.asarray(bounds[1], dtype = np.float64), params.shape)
+    weights = np.ones_like(curves) if sigma is None else np.broadcast_to(1/np.asarray(sigma, dtype = np.float64), curves.shape)
+    shared = np.unique(np.asarray(shared, dtype = np.int64))
+    local = np.setdiff1d(np.arange(n_params), shared)
+    params[:, shared] = np.median(params[:, shared], axis = 0)
+    params = np.clip(params, lower, upper)
+
+    def normal_equations(params, r):
+        derivatives = _residual_jacobian(model, jacobian, t, curves, weights, upper, params, r)
+        local_derivatives = derivatives[:, :, local]
+        shared_derivatives = derivatives[:, :, shared]
+        return (
+            np.einsum('clp,clq->cpq', local_derivatives, local_derivatives),
+            np.einsum('clp,clq->cpq', local_derivatives, shared_derivatives),
+            np.einsum('clp,clq->pq', shared_derivatives, shared_derivatives),
+            np.einsum('clp,cl->cp', local_derivatives, r),
+            np.einsum('clp,cl->p', shared_derivatives, r)
+        )
+
+    r = _residuals(model, t, curves, weights, params)
+    chi2 = np.sum(r**2)
+    damping = 1e-3
+    converged = chi2 == 0
+    iterations = 0
+
+    while not converged and iterations < max_iterations and damping <= 1e16:
+        local_jtj, cross_jtj, shared_jtj, local_gradient, shared_gradient = normal_equations(params, r)
+        # Marquardt's scaling: damp each parameter by its own curvature
+        local_damped = local_jtj + damping*np.einsum('cp,pq->cpq', np.maximum(np.diagonal(local_jtj, axis1 = 1, axis2 = 2), 1e-300), np.eye(len(local)))
+        shared_damped = shared_jtj + damping*np.diag(np.maximum(np.diagonal(shared_jtj), 1e-300))
+        local_step, shared_step = _block_step(local_damped, cross_jtj, shared_damped, local_gradient, shared_gradient)
+        trial = params.copy()
+        trial[:, local] += local_step
+        trial[:, shared] += shared_step
+        trial = np.clip(trial, lower, upper)
+        trial_r = _residuals(model, t, curves, weights, trial)
+        trial_chi2 = np.sum(trial_r**2)
+        iterations += 1
+
+        small_step = np.all(np.abs(trial - params) <= tolerance*(np.abs(params) + tolerance))
+        if trial_chi2 < chi2:
+            converged = (chi2 - trial_chi2) <= tolerance*chi2
+            params, r, chi2 = trial, trial_r, trial_chi2
+            damping = max(damping/10, 1e-12)
+        else:
+            damping *= 10
+        converged = converged or small_step
+
+    # The shared and local blocks of the inverse of the undamped normal equations
+    local_jtj, cross_jtj, shared_jtj, _, _ = normal_equations(params, r)
+    local_inverse = np.linalg.pinv(local_jtj)
+    local_cross = np.einsum('cpq,cqs->cps', local_inverse, cross_jtj)
+    shared_covariance = np.linalg.pinv(shared_jtj - np.einsum('cps,cpt->st', cross_jtj, local_cross))
+    local_covariance = local_inverse + np.einsum('cps,st,cqt->cpq', local_cross, shared_covariance, local_cross)
+    if not absolute_sigma:
+        dof = max(n_curves*(n_times - len(local)) - len(shared), 1)
+        shared_covariance = shared_covariance*chi2/dof
+        local_covariance = local_covariance*chi2/dof
+    stderr = np.empty_like(params)
+    stderr[:, local] = np.sqrt(np.abs(np.diagonal(local_covariance, axis1 = 1, axis2 = 2)))
+    stderr[:, shared] = np.sqrt(np.abs(np.diagonal(shared_covariance)))
+    return {
+        'parameters': params,
+        'stderr': stderr,
+        'shared_covariance': shared_covariance,
+        'local_covariance': local_covariance,
+        'chi2': chi2,
+        'curve_chi2': np.sum(r**2, axis = 1),
+        'converged': converged,
+        'iterations': iterations
+    }
+
+def _block_step(local_jtj: 'np.array', cross_jtj: 'np.array', shared_jtj: 'np.array', local_gradient: 'np.array', shared_gradient: 'np.array') -> tuple:
+    """Solves the block normal equations of a global fit for the local and shared steps
+
+    The local parameters of each curve are eliminated first, leaving a small system in the shared parameters (the Schur complement)
+    """
+    local_cross = _solve_many(local_jtj, cross_jtj)
+    local_solution = _solve(local_jtj, local_gradient)
+    reduced = shared_jtj - np.einsum('cps,cpt->st', cross_jtj, local_cross)
+    reduced_gradient = shared_gradient - np.einsum('cps,cp->s', cross_jtj, local_solution)
+    shared_step = -_solve(reduced[np.newaxis], reduced_gradient[np.newaxis])[0]
+    local_step = -local_solution - np.einsum('cps,s->cp', local_cross, shared_step)
+    return local_step, shared_step
+
+def _solve_many(matrices: 'np.array', right: 'np.array') -> 'np.array':
+    """Solves a stack of linear systems with several right hand sides each"""
+    try:
+        return np.linalg.solve(matrices, right)
+    except np.linalg.LinAlgError:
+        return np.einsum('cpq,cqs->cps', np.linalg.pinv(matrices), right)
+
+def _fcs_entries(sources) -> dict:
+    """Collects the FcsData entries of a Confocor3FCS, an Experiment, or a list of Confocor3FCS"""
+    if isinstance(sources, fcs_objects.Confocor3FCS):
+        return sources.data
+    traces = sources.data if isinstance(sources, fcs_objects.Experiment) else dict(enumerate(sources))
+    entries = dict()
+    for name, trace in traces.items():
+        for entry_id, entry in trace.data.items():
+            entries[(name, entry_id)] = entry
+    return entries
+
+def global_fit_fcs(sources, model: Callable, p0: 'np.array', shared: list, label: str = 'CorrelationArray', **kwargs) -> dict:
+    """Fits a model to every repeat of one or more files at once, with some parameters shared by every repeat
+
+    Parameters
+    ----------
+    sources: Confocor3FCS, Experiment or list
+        The repeats to fit: those of a Confocor3FCS, of every trace in an Experiment, or of a list of Confocor3FCS
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    p0: numpy array
+        The starting parameters
+    shared: list
+        The indices of the parameters shared by every repeat
+    label: str
+        The array to fit
+    kwargs
+        Passed to global_fit
+
+    Returns
+    -------
+    The dictionary from global_fit, with the ids of the repeats. Repeats of several files are identified by (trace, repeat) tuples
+    """
+    t, curves, ids = stack_curves(_fcs_entries(sources), label)
+    result = global_fit(model, t, curves, p0, shared, **kwargs)
+    result['ids'] = ids
+    return result
+
+def model_parameters(model: Callable) -> list:
+    """Returns the names of the fitted parameters of a model, e.g. ['n', 'triplet_frac', 'triplet_time', 't_d'] for one_component_model"""
+    function = model.func if isinstance(model, partial) else model
+    fixed = model.keywords if isinstance(model, partial) else {}
+    names = list(inspect.signature(function).parameters)[1:]
+    return [name for name in names if name not in fixed and name != 'jacobian']
+
+def zen_starting_values(entries: list, model: Callable, p0: 'np.array', bounds: tuple = (-np.inf, np.inf), identifiers: dict = zen_identifiers) -> tuple:
+    """Starting values and bounds for fitting a model to each entry, from the fits stored by Zen
+
+    Each parameter starts from Zen's Result when it is valid, otherwise from its StartValue, and is bounded by Zen's Minimum and Maximum.
+    Where an entry has no stored value, the median of the other entries is used, then p0 and bounds
+
+    Parameters
+    ----------
+    entries: list
+        FcsData objects
+    model: function
+        The model to be fitted, e.g. from models.one_component_model
+    p0: numpy array
+        The starting parameters used where no entry has a stored value
+    bounds: tuple
+        The bounds used where no entry has a stored value
+    identifiers: dict
+        The Zen Identifier of each model parameter name
+
+    Returns
+    -------
+    A tuple of entries x parameters arrays of the starting values, lower bounds and upper bounds
+    """
+    names = model_parameters(model)
+    stored = np.full((3, len(entries), len(names)), np.nan)
+    for row, entry in enumerate(entries):
+        fit = getattr(entry, 'fit', None)
+        zen_parameters = fit.get('Parameters', {}) if isinstance(fit, dict) else {}
+        for column, name in enumerate(names):
+            parameter = zen_parameters.get(identifiers.get(name))
+            if parameter is None:
+                continue
+            if parameter.get('ResultValid', 1) and 'Result' in parameter:
+                stored[0, row, column] = parameter['Result']
+            else:
+                stored[0, row, column] = parameter.get('StartValue', np.nan)
+            stored[1, row, column] = parameter.get('Minimum', np.nan)
+            stored[2, row, column] = parameter.get('Maximum', np.nan)
+    defaults = [np.asarray(p0, dtype = np.float64), np.asarray(bounds[0], dtype = np.float64), np.asarray(bounds[1], dtype = np.float64)]
+    for values, default in zip(stored, defaults):
+        # Entries without a stored value take the ensemble median, and parameters no entry has take the default
+        missing = np.isnan(values)
+        with warnings.catch_warnings():
+            # Columns with no stored values give NaN medians, which are replaced by the default
+            warnings.simplefilter('ignore', RuntimeWarning)
+            medians = np.nanmedian(values, axis = 0)
+        fallback = np.where(np.isnan(medians), np.broadcast_to(default, medians.shape), medians)
+        values[missing] = np.broadcast_to(fallback, values.shape)[missing]
+    starting, lower, upper = stored
+    return np.clip(starting, lower, upper), lower, upper
+
+def refit_fcs(fcs: 'fcs_objects.Confocor3FCS', model: Callable, p0: 'np.array', bounds: tuple = (-np.inf, np.inf), identifiers: dict = zen_identifiers, label: str = 'CorrelationArray', **kwargs) -> dict:
+    """Refits every repeat of a Confocor3FCS, starting from the fits stored by Zen
+
+    Starting close to the solution within Zen's bounds cuts the iterations and failed fits of large batches, see zen_starting_values
+
+    Parameters
+    ----------
+    fcs: Confocor3FCS
+        The file to fit
+    model: function
+        model(t, *parameters), e.g. from models.one_component_model
+    p0: numpy array
+        The starting parameters used where no repeat has a stored value
+    bounds: tuple
+        The bounds used where no repeat has a stored value
+    identifiers: dict
+        The Zen Identifier of each model parameter name
+    label: str
+        The array to fit
+    kwargs
+        Passed to fit_curves
+
+    Returns
+    -------
+    The dictionary from fit_curves, with the ids of the repeats and the starting values used (p0)
+    """
+    t, curves, ids = stack_curves(fcs.data, label)
+    starting, lower, upper = zen_starting_values([fcs.data[entry_id] for entry_id in ids], model, p0, bounds, identifiers)
+    result = fit_curves(model, t, curves, starting, bounds = (lower, upper), **kwargs)
+    result['ids'] = ids
+    result['p0'] = starting
+    return result
@@ -0,0 +1,280 @@
+"""Indexer
+Indexing directories of ConfoCor3 files, pairing each repeat in an fcs file with its raw file
+
+Only the 128 byte header of each raw file and the top level fields of each fcs file are read.
+The index is saved as JSON in the directory and updated incrementally: files are only read again when their size or modification time changes
+
+Raw files are paired with the fcs file in the same directory whose name starts their own, as in Zen's default names (e.g. 'run.fcs' and 'run_R1_P1_K1_Ch1.raw').
+Within an fcs file, raw files are sorted in the fcs file's Sort Order (e.g. by repeat, then channel, taken from the '_Ch1' of the name), then by measurement position,
+kinetic index, repetition number, channel and name, and paired with the repeats in order.
+An fcs file is only paired when it has as many raw files as repeats, as otherwise which repeat each file belongs to is unknown
+
+Classes:
+    - DirectoryIndex
+Values:
+    - index_file_name
+    - index_version
+    - sort_fields
+Functions:
+    - index_directory
+    - raw_channel
+"""
+import json
+import os
+import re
+from . import fcs_objects, raw_functions
+
+# The name of the index file saved in an indexed directory
+index_file_name = '.fcs_index.json'
+
+# The layout version of saved indexes. Indexes of other versions are rebuilt
+index_version = 1
+
+# The raw file value sorted by for each name in an fcs file's Sort Order
+sort_fields = {
+    'FcsPosition': 'measurement_pos',
+    'FcsKinetic': 'kinetic_index',
+    'FcsRepeat': 'repetition_number',
+    'FcsChannel': 'channel'
+}
+
+
+class DirectoryIndex(object):
+    """
+        An index of the ConfoCor3 fcs and raw files in a directory
+
+        ...
+
+        Attributes
+        ----------
+        directory : str
+            The indexed directory
+        index_path : str
+            The path of the saved index
+        recursive : bool
+            Whether subdirectories are indexed
+        raw : dict
+            The header (see raw_functions.read_raw_header) of each raw file, by path relative to directory
+        fcs : dict
+            The top level fields (see fcs_objects.read_fcs_header) of each fcs file, by relative path
+        pairs : dict
+            The relative path of the raw file of each repeat (e.g. 'Repeat 1'), by fcs file
+        unpaired : list
+            The raw files not paired with any repeat, including those of fcs files with more or fewer raw files than repeats
+        errors : dict
+            The error from each file that could not be read, by relative path
+
+        Methods
+        -------
+        update():
+            Reads new and changed files, forgets deleted ones, pairs the files and saves the index
+        save():
+            Saves the index
+        raw_path(fcs_path, repeat):
+            Returns the path of the raw file paired with a repeat
+        load_fcs(fcs_path, lazy=True):
+            Reads an fcs file with each repeat linked to its raw file
+    """
+
+    def __init__(self, directory: str, index_path: str = None, recursive: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory to index
+        index_path: str
+            Where to save the index. Defaults to index_file_name in the directory
+        recursive: bool
+            Whether to index subdirectories
+        """
+        self.directory = os.path.abspath(directory)
+        self.index_path = index_path or os.path.join(self.directory, index_file_name)
+        self.recursive = recursive
+        self.raw = {}
+        self.fcs = {}
+        self.pairs = {}
+        self._stats = {}
+        self.unpaired = []
+        self.errors = {}
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('version') != index_version:
+            return
+        self.raw = saved['raw']
+        self.fcs = saved['fcs']
+        self._stats = dict([(path, tuple(stat)) for path, stat in saved['stats'].items()])
+        self.errors = saved.get('errors', {})
+        self._pair()
+
+    def save(self) -> None:
+        """Saves the index, writing to a temporary file then renaming so readers never see a half written index"""
+        saved = {
+            'version': index_version,
+            'raw': self.raw,
+            'fcs': self.fcs,
+            'stats': self._stats,
+            'errors': self.errors
+        }
+        temporary = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(saved, f)
+        os.replace(temporary, self.index_path)
+
+    def _scan(self) -> dict:
+        """The size and modification time of every fcs and raw file, by relative path"""
+        found = {}
+        directories = [self.directory]
+        while directories:
+            for entry in os.scandir(directories.pop()):
+                if entry.is_dir(follow_symlinks = False):
+                    if self.recursive:
+                        directories.append(entry.path)
+                elif entry.name.lower().endswith(('.fcs', '.raw')):
+                    stat = entry.stat()
+                    found[os.path.relpath(entry.path, self.directory)] = (stat.st_size, stat.st_mtime_ns)
+        return found
+
+    def update(self) -> 'DirectoryIndex':
+        """Reads new and changed files, forgets deleted ones, pairs the files and saves the index
+
+        Returns
+        -------
+        The index, so DirectoryIndex(directory).update() can be chained
+        """
+        found = self._scan()
+        for path in set(self._stats) - set(found):
+            self.raw.pop(path, None)
+            self.fcs.pop(path, None)
+            self.errors.pop(path, None)
+        for path, stat in found.items():
+            if self._stats.get(path) == stat:
+                continue
+            self.raw.pop(path, None)
+            self.fcs.pop(path, None)
+            self.errors.pop(path, None)
+            full_path = os.path.join(self.directory, path)
+            try:
+                if path.lower().endswith('.raw'):
+                    header = raw_functions.read_raw_header(full_path)
+                    header['measurement_id'] = list(header['measurement_id'])
+                    self.raw[path] = header
+                else:
+                    self.fcs[path] = fcs_objects.read_fcs_header(full_path)
+            except (OSError, ValueError, UnicodeDecodeError) as error:
+                # Files that cannot be read are remembered, so they are not read again until they change
+                self.errors[path] = str(error)
+        self._stats = found
+        self._pair()
+        self.save()
+        return self
+
+    def _pair(self) -> None:
+        """Pairs each repeat of each fcs file with a raw file"""
+        by_directory = {}
+        for fcs_path in self.fcs:
+            by_directory.setdefault(os.path.dirname(fcs_path), []).append(fcs_path)
+        candidates = dict([(fcs_path, []) for fcs_path in self.fcs])
+        self.unpaired = []
+        for raw_path in self.raw:
+            name = os.path.basename(raw_path)
+            stems = [fcs_path for fcs_path in by_directory.get(os.path.dirname(raw_path), []) if name.startswith(os.path.splitext(os.path.basename(fcs_path))[0])]
+            if stems:
+                # The longest matching name, so 'run_2.fcs' rather than 'run.fcs' takes 'run_2_R1.raw'
+                candidates[max(stems, key = len)].append(raw_path)
+            else:
+                self.unpaired.append(raw_path)
+        self.pairs = {}
+        for fcs_path, raw_files in candidates.items():
+            if len(raw_files) != self.fcs[fcs_path]['repeats']:
+                self.pairs[fcs_path] = {}
+                self.unpaired.extend(raw_files)
+                continue
+            raw_files.sort(key = lambda raw_path: self._sort_key(raw_path, self.fcs[fcs_path]['Sort Order']))
+            self.pairs[fcs_path] = dict([('Repeat ' + str(number + 1), raw_path) for number, raw_path in enumerate(raw_files)])
+
+    def _sort_key(self, raw_path: str, sort_order: list) -> tuple:
+        """The order of a raw file among those of its fcs file: the fields of the Sort Order first, then the rest"""
+        values = dict(self.raw[raw_path], channel = raw_channel(raw_path))
+        fields = [sort_fields[name] for name in sort_order if name in sort_fields]
+        fields += [field for field in sort_fields.values() if field not in fields]
+        return tuple(values[field] for field in fields) + (raw_path,)
+
+    def raw_path(self, fcs_path: str, repeat: str) -> str:
+        """Returns the path of the raw file paired with a repeat
+
+        Parameters
+        ----------
+        fcs_path: str
+            The fcs file, relative to the directory
+        repeat: str
+            The repeat, e.g. 'Repeat 1'
+
+        Returns
+        -------
+        The full path of the raw file, or None if the repeat has none
+        """
+        raw_path = self.pairs.get(fcs_path, {}).get(repeat)
+        return None if raw_path is None else os.path.join(self.directory, raw_path)
+
+    def load_fcs(self, fcs_path: str, lazy: bool = True, **kwargs) -> 'fcs_objects.Confocor3FCS':
+        """Reads an fcs file with each repeat linked to its raw file. The raw files are only opened when used
+
+        Parameters
+        ----------
+        fcs_path: str
+            The fcs file, relative to the directory
+        lazy: bool
+            Passed to Confocor3FCS, so arrays are only parsed when used
+        kwargs
+            Passed to Confocor3FCS
+
+        Returns
+        -------
+        A Confocor3FCS
+        """
+        fcs = fcs_objects.Confocor3FCS(os.path.join(self.directory, fcs_path), lazy = lazy, **kwargs)
+        for repeat in fcs.data:
+            raw_path = self.raw_path(fcs_path, repeat)
+            if raw_path is not None:
+                fcs.link_raw(repeat, raw_path)
+        return fcs
+
+
+def index_directory(directory: str, index_path: str = None, recursive: bool = True) -> DirectoryIndex:
+    """Indexes a directory of ConfoCor3 files, reading only files that are new or changed since it was last indexed
+
+    Parameters
+    ----------
+    directory: str
+        The directory to index
+    index_path: str
+        Where to save the index. Defaults to index_file_name in the directory
+    recursive: bool
+        Whether to index subdirectories
+
+    Returns
+    -------
+    The updated DirectoryIndex
+    """
+    return DirectoryIndex(directory, index_path, recursive).update()
+
+def raw_channel(path: str) -> int:
+    """The detector channel of a raw file, from the '_Ch1' in Zen's default names
+
+    Parameters
+    ----------
+    path: str
+        The path of the raw file
+
+    Returns
+    -------
+    The channel number, or 0 if the name has none
+    """
+    match = re.search(r'_Ch(\d+)', os.path.basename(path), re.IGNORECASE)
+    return int(match.group(1)) if match else 0
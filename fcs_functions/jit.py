@@ -0,0 +1,114 @@
+"""JIT
+Lazily compiled numba kernels
+
+numba takes a large share of the time to import fcs_functions, so the kernels in raw_functions and models are decorated with this module's njit.
+numba is only imported, and a kernel only compiled, when the kernel is first called.
+Compiled kernels are cached on disk (numba's cache = True), so later processes load them rather than compiling again.
+warmup compiles, or loads, every kernel for its common signatures up front, e.g. as the initializer of a process pool
+
+Classes:
+    - LazyKernel
+Values:
+    - kernel_modules
+Functions:
+    - njit
+    - prange
+    - warmup
+"""
+import importlib
+from functools import update_wrapper
+from typing import Callable
+
+# The modules of fcs_functions holding kernels
+kernel_modules = ['raw_functions', 'models']
+
+_kernels = []
+
+
+class LazyKernel(object):
+    """
+        A function compiled with numba.njit when it is first called
+
+        ...
+
+        Attributes
+        ----------
+        function : function
+            The Python function to compile
+        options : dict
+            Keyword arguments for numba.njit, e.g. parallel
+        signatures : list
+            The argument types the kernel is usually called with, as numba signature strings, compiled by warmup
+
+        Methods
+        -------
+        compile():
+            Compiles the function, if it is not already, and returns the numba dispatcher
+        warmup():
+            Compiles the function for each of its signatures
+    """
+
+    def __init__(self, function: Callable, options: dict, signatures: list = None) -> None:
+        self.function = function
+        self.options = options
+        self.signatures = signatures or []
+        self._dispatcher = None
+        update_wrapper(self, function)
+        _kernels.append(self)
+
+    def compile(self) -> Callable:
+        """Compiles the function, if it is not already, and returns the numba dispatcher"""
+        if self._dispatcher is None:
+            import numba
+            # Kernels loop over prange from this module, which numba only recognises as its own prange
+            if self.function.__globals__.get('prange') is prange:
+                self.function.__globals__['prange'] = numba.prange
+            self._dispatcher = numba.njit(**self.options)(self.function)
+        return self._dispatcher
+
+    def warmup(self) -> None:
+        """Compiles the function for each of its signatures, loading them from the on-disk cache where they are already compiled"""
+        dispatcher = self.compile()
+        for signature in self.signatures:
+            dispatcher.compile(signature)
+
+    def __call__(self, *args, **kwargs):
+        return self.compile()(*args, **kwargs)
+
+
+def njit(*args, signatures: list = None, **options):
+    """Decorates a function to be compiled with numba.njit when it is first called
+
+    Used as numba.njit, either bare (@njit) or with options (@njit(parallel = True)). Kernels are cached on disk unless cache = False is given
+
+    Parameters
+    ----------
+    signatures: list
+        The argument types the kernel is usually called with, as numba signature strings, e.g. ['(float64[::1], int64[::1])'], compiled by warmup
+    options
+        Keyword arguments for numba.njit
+    """
+    options.setdefault('cache', True)
+    if args and callable(args[0]):
+        return LazyKernel(args[0], options, signatures)
+    return lambda function: LazyKernel(function, options, signatures)
+
+def prange(*args):
+    """range, standing in for numba.prange until a kernel is compiled"""
+    return range(*args)
+
+def warmup(modules: list = None) -> None:
+    """Compiles every kernel for its common signatures, so their first calls are as fast as later ones
+
+    Kernels already compiled by an earlier process are loaded from the on-disk cache. Pass as the initializer of a process pool to warm up every worker,
+    e.g. ProcessPoolExecutor(initializer = warmup)
+
+    Parameters
+    ----------
+    modules: list
+        The modules of fcs_functions whose kernels to compile. Defaults to kernel_modules
+    """
+    names = [importlib.import_module('fcs_functions.' + module).__name__ for module in (modules or kernel_modules)]
+    for kernel in _kernels:
+        if kernel.function.__module__ in names:
+            kernel.warmup()
@@ -1,27 +1,204 @@
+'''Models
+3D diffusion models with a triplet state for fitting autocorrelation functions
+
+The *_model functions take the confocal widths (and any fixed values) and return a model of t and the fitted parameters, e.g. for scipy.optimize.curve_fit.
+The models are partials of module-level functions, so they can be sent to other processes.
+The compiled_*_model functions return the same models as numba kernels, with a matching analytic Jacobian, e.g. for the jac argument of curve_fit or the jacobian argument of fitting.fit_curves
+
+Functions:
+    - one_component
+    - two_component
+    - second_component
+    - one_component_model
+    - two_component_model
+    - add_second_component
+    - compiled_one_component
+    - compiled_two_component
+    - compiled_second_component
+    - compiled_one_component_model
+    - compiled_two_component_model
+    - compiled_add_second_component
+'''
+from functools import partial
 import numpy as np
+from .jit import njit, prange
+
+def one_component(t, n, triplet_frac, triplet_time, t_d, w1, w2):
+    triplet_term = 1 + triplet_frac/(1-triplet_frac)*(np.exp(-t/triplet_time))
+    term1 = 1/n
+    term2 = 1/((1+(t/t_d))*np.sqrt((1+t/t_d*(w1/w2)**2)))
+    return 1+triplet_term*term1*term2
+
+def two_component(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2, w1, w2):
+    triplet_term = 1 + triplet_frac/(1-triplet_frac)*(np.exp(-t/triplet_time))
+    term1 = 1/n
+    term2 = f1/((1+(t/t_d1))*np.sqrt((1+t/t_d1*(w1/w2)**2)))
+    term3 = (1-f1)/((1+(t/t_d2))*np.sqrt((1+t/t_d2*(w1/w2)**2)))
+    return 1+triplet_term*term1*(term2+term3)
+
+def second_component(t, triplet_frac, triplet_time, f1, t_d2, n, t_d1, w1, w2):
+    return two_component(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2, w1, w2)
 
 def one_component_model(w1, w2):
-    def model(t, n, triplet_frac, triplet_time, t_d):
-        triplet_term = 1 + triplet_frac/(1-triplet_frac)*(np.exp(-t/triplet_time))
-        term1 = 1/n
-        term2 = 1/((1+(t/t_d))*np.sqrt((1+t/t_d*(w1/w2)**2)))
-        return 1+triplet_term*term1*term2
-    return model
+    return partial(one_component, w1 = w1, w2 = w2)
 
 def two_component_model(w1, w2):
-    def model(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2):
-        triplet_term = 1 + triplet_frac/(1-triplet_frac)*(np.exp(-t/triplet_time))
-        term1 = 1/n
-        term2 = f1/((1+(t/t_d1))*np.sqrt((1+t/t_d1*(w1/w2)**2)))
-        term3 = (1-f1)/((1+(t/t_d2))*np.sqrt((1+t/t_d2*(w1/w2)**2)))
-        return 1+triplet_term*term1*(term2+term3)
-    return model
+    return partial(two_component, w1 = w1, w2 = w2)
 
 def add_second_component(n, t_d1, w1, w2):
-    def two_component_model(t, triplet_frac, triplet_time, f1, t_d2):
-        triplet_term = 1 + triplet_frac/(1-triplet_frac)*(np.exp(-t/triplet_time))
-        term1 = 1/n
-        term2 = f1/((1+(t/t_d1))*np.sqrt((1+t/t_d1*(w1/w2)**2)))
-        term3 = (1-f1)/((1+(t/t_d2))*np.sqrt((1+t/t_d2*(w1/w2)**2)))
-        return 1+triplet_term*term1*(term2+term3)
-    return two_component_model
\ No newline at end of file
+    return partial(second_component, n = n, t_d1 = t_d1, w1 = w1, w2 = w2)
+
+def _parameter_matrix(parameters: tuple) -> tuple:
+    """Stacks parameters given as scalars (curve_fit) or (curves, 1) columns (fitting.fit_curves) into a curves x parameters array"""
+    columns = np.broadcast_arrays(*[np.asarray(parameter, dtype = np.float64) for parameter in parameters])
+    return np.stack([column.reshape(-1) for column in columns], axis = 1), columns[0].ndim == 0
+
+def _kernel_call(kernel, t, parameters, w_ratio_sq):
+    """Calls a compiled kernel, returning one curve for scalar parameters or one per row of column parameters"""
+    matrix, scalar = _parameter_matrix(parameters)
+    result = kernel(np.ascontiguousarray(t, dtype = np.float64).reshape(-1), matrix, w_ratio_sq)
+    return result[0] if scalar else result
+
+# The argument types the kernels are called with, compiled by jit.warmup
+_kernel_signatures = ['(float64[::1], float64[:, ::1], float64)']
+
+@njit(parallel = True, signatures = _kernel_signatures)
+def _one_component_kernel(t, parameters, w_ratio_sq):
+    """Evaluates one_component for every row of a curves x (n, triplet_frac, triplet_time, t_d) array"""
+    values = np.empty((parameters.shape[0], len(t)))
+    for curve in prange(parameters.shape[0]):
+        n, triplet_frac, triplet_time, t_d = parameters[curve]
+        triplet_amplitude = triplet_frac/(1-triplet_frac)
+        for index in range(len(t)):
+            x = t[index]/t_d
+            diffusion = 1/((1+x)*np.sqrt(1+x*w_ratio_sq))
+            values[curve, index] = 1+(1+triplet_amplitude*np.exp(-t[index]/triplet_time))*diffusion/n
+    return values
+
+@njit(parallel = True, signatures = _kernel_signatures)
+def _one_component_jacobian_kernel(t, parameters, w_ratio_sq):
+    """The derivatives of one_component by (n, triplet_frac, triplet_time, t_d), as a curves x time delays x parameters array"""
+    jacobian = np.empty((parameters.shape[0], len(t), 4))
+    for curve in prange(parameters.shape[0]):
+        n, triplet_frac, triplet_time, t_d = parameters[curve]
+        triplet_amplitude = triplet_frac/(1-triplet_frac)
+        for index in range(len(t)):
+            x = t[index]/t_d
+            diffusion = 1/((1+x)*np.sqrt(1+x*w_ratio_sq))
+            decay = np.exp(-t[index]/triplet_time)
+            triplet = 1+triplet_amplitude*decay
+            jacobian[curve, index, 0] = -triplet*diffusion/n**2
+            jacobian[curve, index, 1] = decay/(1-triplet_frac)**2*diffusion/n
+            jacobian[curve, index, 2] = triplet_amplitude*decay*t[index]/triplet_time**2*diffusion/n
+            jacobian[curve, index, 3] = triplet/n*diffusion*(1/(1+x)+w_ratio_sq/(2*(1+x*w_ratio_sq)))*x/t_d
+    return jacobian
+
+@njit(parallel = True, signatures = _kernel_signatures)
+def _two_component_kernel(t, parameters, w_ratio_sq):
+    """Evaluates two_component for every row of a curves x (triplet_frac, triplet_time, n, f1, t_d1, t_d2) array"""
+    values = np.empty((parameters.shape[0], len(t)))
+    for curve in prange(parameters.shape[0]):
+        triplet_frac, triplet_time, n, f1, t_d1, t_d2 = parameters[curve]
+        triplet_amplitude = triplet_frac/(1-triplet_frac)
+        for index in range(len(t)):
+            x1 = t[index]/t_d1
+            x2 = t[index]/t_d2
+            diffusion1 = 1/((1+x1)*np.sqrt(1+x1*w_ratio_sq))
+            diffusion2 = 1/((1+x2)*np.sqrt(1+x2*w_ratio_sq))
+            triplet = 1+triplet_amplitude*np.exp(-t[index]/triplet_time)
+            values[curve, index] = 1+triplet/n*(f1*diffusion1+(1-f1)*diffusion2)
+    return values
+
+@njit(parallel = True, signatures = _kernel_signatures)
+def _two_component_jacobian_kernel(t, parameters, w_ratio_sq):
+    """The derivatives of two_component by (triplet_frac, triplet_time, n, f1, t_d1, t_d2), as a curves x time delays x parameters array"""
+    jacobian = np.empty((parameters.shape[0], len(t), 6))
+    for curve in prange(parameters.shape[0]):
+        triplet_frac, triplet_time, n, f1, t_d1, t_d2 = parameters[curve]
+        triplet_amplitude = triplet_frac/(1-triplet_frac)
+        for index in range(len(t)):
+            x1 = t[index]/t_d1
+            x2 = t[index]/t_d2
+            diffusion1 = 1/((1+x1)*np.sqrt(1+x1*w_ratio_sq))
+            diffusion2 = 1/((1+x2)*np.sqrt(1+x2*w_ratio_sq))
+            diffusion = f1*diffusion1+(1-f1)*diffusion2
+            decay = np.exp(-t[index]/triplet_time)
+            triplet = 1+triplet_amplitude*decay
+            jacobian[curve, index, 0] = decay/(1-triplet_frac)**2*diffusion/n
+            jacobian[curve, index, 1] = triplet_amplitude*decay*t[index]/triplet_time**2*diffusion/n
+            jacobian[curve, index, 2] = -triplet*diffusion/n**2
+            jacobian[curve, index, 3] = triplet/n*(diffusion1-diffusion2)
+            jacobian[curve, index, 4] = triplet/n*f1*diffusion1*(1/(1+x1)+w_ratio_sq/(2*(1+x1*w_ratio_sq)))*x1/t_d1
+            jacobian[curve, index, 5] = triplet/n*(1-f1)*diffusion2*(1/(1+x2)+w_ratio_sq/(2*(1+x2*w_ratio_sq)))*x2/t_d2
+    return jacobian
+
+def compiled_one_component(t, n, triplet_frac, triplet_time, t_d, w_ratio_sq, jacobian = False):
+    """one_component as a compiled kernel, with w_ratio_sq = (w1/w2)**2. Returns the Jacobian instead of the model if jacobian is True"""
+    kernel = _one_component_jacobian_kernel if jacobian else _one_component_kernel
+    return _kernel_call(kernel, t, (n, triplet_frac, triplet_time, t_d), w_ratio_sq)
+
+def compiled_two_component(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2, w_ratio_sq, jacobian = False):
+    """two_component as a compiled kernel, with w_ratio_sq = (w1/w2)**2. Returns the Jacobian instead of the model if jacobian is True"""
+    kernel = _two_component_jacobian_kernel if jacobian else _two_component_kernel
+    return _kernel_call(kernel, t, (triplet_frac, triplet_time, n, f1, t_d1, t_d2), w_ratio_sq)
+
+def compiled_second_component(t, triplet_frac, triplet_time, f1, t_d2, n, t_d1, w_ratio_sq, jacobian = False):
+    """second_component as a compiled kernel, with w_ratio_sq = (w1/w2)**2. Returns the Jacobian instead of the model if jacobian is True"""
+    result = compiled_two_component(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2, w_ratio_sq, jacobian)
+    # Only the columns of the fitted parameters, in second_component's order
+    return result[..., [0, 1, 3, 5]] if jacobian else result
+
+def compiled_one_component_model(w1, w2):
+    """Returns the compiled one component model and its Jacobian
+
+    Parameters
+    ----------
+    w1: float
+        The lateral width of the confocal volume
+    w2: float
+        The axial width of the confocal volume
+
+    Returns
+    -------
+    A tuple of model(t, n, triplet_frac, triplet_time, t_d) and jacobian(t, n, triplet_frac, triplet_time, t_d)
+    """
+    w_ratio_sq = (w1/w2)**2
+    return partial(compiled_one_component, w_ratio_sq = w_ratio_sq), partial(compiled_one_component, w_ratio_sq = w_ratio_sq, jacobian = True)
+
+def compiled_two_component_model(w1, w2):
+    """Returns the compiled two component model and its Jacobian
+
+    Parameters
+    ----------
+    w1: float
+        The lateral width of the confocal volume
+    w2: float
+        The axial width of the confocal volume
+
+    Returns
+    -------
+    A tuple of model(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2) and jacobian(t, triplet_frac, triplet_time, n, f1, t_d1, t_d2)
+    """
+    w_ratio_sq = (w1/w2)**2
+    return partial(compiled_two_component, w_ratio_sq = w_ratio_sq), partial(compiled_two_component, w_ratio_sq = w_ratio_sq, jacobian = True)
+
+def compiled_add_second_component(n, t_d1, w1, w2):
+    """Returns the compiled second component model, with the first component fixed, and its Jacobian
+
+    Parameters
+    ----------
+    n: float
+        The number of particles, from a one component fit
+    t_d1: float
+        The diffusion time of the first component, from a one component fit
+    w1: float
+        The lateral width of the confocal volume
+    w2: float
+        The axial width of the confocal volume
+
+    Returns
+    -------
+    A tuple of model(t, triplet_frac, triplet_time, f1, t_d2) and jacobian(t, triplet_frac, triplet_time, f1, t_d2)
+    """
+    w_ratio_sq = (w1/w2)**2
+    return partial(compiled_second_component, n = n, t_d1 = t_d1, w_ratio_sq = w_ratio_sq), partial(compiled_second_component, n = n, t_d1 = t_d1, w_ratio_sq = w_ratio_sq, jacobian = True)
@@ -1,19 +1,45 @@
 """RAW functions
 Classes:
     - RawConfoCor3
+    - OnlineCorrelator
 Values:
     - zen_standard_acf
+    - raw_header_size
+    - default_chunk_size
+    - fft_interval_factor
 Functions:
+    - read_raw_header
+    - read_pulse_distances
+    - iter_detector_times
     - bin_times
+    - bin_time_chunks
     - acf
+    - acf_chunks
+    - acf_segments
+    - acf_fft
+    - binned_acf
+    - clock_ticks
+    - clock_bins
+    - bin_clock
+    - rebin_counts
+    - photon_count_histograms
+    - count_rate_array
+    - multi_tau_levels
+    - multi_tau_acf
+    - segment_edges
+    - segment_sigma
+    - follow_raw
 TODO:
-    - Add standard deviation estimation to acf function for fitting
     - Find out why Zen output does not exactly match the computed ACF
 """
 import numpy as np
 from math import ceil
+import os
 import struct
-from numba import njit
+import time
+from typing import Callable, Iterable, Iterator
+from .jit import njit, prange
+from . import cache
 
 # The x-axis values from Zen's default CountRateArray
 zen_standard_acf = np.array([2.0000000e-07, 4.0000000e-07, 6.0000000e-07, 8.0000000e-07,
@@ -61,6 +87,89 @@ zen_standard_acf = np.array([2.0000000e-07, 4.0000000e-07, 6.0000000e-07, 8.0000
        1.8874368e+00, 2.0971520e+00, 2.3068672e+00, 2.5165824e+00,
        2.7262976e+00, 2.9360128e+00, 3.1457280e+00, 3.3554432e+00])
 
+# The number of bytes before the photon data starts in a ConfoCor3 raw file
+raw_header_size = 128
+
+# The default number of pulses read at once when streaming a raw file
+default_chunk_size = 2**22
+
+# binned_acf switches to FFTs when there are more than this many intervals per log2 of the trace length
+fft_interval_factor = 10
+
+def read_raw_header(path: str) -> dict:
+    """Reads the header of a ConfoCor3 raw file without reading the photon data
+
+    Parameters
+    ----------
+    path: str
+        The path leading to the raw file
+
+    Returns
+    -------
+    A dictionary of the identifier, measurement_id, measurement_pos, kinetic_index, repetition_number and sampling_frequency
+    """
+    with open(path, 'rb') as f:
+        header = f.read(raw_header_size)
+    if len(header) < raw_header_size:
+        raise ValueError(f'{path} is too short to be a ConfoCor3 raw file')
+    # The first 64 bytes make a string of ASCII characters showing the file header
+    # The next 16 bytes are 4-byte integers. This can also be seen in the default file name
+    # The next 16 bytes are 4-byte integers encoding the measurement position, kinetic index, repetition number, and sampling frequency
+    measurement_pos, kinetic_index, repetition_number, sampling_frequency = struct.unpack_from('<4I', header, 80)
+    return {
+        'identifier': header[:64].decode('ASCII'),
+        'measurement_id': struct.unpack_from('<4i', header, 64),
+        'measurement_pos': measurement_pos,
+        'kinetic_index': kinetic_index,
+        'repetition_number': repetition_number,
+        'sampling_frequency': sampling_frequency
+    }
+
+
+def read_pulse_distances(path: str) -> 'np.array':
+    """Maps the photon data of a ConfoCor3 raw file as a numpy array
+
+    The data is not copied into memory, pages of the file are read as they are used
+
+    Parameters
+    ----------
+    path: str
+        The path leading to the raw file
+
+    Returns
+    -------
+    A read-only uint32 numpy array of the clock times between recorded pulses
+    """
+    # np.memmap cannot map zero bytes, so an empty recording gets an empty array
+    if os.path.getsize(path) <= raw_header_size:
+        return np.zeros(0, dtype = '<u4')
+    return np.memmap(path, dtype = '<u4', mode = 'r', offset = raw_header_size)
+
+
+def iter_detector_times(path: str, chunk_size: int = default_chunk_size) -> Iterator['np.array']:
+    """Yields the detector times of a ConfoCor3 raw file, chunk_size pulses at a time
+
+    Only one chunk of the file is read into memory at once. The cumulative clock time is carried between chunks
+
+    Parameters
+    ----------
+    path: str
+        The path leading to the raw file
+    chunk_size: int
+        The number of pulses in each chunk
+
+    Yields
+    ------
+    uint64 numpy arrays of the times at which each pulse occurs in the detector's clock times
+    """
+    pulse_distances = read_pulse_distances(path)
+    offset = np.uint64(0)
+    for start in range(0, len(pulse_distances), chunk_size):
+        chunk = np.cumsum(pulse_distances[start:start + chunk_size], dtype = np.uint64)
+        chunk += offset
+        offset = chunk[-1]
+        yield chunk
+
 
 class RawConfoCor3(object):
     """
@@ -70,6 +179,8 @@ class RawConfoCor3(object):
 
         Attributes
         ----------
+        path : str
+            The path the raw file was read from
         identifier : str
             The file header from the raw file
         measurement_id : list?
@@ -82,8 +193,8 @@ class RawConfoCor3(object):
             The repetition number recorded by the instrument
         sampling_frequency : int
             The sampling frequency of the instrument (in Hz)
-        pulse_distances : list
-            The raw output of the file. Each value is the clock time recorded between each pulse
+        pulse_distances : numpy array
+            The raw output of the file, memory mapped as uint32. Each value is the clock time recorded between each pulse
         detector_times : numpy array
             The times from the start of recording at which each pulse occurs in the detector's clock times
         absolute_times : numpy array
@@ -94,18 +205,32 @@ class RawConfoCor3(object):
         CountRateArray : numpy array
             Created by the bin method. An array of times (in seconds) and the count rate array for that time
         acf : numpy array
-            Created by the make_acf method. An array of time delays (in seconds) and the average autocorrelation of count rate for that delay
+            Created by the make_acf method. An array of time delays (in seconds) and the average autocorrelation of count rate for that delay.
+            If make_acf was given segments, a third row holds the standard error of the autocorrelation, for weighting fits
         PhotonCountHistogram: numpy array
             Created by the make_pch method. An array of count rate bins and the density of count rates that come under that bin
+        PhotonCountHistograms: dict
+            Created by the make_pch_series method. For each bin size, an integer array of the number of bins holding 0, 1, 2... photons
         
         Methods
         -------
-        bin(bin_size):
+        iter_times(chunk_size = default_chunk_size):
+            Yields the absolute times in chunks, without holding the whole file in memory
+        bin(bin_size, chunk_size = None):
             Add a CountRateArray attribute. This splits your absolute times into bins of width bin_size.
-        make_acf(bin_size = 2*10**-7, autocorr_times = zen_standard_acf):
+        count_photons(bin_size, keep = False):
+            Returns integer photon counts in bins of width bin_size, reusing finer counts that were kept where possible
+        clear_counts():
+            Forgets the photon counts kept by count_photons
+        make_acf(bin_size = 2*10**-7, autocorr_times = zen_standard_acf, chunk_size = None, method = 'multitau', segments = None):
             Add an acf attribute. Calculates an autocorrelation function at the time delays given in autocorr_times after binning the data with the bin_size provided
-        make_pch(bin_size = 2*10**5, pch_bins = np.arange(0,160000, 50000)):
-            
+        make_pch(bin_size = 2*10**5, pch_bins = np.arange(0,160000, 50000), chunk_size = None):
+            Add a PhotonCountHistogram attribute. Histograms the count rates after binning the data with the bin_size provided
+        make_pch_series(bin_sizes):
+            Add a PhotonCountHistograms attribute. Histograms the integer photon counts at each of several bin sizes
+        
+        Passing chunk_size to bin, make_acf or make_pch streams the file rather than loading every pulse time.
+        bin, make_acf and make_pch load their results from the on-disk cache when it is enabled, see the cache module
     """
 
     def __init__(self, path: str) -> None:
@@ -116,55 +241,160 @@ class RawConfoCor3(object):
             The path leading to the raw file to read in
         """
 
-        # The file is binary
-        with open(path, 'rb') as f:
-            bytes = f.read()
-        # The first 64 bytes make a string of ASCII characters showing the file header
-        self.identifier = bytes[:64].decode('ASCII')
-        # The next 32 bytes are 4-byte integers. This can also be seen in the default file name
-        self.measurement_id = struct.unpack_from('<4i', bytes[64:80])
-        # The next 16 bytes are 4-byte integers encoding the measurement position, kinetic index, repetition number, and sampling frequency
-        self.measurement_pos, self.kinetic_index, self.repetition_number, self.sampling_frequency = struct.unpack_from('<4I', bytes[80:96])
-        # The remaining bytes (after a 32 byte gap) are integers showing the clock times of recorded pulses
-        self.pulse_distances = [x[0] for x in struct.iter_unpack('<I', bytes[128:])]
-        # To convert from pulse_distances to detector times, take the cumulative sum.
-        self.detector_times = np.cumsum(self.pulse_distances)
-        # To convert from detector times to real times, divide by the sampling frequency (e.g. clock time 15000 at 150000 Hz is 1 second)
-        self.absolute_times = self.detector_times/self.sampling_frequency
-    
-    def bin(self, bin_size: int) -> None:
+        self.path = path
+        header = read_raw_header(path)
+        self.identifier = header['identifier']
+        self.measurement_id = header['measurement_id']
+        self.measurement_pos = header['measurement_pos']
+        self.kinetic_index = header['kinetic_index']
+        self.repetition_number = header['repetition_number']
+        self.sampling_frequency = header['sampling_frequency']
+        # The remaining bytes (after a 32 byte gap) are integers showing the clock times of recorded pulses.
+        # These are mapped straight from the file rather than read into memory
+        self.pulse_distances = read_pulse_distances(path)
+        # The times are only computed when first used, so a file can be streamed without ever holding them all
+        self._detector_times = None
+        self._absolute_times = None
+        # Photon counts kept by count_photons, keyed by bin size in clock ticks
+        self._photon_counts = {}
+
+    @property
+    def detector_times(self) -> 'np.array':
+        if self._detector_times is None:
+            # To convert from pulse_distances to detector times, take the cumulative sum. uint64 stops long traces overflowing
+            self._detector_times = np.cumsum(self.pulse_distances, dtype = np.uint64)
+        return self._detector_times
+
+    @property
+    def absolute_times(self) -> 'np.array':
+        if self._absolute_times is None:
+            # To convert from detector times to real times, divide by the sampling frequency (e.g. clock time 15000 at 150000 Hz is 1 second)
+            self._absolute_times = self.detector_times/self.sampling_frequency
+        return self._absolute_times
+
+    def iter_times(self, chunk_size: int = default_chunk_size) -> Iterator['np.array']:
+        """Yields the file's pulse times in seconds, chunk_size pulses at a time
+
+        Uses the function iter_detector_times, so only one chunk is held in memory at once
+
+        Parameters
+        ----------
+        chunk_size: int
+            The number of pulses in each chunk
+        """
+        for chunk in iter_detector_times(self.path, chunk_size):
+            yield chunk/self.sampling_frequency
+
+    def bin(self, bin_size: int, chunk_size: int = None) -> None:
         """Splits the file's detected photons into count rate
 
-        Uses the function bin_times.
+        Uses count_photons when bin_size is a whole number of clock ticks, otherwise the function bin_times, or bin_time_chunks, which bins the same way, if chunk_size is given.
         Adds a CountRateArray attribute to the object.
 
         Parameters
         ----------
         bin_size: int
             The size of bins in which to put the data, in seconds
+        chunk_size: int
+            If given, the pulse times are streamed from the file this many at a time rather than all held in memory
         """
 
-        self.CountRateArray = bin_times(self.absolute_times, bin_size)
+        def compute():
+            if chunk_size:
+                return {'CountRateArray': np.concatenate(list(bin_time_chunks(iter_detector_times(self.path, chunk_size), bin_size, self.sampling_frequency)), axis = 1)}
+            return {'CountRateArray': self._count_rates(bin_size)}
+        self.CountRateArray = self._cached('bin', {'bin_size': bin_size, 'streamed': bool(chunk_size)}, compute)['CountRateArray']
+
+    def count_photons(self, bin_size: float, keep: bool = False) -> 'np.array':
+        """Counts the file's detected photons into bins of bin_size
+
+        bin_size must be a whole number of clock ticks. A bin size that is a whole multiple of one whose counts were kept is summed from the finest such counts rather than recounted from the detector times.
+        Counts take 4 bytes a bin, e.g. 1.2 GB for 60 s in 200 ns bins, so they are only kept when asked for, until clear_counts is called
+
+        Parameters
+        ----------
+        bin_size: float
+            The size of bins in which to count the photons, in seconds
+        keep: bool
+            If True, the counts are kept on the object so later calls can reuse them
+
+        Returns
+        -------
+        An int32 numpy array of the number of photons in each complete bin
+        """
+        bin_ticks = clock_ticks(bin_size, self.sampling_frequency)
+        if bin_ticks is None:
+            raise ValueError(f'A bin size of {bin_size} s is not a whole number of clock ticks at {self.sampling_frequency} Hz')
+        if bin_ticks in self._photon_counts:
+            return self._photon_counts[bin_ticks]
+        counts = _coarsen_counts(self._photon_counts, bin_ticks)
+        if counts is None:
+            counts = bin_clock(self.detector_times, bin_ticks)
+        if keep:
+            self._photon_counts[bin_ticks] = counts
+        return counts
+
+    def clear_counts(self) -> None:
+        """Forgets the photon counts kept by count_photons"""
+        self._photon_counts = {}
+
+    def _count_rates(self, bin_size: float) -> 'np.array':
+        """Bins the file's detected photons by integer clock ticks where bin_size allows it, otherwise with bin_times"""
+        if clock_ticks(bin_size, self.sampling_frequency) is None:
+            return bin_times(self.absolute_times, bin_size)
+        return count_rate_array(self.count_photons(bin_size), bin_size)
     
-    def make_acf(self, bin_size: int = 2*10**-7, autocorr_times = zen_standard_acf) -> None:
+    def make_acf(self, bin_size: int = 2*10**-7, autocorr_times = zen_standard_acf, chunk_size: int = None, method: str = 'multitau', segments: int = None) -> None:
         """Computes an autocorrelation function from the file's pulse times
         
-        Uses the function acf.
+        Uses the function multi_tau_acf by default, or binned_acf on a count rate array for the other methods.
         Adds an acf attribute to the object
 
         Parameters
         ----------
         bin_size: int
-            The bin size to pass to bin_times. Note, this bins data separately from the CountRateArray attribute
+            The finest bin size. For the binned methods, this bins data separately from the CountRateArray attribute
         autocorr_times: numpy array
             The time delays (tau) at which to calculate the autocorrelation function. See documentation for the acf function for details
+        chunk_size: int
+            If given, the pulse times are streamed from the file this many at a time rather than all held in memory.
+            This uses an OnlineCorrelator for the multitau method, and acf_chunks otherwise
+        method: str
+            'multitau' to correlate the photon times directly, or a count rate array correlated by
+            'direct' at every interval, 'fft' with FFTs, or 'binned' to pick between direct and fft by the size of the problem
+        segments: int
+            If given, the trace is split into this many segments to estimate the standard error of the ACF, which is added as a third row of the acf attribute.
+            This uses the direct correlator for the binned methods, and cannot be used with chunk_size
         """
 
-        binned = bin_times(self.absolute_times, bin_size)
-        intervals = np.array(autocorr_times/bin_size, dtype = int)
-        self.acf = np.array([autocorr_times, acf(binned, intervals)])
+        if method not in ('multitau', 'binned', 'direct', 'fft'):
+            raise ValueError(f'Unknown ACF method {method}')
+        if segments and chunk_size:
+            raise ValueError('segments cannot be used with chunk_size')
+
+        def compute():
+            if method == 'multitau' and chunk_size:
+                correlator = OnlineCorrelator(self.sampling_frequency, autocorr_times, bin_size)
+                for start in range(0, len(self.pulse_distances), chunk_size):
+                    correlator.update(self.pulse_distances[start:start + chunk_size])
+                ac_mean = correlator.acf()[1]
+            elif method == 'multitau':
+                ac_mean = multi_tau_acf(self.detector_times, self.sampling_frequency, autocorr_times, bin_size, segments = segments)
+            else:
+                intervals = np.array(np.rint(autocorr_times/bin_size), dtype = int)
+                if chunk_size:
+                    ac_mean = acf_chunks(bin_time_chunks(iter_detector_times(self.path, chunk_size), bin_size, self.sampling_frequency), intervals)
+                elif segments:
+                    ac_mean = acf_segments(self._count_rates(bin_size), intervals, segments)
+                else:
+                    binned = self._count_rates(bin_size)
+                    ac_mean = binned_acf(binned, intervals, 'auto' if method == 'binned' else method)
+            # With segments, ac_mean is the mean and standard error, giving an array of (tau, G, sigma)
+            return {'acf': np.array([autocorr_times, *ac_mean]) if segments else np.array([autocorr_times, ac_mean])}
+        parameters = {'bin_size': bin_size, 'autocorr_times': np.asarray(autocorr_times), 'method': method, 'segments': segments, 'streamed': bool(chunk_size)}
+        self.acf = self._cached('acf', parameters, compute)['acf']
     
-    def make_pch(self, bin_size:int = 2*10**-5, pch_bins: 'np.array' = np.arange(0, 160000, 50000)) -> None:
+    def make_pch(self, bin_size:int = 2*10**-5, pch_bins: 'np.array' = np.arange(0, 160000, 50000), chunk_size: int = None) -> None:
         """Creates a photon counting histogram from the file's pulse times
 
         Adds a PhotonCountHistogram attribute to the object
@@ -175,10 +405,56 @@ class RawConfoCor3(object):
             The binning for the pulse times. Note, this is not the bins for the PCH
         pch_bins: numpy array
             The bins for the PCH
+        chunk_size: int
+            If given, the pulse times are streamed from the file this many at a time rather than all held in memory
         """
 
-        binned = bin_times(self.absolute_times, bin_size)
-        self.PhotonCountHistogram = np.histogram(binned, bins = pch_bins)
+        def compute():
+            if chunk_size:
+                binned_chunks = bin_time_chunks(iter_detector_times(self.path, chunk_size), bin_size, self.sampling_frequency)
+            else:
+                binned_chunks = [self._count_rates(bin_size)]
+            # The histogram bins are fixed, so the histograms of each chunk can be summed
+            histogram = np.zeros(len(pch_bins) - 1, dtype = np.int64)
+            for binned in binned_chunks:
+                histogram += np.histogram(binned[1], bins = pch_bins)[0]
+            return {'histogram': histogram, 'bins': np.asarray(pch_bins)}
+        pch = self._cached('pch', {'bin_size': bin_size, 'pch_bins': np.asarray(pch_bins), 'streamed': bool(chunk_size)}, compute)
+        self.PhotonCountHistogram = (pch['histogram'], pch['bins'])
+
+    def make_pch_series(self, bin_sizes: list = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4)) -> None:
+        """Creates photon counting histograms of integer photon counts for several bin sizes
+
+        The photons are counted once at the finest bin size with count_photons, then each coarser bin size is summed from a finer one with photon_count_histograms.
+        Every bin size must be a whole number of clock ticks and a multiple of the finest.
+        Adds a PhotonCountHistograms attribute to the object, keyed by each bin size as its clock ticks divided by the sampling frequency,
+        so e.g. 5*10**-6 is stored under 5e-06
+
+        Parameters
+        ----------
+        bin_sizes: list
+            The bin sizes, in seconds
+        """
+
+        bin_sizes = sorted(bin_sizes)
+        bin_ticks = [clock_ticks(bin_size, self.sampling_frequency) for bin_size in bin_sizes]
+        if None in bin_ticks:
+            raise ValueError(f'Every bin size must be a whole number of clock ticks at {self.sampling_frequency} Hz')
+        if any(ticks % bin_ticks[0] for ticks in bin_ticks):
+            raise ValueError(f'Every bin size must be a multiple of the finest, {bin_sizes[0]} s')
+
+        def compute():
+            histograms = photon_count_histograms(self.count_photons(bin_sizes[0]), [ticks//bin_ticks[0] for ticks in bin_ticks])
+            return dict([(f'histogram_{index}', histogram) for index, histogram in enumerate(histograms)])
+        stored = self._cached('pch_series', {'bin_ticks': np.array(bin_ticks)}, compute)
+        self.PhotonCountHistograms = dict([(ticks/self.sampling_frequency, stored[f'histogram_{index}']) for index, ticks in enumerate(bin_ticks)])
+
+    def _cached(self, name: str, parameters: dict, compute: Callable[[], dict]) -> dict:
+        """Uses the on-disk result cache for a computation from this file, if the cache is enabled (see the cache module)"""
+        result_cache = cache.get_cache()
+        if result_cache is None:
+            return compute()
+        return result_cache.cached(self.path, name, parameters, compute)
 
 def bin_times(time_array: 'np.array', bin_size: int) -> 'np.array':
     """Bins an array of times into the bin sizes provided
@@ -201,8 +477,102 @@ def bin_times(time_array: 'np.array', bin_size: int) -> 'np.array':
     # Return a 2-Dimensional array of the bin times and the binned data. The last bin is trimmed off as it may not be full length (this is what Zen seems to do, so I copied it)
     return np.array([bins, binned[:-1]])
 
+def bin_time_chunks(time_chunks: Iterable['np.array'], bin_size: int, sampling_frequency: int = None) -> Iterator['np.array']:
+    """Bins chunks of times into the bin sizes provided, yielding each bin once it is complete
+
+    Given detector times and their sampling_frequency, this gives the same bins as RawConfoCor3.bin without chunks: bins of a whole number of clock ticks
+    are counted by integer floor division as in bin_clock, and other bin sizes as bin_times would for the concatenated chunks. Only one chunk is held at a time.
+    Photons in the last bin are carried into the next chunk until a later photon shows the bin is complete
+
+    Parameters
+    ----------
+    time_chunks: iterable
+        Successive sorted numpy arrays of times of recorded responses from the detector, in clock ticks (e.g. from iter_detector_times) if sampling_frequency is given,
+        otherwise in seconds (e.g. from RawConfoCor3.iter_times)
+    bin_size: int
+        The size of bins into which the times should be split, in seconds
+    sampling_frequency: int
+        The sampling frequency of the detector clock (in Hz), if the chunks are in clock ticks
+
+    Yields
+    ------
+    2-Dimensional numpy arrays with the binned times and the count rates within those bins
+    """
+    bin_ticks = None if sampling_frequency is None else clock_ticks(bin_size, sampling_frequency)
+    # The index of the bin still being filled, and the number of photons already in it
+    open_bin = 0
+    carried = 0
+    for times in time_chunks:
+        if len(times) == 0:
+            continue
+        if bin_ticks is not None:
+            counts = np.bincount(np.asarray(times, dtype = np.int64)//bin_ticks - open_bin, minlength = 1)
+            # The bin times are computed as count_rate_array does
+            bins = (np.arange(open_bin, open_bin + len(counts) - 1) + 1)*bin_size
+        else:
+            if sampling_frequency is not None:
+                times = times/sampling_frequency
+            # Bin edges are computed the same way as np.arange in bin_times, so photons on an edge land in the same bin
+            last_bin = int(times[-1]//bin_size) + 1
+            edges = bin_size + np.arange(open_bin, last_bin + 1)*bin_size
+            counts = np.bincount(np.digitize(times, edges), minlength = 1)
+            bins = edges[:len(counts) - 1]
+        counts[0] += carried
+        # Every bin but the last one of this chunk is now complete
+        complete = len(counts) - 1
+        if complete:
+            yield np.array([bins, counts[:-1]/bin_size])
+        open_bin += complete
+        carried = counts[-1]
+    # The last bin is never yielded as it may not be full length, matching bin_times
+
+def acf_chunks(count_rate_chunks: Iterable['np.array'], autocorr_interval: 'np.array') -> 'np.array':
+    """Computes an autocorrelation function from successive chunks of a count rate array
+
+    Gives the same result as acf on the concatenated chunks. Only the chunk and the last max(autocorr_interval) count rates before it are held in memory
+
+    Parameters
+    ----------
+    count_rate_chunks: iterable
+        Successive count rate arrays, with the times in the first row and count rates in the second, e.g. from bin_time_chunks
+    autocorr_interval: numpy array
+        The intervals, in bins, at which to calculate the autocorrelation function
+
+    Returns
+    -------
+    A numpy array of the mean autocorrelation at those intervals
+    """
+    autocorr_interval = np.asarray(autocorr_interval, dtype = np.int64)
+    max_interval = autocorr_interval.max()
+    product_sums = np.zeros(len(autocorr_interval))
+    product_counts = np.zeros(len(autocorr_interval), dtype = np.int64)
+    intensity_sum = 0.0
+    intensity_count = 0
+    previous = np.zeros(0)
+    for chunk in count_rate_chunks:
+        intensity = chunk[1, :]
+        buffer = np.concatenate((previous, intensity))
+        _lag_product_sums(buffer, len(previous), autocorr_interval, product_sums, product_counts)
+        intensity_sum += intensity.sum()
+        intensity_count += len(intensity)
+        previous = buffer[-max_interval:]
+    mean_sq = (intensity_sum/intensity_count)**2
+    return product_sums/product_counts/mean_sq
+
+@njit(parallel = True, signatures = ['(float64[::1], int64, int64[::1], float64[::1], int64[::1])'])
+def _lag_product_sums(buffer, start, autocorr_interval, product_sums, product_counts):
+    """Adds the products of every count rate from buffer[start:] with the count rate each interval before it to product_sums"""
+    for lag in prange(len(autocorr_interval)):
+        interval = autocorr_interval[lag]
+        first = max(start, interval)
+        total = 0.0
+        for index in range(first, len(buffer)):
+            total += buffer[index - interval]*buffer[index]
+        product_sums[lag] += total
+        product_counts[lag] += max(len(buffer) - first, 0)
+
 # Calculating the ACF is **very** slow without JIT compiling and parallel processing
-@njit(parallel = True)
+@njit(parallel = True, signatures = ['(float64[:, ::1], int64[::1])'])
 def acf(count_rate_array, autocorr_interval):
     """Computes an autocorrelation function for the provided count rate array
     
@@ -226,3 +596,577 @@ def acf(count_rate_array, autocorr_interval):
 
     return ac_mean
 
+
+def acf_segments(count_rate_array: 'np.array', autocorr_interval: 'np.array', segments: int) -> tuple:
+    """Computes an autocorrelation function and its standard error for the provided count rate array
+
+    The count rates are split into segments, and the products for each segment and interval are summed in one parallel pass.
+    The mean ACF uses the sum over the segments so it is the same as acf, and the standard error comes from the spread of the segment ACFs, see segment_sigma
+
+    Parameters
+    ----------
+    count_rate_array: numpy array
+        An array of count rates with the times in the first row and count rates in the second
+    autocorr_interval: numpy array
+        The intervals, in bins, at which to calculate the autocorrelation function
+    segments: int
+        The number of segments to split the count rates into
+
+    Returns
+    -------
+    A tuple of numpy arrays of the mean autocorrelation and its standard error at those intervals
+    """
+    intensity = np.ascontiguousarray(count_rate_array[1, :], dtype = np.float64)
+    n_bins = len(intensity)
+    autocorr_interval = np.asarray(autocorr_interval, dtype = np.int64)
+    edges = segment_edges(n_bins, segments)
+    sums = _segment_lag_sums(intensity, autocorr_interval, edges)
+    ac_mean = sums.sum(axis = 0)/(n_bins - autocorr_interval)/np.mean(intensity)**2
+    segment_means = np.add.reduceat(intensity, edges[:-1])/np.diff(edges)
+    return ac_mean, segment_sigma(sums, edges, n_bins, autocorr_interval, segment_means)
+
+def acf_fft(count_rate_array: 'np.array', autocorr_interval: 'np.array') -> 'np.array':
+    """Computes an autocorrelation function for the provided count rate array using FFTs
+
+    Gives the same result as acf. The count rates are zero padded so the circular correlation from the FFT does not wrap round, then each interval is divided by the number of overlapping bins.
+    The cost does not depend on the number of intervals, so this is faster than acf for dense linear grids of intervals
+
+    Parameters
+    ----------
+    count_rate_array: numpy array
+        An array of count rates with the times in the first row and count rates in the second
+    autocorr_interval: numpy array
+        The intervals, in bins, at which to calculate the autocorrelation function
+
+    Returns
+    -------
+    A numpy array of the mean autocorrelation at those intervals
+    """
+    intensity = count_rate_array[1, :]
+    n_bins = len(intensity)
+    autocorr_interval = np.asarray(autocorr_interval, dtype = np.int64)
+    # Padding to at least n_bins + the longest interval stops the end of the trace correlating with its start
+    padded_size = 2**int(ceil(np.log2(n_bins + autocorr_interval.max())))
+    transformed = np.fft.rfft(intensity, padded_size)
+    products = np.fft.irfft(transformed*np.conj(transformed), padded_size)[autocorr_interval]
+    mean_sq = np.mean(intensity)**2
+    return products/(n_bins - autocorr_interval)/mean_sq
+
+def binned_acf(count_rate_array: 'np.array', autocorr_interval: 'np.array', method: str = 'auto') -> 'np.array':
+    """Computes an autocorrelation function for the provided count rate array
+
+    Uses acf or acf_fft. With method 'auto', acf_fft is used when the number of intervals is large compared to log2 of the trace length, where a product for every interval costs more than the FFTs
+
+    Parameters
+    ----------
+    count_rate_array: numpy array
+        An array of count rates with the times in the first row and count rates in the second
+    autocorr_interval: numpy array
+        The intervals, in bins, at which to calculate the autocorrelation function
+    method: str
+        'auto', 'direct' to use acf or 'fft' to use acf_fft
+
+    Returns
+    -------
+    A numpy array of the mean autocorrelation at those intervals
+    """
+    if method == 'auto':
+        n_bins = count_rate_array.shape[1]
+        method = 'fft' if len(autocorr_interval) > fft_interval_factor*np.log2(2*n_bins) else 'direct'
+    if method == 'fft':
+        return acf_fft(count_rate_array, autocorr_interval)
+    elif method == 'direct':
+        return acf(count_rate_array, autocorr_interval)
+    raise ValueError(f'Unknown ACF method {method}')
+
+def multi_tau_levels(autocorr_interval: 'np.array', points_per_level: int = 16) -> tuple:
+    """Assigns each autocorrelation interval to a level of a multiple tau correlator
+
+    At level l the bins are 2**l times wider than the finest bins. Intervals up to points_per_level are computed at level 0, then each interval goes to the finest level where it is at most points_per_level coarse bins.
+    For zen_standard_acf at 200 ns this gives 16 points at level 0 then 8 points per level, as Zen does
+
+    Parameters
+    ----------
+    autocorr_interval: numpy array
+        The intervals, in the finest bins, at which to calculate the autocorrelation function
+    points_per_level: int
+        The largest interval, in that level's bins, computed at each level
+
+    Returns
+    -------
+    A tuple of numpy arrays of the level of each interval and the interval in that level's bins
+    """
+    autocorr_interval = np.asarray(autocorr_interval, dtype = np.int64)
+    levels = np.maximum(np.ceil(np.log2(autocorr_interval/points_per_level)), 0).astype(np.int64)
+    level_intervals = np.rint(autocorr_interval/2.0**levels).astype(np.int64)
+    return levels, level_intervals
+
+def multi_tau_acf(detector_times: 'np.array', sampling_frequency: int, autocorr_times: 'np.array' = zen_standard_acf, bin_size: float = 2*10**-7, points_per_level: int = 16, segments: int = None):
+    """Computes an autocorrelation function directly from photon arrival times with a multiple tau correlator
+
+    The trace is never binned into a count rate array. Photons are counted into bins of bin_size, keeping only the occupied bins, then each level halves the time resolution by merging neighbouring bins.
+    The products for each interval are found by walking the occupied bins, so the cost scales with the number of photons rather than the trace length divided by bin_size.
+    As with any multiple tau correlator, long intervals are computed on coarse bins, so they are smoothed compared to acf on a count rate array
+
+    Parameters
+    ----------
+    detector_times: numpy array
+        The times from the start of recording at which each pulse occurs in the detector's clock times
+    sampling_frequency: int
+        The sampling frequency of the detector clock (in Hz)
+    autocorr_times: numpy array
+        The time delays (tau) at which to calculate the autocorrelation function. These should be multiples of bin_size
+    bin_size: float
+        The finest bin size, in seconds
+    points_per_level: int
+        See multi_tau_levels
+    segments: int
+        If given, the trace is split into this many segments and the standard error of the ACF is estimated from their spread with segment_sigma.
+        The segments are correlated in the same pass as the whole trace, whose products are the sum of the segments'
+
+    Returns
+    -------
+    A numpy array of the mean autocorrelation at autocorr_times, or a tuple of that and its standard error if segments is given
+    """
+    levels, level_intervals = multi_tau_levels(np.rint(np.asarray(autocorr_times)/bin_size), points_per_level)
+    times, weights = _merge_bins(clock_bins(detector_times, sampling_frequency, bin_size), np.ones(len(detector_times), dtype = np.int64), 1)
+    # The last bin is dropped as it may not be full length, as in bin_times
+    n_bins = times[-1]
+    times, weights = times[:-1], weights[:-1]
+    mean_count = weights.sum()/n_bins
+    edges = segment_edges(n_bins, segments or 1)
+    ac_mean = np.zeros(len(level_intervals))
+    ac_sigma = np.zeros(len(level_intervals))
+    for level in range(levels.max() + 1):
+        if level:
+            times, weights = _merge_bins(times, weights, 2)
+        at_level = np.flatnonzero(levels == level)
+        if len(at_level) == 0:
+            continue
+        level_bins = -(-n_bins//2**level)
+        level_mean = mean_count*2**level
+        level_edges = -(-edges//2**level)
+        segment_starts = np.searchsorted(times, level_edges)
+        products = _tag_products(times, weights, level_intervals[at_level], segment_starts)
+        # Intervals as long as the trace have no pairs, so they are left as NaN
+        pairs = level_bins - level_intervals[at_level]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            ac_mean[at_level] = np.where(pairs > 0, products.sum(axis = 0)/pairs/level_mean**2, np.nan)
+            if segments:
+                # Differences of cumulative sums, as np.add.reduceat gives the next bin's count for a segment with no occupied bins
+                segment_counts = np.diff(np.concatenate(([0], np.cumsum(weights)))[segment_starts])
+                segment_means = segment_counts/np.diff(level_edges)
+                ac_sigma[at_level] = segment_sigma(products, level_edges, level_bins, level_intervals[at_level], segment_means)
+    if segments:
+        return ac_mean, ac_sigma
+    return ac_mean
+
+def clock_ticks(bin_size: float, sampling_frequency: int) -> int:
+    """Converts a bin size to a whole number of detector clock ticks
+
+    Parameters
+    ----------
+    bin_size: float
+        The size of the bins, in seconds
+    sampling_frequency: int
+        The sampling frequency of the detector clock (in Hz)
+
+    Returns
+    -------
+    The number of clock ticks in a bin, or None if bin_size is not a whole number of ticks
+    """
+    bin_ticks = bin_size*sampling_frequency
+    if bin_ticks >= 0.5 and abs(bin_ticks - round(bin_ticks)) < 1e-6:
+        return int(round(bin_ticks))
+    return None
+
+def clock_bins(detector_times: 'np.array', sampling_frequency: int, bin_size: float) -> 'np.array':
+    """Finds the index of the bin of bin_size that each detector time falls into
+
+    When bin_size is a whole number of clock ticks this is an integer floor division, so there are no floating point edge errors
+
+    Parameters
+    ----------
+    detector_times: numpy array
+        The times at which each pulse occurs in the detector's clock times
+    sampling_frequency: int
+        The sampling frequency of the detector clock (in Hz)
+    bin_size: float
+        The size of the bins, in seconds
+
+    Returns
+    -------
+    An int64 numpy array of bin indices
+    """
+    bin_ticks = clock_ticks(bin_size, sampling_frequency)
+    if bin_ticks is not None:
+        return (np.asarray(detector_times, dtype = np.int64)//bin_ticks)
+    return np.floor(np.asarray(detector_times)/(bin_size*sampling_frequency)).astype(np.int64)
+
+def bin_clock(detector_times: 'np.array', bin_ticks: int) -> 'np.array':
+    """Counts detector times into bins of a whole number of clock ticks
+
+    The integer equivalent of bin_times: a floor division and np.bincount, with no bin edges and no division by the bin size
+
+    Parameters
+    ----------
+    detector_times: numpy array
+        The times at which each pulse occurs in the detector's clock times
+    bin_ticks: int
+        The size of the bins, in clock ticks
+
+    Returns
+    -------
+    An int32 numpy array of the number of photons in each bin. The last bin is trimmed off as it may not be full length, as in bin_times
+    """
+    counts = np.bincount(np.asarray(detector_times, dtype = np.int64)//bin_ticks)
+    return counts[:-1].astype(np.int32)
+
+def rebin_counts(counts: 'np.array', factor: int) -> 'np.array':
+    """Sums every factor neighbouring bins of photon counts into one coarser bin
+
+    Counting at a fine bin size then rebinning gives the same counts as bin_clock at the coarse bin size
+
+    Parameters
+    ----------
+    counts: numpy array
+        Photon counts in each bin, e.g. from bin_clock
+    factor: int
+        The number of bins to sum into each coarser bin
+
+    Returns
+    -------
+    A numpy array of the photon counts in each complete coarse bin
+    """
+    n_coarse = len(counts)//factor
+    return counts[:n_coarse*factor].reshape(n_coarse, factor).sum(axis = 1, dtype = counts.dtype)
+
+def _coarsen_counts(levels: dict, bin_size: int) -> 'np.array':
+    """Sums photon counts at bin_size from the coarsest counts in levels that it is a multiple of, or returns None if there are none"""
+    finer = [level for level in levels if bin_size % level == 0]
+    if not finer:
+        return None
+    finest = max(finer)
+    return rebin_counts(levels[finest], bin_size//finest)
+
+def photon_count_histograms(counts: 'np.array', factors: list) -> list:
+    """Creates photon counting histograms of photon counts at several bin sizes
+
+    Each bin size is summed from the coarsest finer one it is a multiple of, so the counts are only ever built up from the previous levels, never from the photon times
+
+    Parameters
+    ----------
+    counts: numpy array
+        Photon counts in each bin at the finest bin size, e.g. from bin_clock
+    factors: list
+        Increasing multiples of the finest bin size at which to histogram the counts. 1 histograms counts itself
+
+    Returns
+    -------
+    A list of int64 numpy arrays, one for each factor, of the number of bins holding 0, 1, 2... photons
+    """
+    levels = {1: counts}
+    histograms = []
+    for factor in factors:
+        if factor not in levels:
+            levels[factor] = _coarsen_counts(levels, factor)
+            # Only levels that later factors could be built from are kept
+            levels = dict((level, level_counts) for level, level_counts in levels.items() if any(later % level == 0 and later > level for later in factors) or level == factor)
+        histograms.append(np.bincount(levels[factor]).astype(np.int64))
+    return histograms
+
+def count_rate_array(counts: 'np.array', bin_size: float) -> 'np.array':
+    """Converts photon counts into a count rate array in the same layout as bin_times
+
+    Parameters
+    ----------
+    counts: numpy array
+        Photon counts in each bin, e.g. from bin_clock
+    bin_size: float
+        The size of the bins, in seconds
+
+    Returns
+    -------
+    A 2-Dimensional numpy array with the binned times and the count rates within those bins
+    """
+    return np.array([(np.arange(len(counts)) + 1)*bin_size, counts/bin_size])
+
+@njit(signatures = ['(int64[::1], int64[::1], int64)'])
+def _merge_bins(times, weights, factor):
+    """Divides sorted bin indices by factor and sums the weights of indices that become equal"""
+    merged_times = np.empty_like(times)
+    merged_weights = np.empty_like(weights)
+    last = -1
+    for index in range(len(times)):
+        time = times[index]//factor
+        if last >= 0 and merged_times[last] == time:
+            merged_weights[last] += weights[index]
+        else:
+            last += 1
+            merged_times[last] = time
+            merged_weights[last] = weights[index]
+    return merged_times[:last + 1], merged_weights[:last + 1]
+
+@njit(parallel = True, signatures = ['(int64[::1], int64[::1], int64[::1], int64[::1])'])
+def _tag_products(times, weights, intervals, segment_starts):
+    """Sums weights[i]*weights[j] over every pair of occupied bins with times[j] - times[i] equal to each interval
+
+    Pairs are summed separately for each segment of times[segment_starts[s]:segment_starts[s + 1]] holding the earlier bin, giving a segments x intervals array
+    """
+    n_segments = len(segment_starts) - 1
+    n_intervals = len(intervals)
+    products = np.zeros((n_segments, n_intervals))
+    n_times = len(times)
+    for job in prange(n_segments*n_intervals):
+        segment = job//n_intervals
+        lag = job % n_intervals
+        interval = intervals[lag]
+        partner = segment_starts[segment]
+        total = 0.0
+        for index in range(segment_starts[segment], segment_starts[segment + 1]):
+            target = times[index] + interval
+            while partner < n_times and times[partner] < target:
+                partner += 1
+            if partner == n_times:
+                break
+            if times[partner] == target:
+                total += weights[index]*weights[partner]
+        products[segment, lag] = total
+    return products
+
+@njit(parallel = True, signatures = ['(float64[::1], int64[::1], int64[::1])'])
+def _segment_lag_sums(intensity, autocorr_interval, segment_edges):
+    """Sums intensity[i]*intensity[i + interval] for each interval, separately for each segment of intensity[segment_edges[s]:segment_edges[s + 1]] holding i"""
+    n_segments = len(segment_edges) - 1
+    n_intervals = len(autocorr_interval)
+    sums = np.zeros((n_segments, n_intervals))
+    for job in prange(n_segments*n_intervals):
+        segment = job//n_intervals
+        interval = autocorr_interval[job % n_intervals]
+        end = min(segment_edges[segment + 1], len(intensity) - interval)
+        total = 0.0
+        for index in range(segment_edges[segment], end):
+            total += intensity[index]*intensity[index + interval]
+        sums[segment, job % n_intervals] = total
+    return sums
+
+def segment_edges(n_bins: int, segments: int) -> 'np.array':
+    """Splits n_bins bins into segments of (nearly) equal length
+
+    Returns
+    -------
+    An int64 numpy array of the segments + 1 bin indices bounding the segments
+    """
+    return (np.arange(segments + 1)*n_bins)//segments
+
+def segment_sigma(products: 'np.array', edges: 'np.array', n_bins: int, intervals: 'np.array', segment_means: 'np.array') -> 'np.array':
+    """Estimates the standard error of an ACF from the correlations of its segments
+
+    Each segment's ACF is its products divided by its number of pairs and its own mean squared. The standard error is the standard deviation of the segment ACFs over the square root of the number of segments (block averaging)
+
+    Parameters
+    ----------
+    products: numpy array
+        A segments x intervals array of summed products, where each segment holds the earlier bin of each pair
+    edges: numpy array
+        The bin indices bounding the segments, see segment_edges
+    n_bins: int
+        The total number of bins
+    intervals: numpy array
+        The intervals, in bins, of each column of products
+    segment_means: numpy array
+        The mean count (or count rate) in each segment
+
+    Returns
+    -------
+    A numpy array of the standard error of the ACF at each interval
+    """
+    pairs = np.minimum(edges[1:, np.newaxis], n_bins - intervals[np.newaxis, :]) - edges[:-1, np.newaxis]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        segment_acfs = products/pairs/segment_means[:, np.newaxis]**2
+    segment_acfs[(pairs <= 0) | (segment_means[:, np.newaxis] == 0)] = np.nan
+    valid = np.sum(~np.isnan(segment_acfs), axis = 0)
+    # Intervals with fewer than two usable segments have no spread to estimate from
+    sigma = np.full(len(intervals), np.nan)
+    spread = valid > 1
+    sigma[spread] = np.nanstd(segment_acfs[:, spread], axis = 0, ddof = 1)/np.sqrt(valid[spread])
+    return sigma
+
+@njit(parallel = True, signatures = ['(int64[::1], int64[::1], int64[::1], int64)'])
+def _tag_products_since(times, weights, intervals, start):
+    """Sums weights[i]*weights[j] over every pair of occupied bins with times[j] - times[i] equal to each interval and j at least start"""
+    products = np.zeros(len(intervals))
+    for lag in prange(len(intervals)):
+        interval = intervals[lag]
+        partner = 0
+        total = 0.0
+        for index in range(start, len(times)):
+            target = times[index] - interval
+            while times[partner] < target:
+                partner += 1
+            if times[partner] == target:
+                total += weights[index]*weights[partner]
+        products[lag] = total
+    return products
+
+
+class OnlineCorrelator(object):
+    """
+        A multiple tau correlator that is updated with successive blocks of pulse distances
+
+        Each level keeps only the bin still being filled and the finished bins within its longest interval, so an update costs time proportional to the block and memory does not grow with the trace.
+        The ACF can be read at any time and converges to multi_tau_acf for the same photons. The most recent, unfinished bin of each level is left out until it is finished
+
+        Attributes
+        ----------
+        sampling_frequency : int
+            The sampling frequency of the detector clock (in Hz)
+        autocorr_times : numpy array
+            The time delays (tau) at which the autocorrelation function is calculated
+        bin_size : float
+            The finest bin size, in seconds
+        n_photons : int
+            The number of photons added so far
+        
+        Methods
+        -------
+        update(pulse_distances):
+            Adds a block of pulse distances to the correlator
+        acf():
+            Returns the current time delays and autocorrelation function
+    """
+
+    def __init__(self, sampling_frequency: int, autocorr_times: 'np.array' = zen_standard_acf, bin_size: float = 2*10**-7, points_per_level: int = 16) -> None:
+        """
+        Parameters
+        ----------
+        sampling_frequency: int
+            The sampling frequency of the detector clock (in Hz)
+        autocorr_times: numpy array
+            The time delays (tau) at which to calculate the autocorrelation function. These should be multiples of bin_size
+        bin_size: float
+            The finest bin size, in seconds
+        points_per_level: int
+            See multi_tau_levels
+        """
+        self.sampling_frequency = sampling_frequency
+        self.autocorr_times = np.asarray(autocorr_times)
+        self.bin_size = bin_size
+        self.n_photons = 0
+        self._levels, self._level_intervals = multi_tau_levels(np.rint(self.autocorr_times/bin_size), points_per_level)
+        n_levels = self._levels.max() + 1
+        self._at_level = [np.flatnonzero(self._levels == level) for level in range(n_levels)]
+        self._products = np.zeros(len(self._level_intervals))
+        self._clock = 0
+        # For each level: the bin still being filled, the finished bins within the longest interval, and the finished bins and photons so far
+        self._open_bin = [None]*n_levels
+        self._tail = [(np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64)) for level in range(n_levels)]
+        self._finished_bins = np.zeros(n_levels, dtype = np.int64)
+        self._finished_photons = np.zeros(n_levels, dtype = np.int64)
+
+    def update(self, pulse_distances: 'np.array') -> None:
+        """Adds a block of pulse distances to the correlator
+
+        Parameters
+        ----------
+        pulse_distances: numpy array
+            The clock times between successive pulses, continuing from the last block
+        """
+        if len(pulse_distances) == 0:
+            return
+        detector_times = np.cumsum(pulse_distances, dtype = np.uint64) + np.uint64(self._clock)
+        self._clock = int(detector_times[-1])
+        self.n_photons += len(detector_times)
+        times, weights = _merge_bins(clock_bins(detector_times, self.sampling_frequency, self.bin_size), np.ones(len(detector_times), dtype = np.int64), 1)
+        for level in range(len(self._open_bin)):
+            if level:
+                times, weights = _merge_bins(times, weights, 2)
+            times, weights = self._finish_bins(level, times, weights)
+            if len(times) == 0:
+                break
+
+    def _finish_bins(self, level: int, times: 'np.array', weights: 'np.array') -> tuple:
+        """Adds bins to a level, correlates the ones that are now finished and returns them for the next level"""
+        open_bin = self._open_bin[level]
+        if open_bin is not None:
+            if times[0] == open_bin[0]:
+                weights = weights.copy()
+                weights[0] += open_bin[1]
+            else:
+                times = np.concatenate(([open_bin[0]], times))
+                weights = np.concatenate(([open_bin[1]], weights))
+        # The last bin may still get photons from the next block
+        self._open_bin[level] = (times[-1], weights[-1])
+        times, weights = times[:-1], weights[:-1]
+        self._finished_bins[level] = self._open_bin[level][0]
+        if len(times) == 0:
+            return times, weights
+        self._finished_photons[level] += weights.sum()
+        at_level = self._at_level[level]
+        if len(at_level):
+            tail_times, tail_weights = self._tail[level]
+            buffer_times = np.concatenate((tail_times, times))
+            buffer_weights = np.concatenate((tail_weights, weights))
+            self._products[at_level] += _tag_products_since(buffer_times, buffer_weights, self._level_intervals[at_level], len(tail_times))
+            keep = np.searchsorted(buffer_times, buffer_times[-1] - self._level_intervals[at_level].max())
+            self._tail[level] = (buffer_times[keep:], buffer_weights[keep:])
+        return times, weights
+
+    def acf(self) -> 'np.array':
+        """Returns the autocorrelation function of the photons added so far
+
+        Returns
+        -------
+        A numpy array of the time delays (in seconds) and the autocorrelation function, in the same layout as RawConfoCor3.acf
+        """
+        level_bins = self._finished_bins[self._levels]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            level_mean = self._finished_photons[self._levels]/level_bins
+            ac_mean = self._products/(level_bins - self._level_intervals)/level_mean**2
+        ac_mean[level_bins <= self._level_intervals] = np.nan
+        return np.array([self.autocorr_times, ac_mean])
+
+def follow_raw(path: str, correlator: OnlineCorrelator = None, poll_interval: float = 1.0, timeout: float = 10.0, **kwargs) -> Iterator[OnlineCorrelator]:
+    """Follows a ConfoCor3 raw file that is still being written, updating an OnlineCorrelator with each new block of pulses
+
+    Stops once the file has not grown for timeout seconds
+
+    Parameters
+    ----------
+    path: str
+        The path leading to the raw file
+    correlator: OnlineCorrelator
+        The correlator to update. If not given, one is made with the file's sampling frequency and kwargs
+    poll_interval: float
+        The time to wait between checks for new data, in seconds
+    timeout: float
+        The time without new data after which the file is taken to be finished, in seconds
+
+    Yields
+    ------
+    The correlator, each time it has been updated
+    """
+    waited = 0.0
+    while os.path.getsize(path) < raw_header_size:
+        if waited >= timeout:
+            return
+        time.sleep(poll_interval)
+        waited += poll_interval
+    if correlator is None:
+        correlator = OnlineCorrelator(read_raw_header(path)['sampling_frequency'], **kwargs)
+    with open(path, 'rb') as f:
+        f.seek(raw_header_size)
+        partial = b''
+        waited = 0.0
+        while waited < timeout:
+            block = partial + f.read()
+            # Only whole 4-byte pulse distances are used, the rest waits for the next read
+            whole = len(block) - len(block) % 4
+            partial = block[whole:]
+            if whole:
+                correlator.update(np.frombuffer(block[:whole], dtype = '<u4'))
+                waited = 0.0
+                yield correlator
+            else:
+                time.sleep(poll_interval)
+                waited += poll_interval
@@ -0,0 +1,95 @@
+"""Small ConfoCor3 files written for the tests."""
+
+
+import struct
+
+import numpy as np
+
+fcs_first_line = 'Carl Zeiss ConfoCor3 - measurement data file - version 3.0 ANSI\n'
+raw_first_line = b'Carl Zeiss ConfoCor3 - raw data file - version 3.0 ANSI'
+
+# The values fitted by Zen in every fixture entry, by identifier
+fitted_parameters = {
+    'Number of molecules': 3.0,
+    'Translation diffusion time species 1': 3.5e-5,
+    'Translation structural parameter': 5.0,
+    'Triplet state fraction': 0.1,
+    'Triplet state relaxation time': 3e-6
+}
+
+
+def fcs_entry(rng: 'np.random.Generator', tau: 'np.array', n_count_rates: int = 100) -> list:
+    """The lines of one entry of an fcs file, indented by one tab, with a noisy one component ACF"""
+    n = fitted_parameters['Number of molecules']
+    t_d = fitted_parameters['Translation diffusion time species 1']
+    structural = fitted_parameters['Translation structural parameter']
+    acf = 1 + 1/n/(1 + tau/t_d)/np.sqrt(1 + tau/t_d/structural**2)*(1 + 0.1/0.9*np.exp(-tau/3e-6)) + rng.normal(0, 0.002, len(tau))
+    lines = [
+        '\tBEGIN FcsEntry0 10000\n',
+        '\t\tBEGIN FcsDataSet 10000\n',
+        '\t\t\tChannel = Auto-correlation detector Meta1\n',
+        '\t\t\tBEGIN Acquisition 10000\n',
+        '\t\t\t\tBEGIN AcqSettings 10000\n',
+        '\t\t\t\t\tBeamPath = BP1\n',
+        '\t\t\t\t\tMeasurementTime = 10.0\n',
+        '\t\t\t\tEND\n',
+        '\t\t\tEND\n',
+        f'\t\t\tCountRateArray = {n_count_rates} 2\n'
+    ]
+    lines += [f'\t\t\t{index*0.01:.10f}\t{rate:.10f}\t \n' for index, rate in enumerate(rng.uniform(40, 60, n_count_rates))]
+    lines.append(f'\t\t\tCorrelationArray = {len(tau)} 2\n')
+    lines += [f'\t\t\t{time:.10f}\t{value:.10f}\t \n' for time, value in zip(tau, acf)]
+    lines += [
+        '\t\t\tPhotonCountHistogramArray = 0 2\n',
+        '\t\t\tBEGIN Fit 10000\n',
+        '\t\t\t\tBEGIN FitResult 10000\n',
+        '\t\t\t\t\tModelName = 3D diffusion\n'
+    ]
+    for identifier, value in fitted_parameters.items():
+        lines += [
+            '\t\t\t\t\tBEGIN Parameter 10000\n',
+            f'\t\t\t\t\t\tIdentifier = {identifier}\n',
+            f'\t\t\t\t\t\tStartValue = {value*1.1}\n',
+            f'\t\t\t\t\t\tMinimum = {value*0.01}\n',
+            f'\t\t\t\t\t\tMaximum = {value*100}\n',
+            f'\t\t\t\t\t\tResult = {value}\n',
+            '\t\t\t\t\t\tResultValid = 1\n',
+            '\t\t\t\t\tEND\n'
+        ]
+    lines += [
+        '\t\t\t\tEND\n',
+        '\t\t\tEND\n',
+        '\t\tEND\n',
+        '\tEND\n'
+    ]
+    return lines
+
+
+def write_fcs(path: str, repeats: int = 3, fields: dict = None, seed: int = 0) -> None:
+    """Writes an fcs file with an average and a number of repeats
+
+    fields replaces the top level fields, e.g. {'Comment': ''} for an empty comment
+    """
+    from fcs_functions import raw_functions
+    rng = np.random.default_rng(seed)
+    top_level = {'Name': 'test', 'Comment': 'a comment', 'AverageFlags': 'FcsRepeat|FcsChannel', 'SortOrder': 'FcsRepeat-FcsChannel'}
+    top_level.update(fields or {})
+    lines = [fcs_first_line, 'BEGIN ConfoCor3Fcs 1\n']
+    lines += [f'\t{key} = {value}\n' for key, value in top_level.items()]
+    for _ in range(repeats + 1):
+        lines += fcs_entry(rng, raw_functions.zen_standard_acf)
+    lines.append('END\n')
+    with open(path, 'w') as f:
+        f.writelines(lines)
+
+
+def write_raw(path: str, n_photons: int = 200000, mean_distance: int = 60, sampling_frequency: int = 20000000, measurement_pos: int = 7, kinetic_index: int = 0, repetition_number: int = 1, seed: int = 0) -> 'np.array':
+    """Writes a raw file of photons with geometrically distributed distances, and returns the distances"""
+    rng = np.random.default_rng(seed)
+    distances = rng.geometric(1/mean_distance, n_photons).astype('<u4')
+    header = raw_first_line.ljust(64, b' ')
+    header += struct.pack('<4i', 1, 2, 3, 4) + struct.pack('<4I', measurement_pos, kinetic_index, repetition_number, sampling_frequency)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(128, b'\0'))
+        f.write(distances.tobytes())
+    return distances
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""Tests for batch processing of raw files with `fcs_functions`."""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fcs_functions import batch, cache, raw_functions
+
+from .fixtures import write_raw
+
+acf_kwargs = {'bin_size': 1e-6, 'autocorr_times': np.arange(1, 33)*1e-6}
+pch_kwargs = {'bin_size': 2e-5, 'pch_bins': np.arange(0, 2000000, 50000)}
+
+
+class TestProcessRawFiles(unittest.TestCase):
+    """Tests for `batch.process_raw_files`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = [os.path.join(self.directory.name, f'run_R{repetition}_P1_K1_Ch1.raw') for repetition in (1, 2)]
+        for seed, path in enumerate(self.paths):
+            write_raw(path, n_photons = 20000, repetition_number = seed + 1, seed = seed)
+
+    def tearDown(self):
+        cache.disable()
+        self.directory.cleanup()
+
+    def test_matches_files_processed_one_by_one(self):
+        """Each file's row holds the results of processing it alone, and a file that fails only fails its own row."""
+        missing = os.path.join(self.directory.name, 'missing.raw')
+        stacked = batch.process_raw_files([self.paths[0], missing, self.paths[1]], acf_kwargs, pch_kwargs, max_workers = 2)
+        self.assertIsNone(stacked['errors'][0])
+        self.assertIn('FileNotFoundError', stacked['errors'][1])
+        self.assertEqual([metadata['repetition_number'] for metadata in stacked['metadata']], [1, None, 2])
+        self.assertTrue(np.all(np.isnan(stacked['acf'][1])))
+        self.assertTrue(np.all(stacked['pch'][1] == 0))
+        for row, path in ((0, self.paths[0]), (2, self.paths[1])):
+            raw = raw_functions.RawConfoCor3(path)
+            raw.make_acf(**acf_kwargs)
+            raw.make_pch(**pch_kwargs)
+            np.testing.assert_array_equal(stacked['acf'][row], raw.acf[1])
+            np.testing.assert_array_equal(stacked['pch'][row], raw.PhotonCountHistogram[0])
+        np.testing.assert_array_equal(stacked['tau'], acf_kwargs['autocorr_times'])
+
+    def test_every_file_failing(self):
+        """The arrays are returned, empty, when every file fails."""
+        stacked = batch.process_raw_files([os.path.join(self.directory.name, 'missing.raw')], max_workers = 1)
+        self.assertEqual(stacked['tau'].shape, (0,))
+        self.assertEqual(stacked['pch_bins'].shape, (0,))
+        self.assertEqual(stacked['acf'].shape, (1, 0))
+        self.assertEqual(stacked['pch'].shape, (1, 0))
+
+    def test_workers_use_cache(self):
+        """Workers store their results in the cache enabled in the calling process."""
+        cache_directory = os.path.join(self.directory.name, 'cache')
+        cache.enable(cache_directory)
+        batch.process_raw_files(self.paths, acf_kwargs, pch_kwargs, max_workers = 2)
+        self.assertEqual(len([name for name in os.listdir(cache_directory) if name.endswith('.npz')]), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""Tests for bootstrap uncertainties with `fcs_functions`."""
+
+
+import unittest
+
+import numpy as np
+
+from fcs_functions import bootstrap, calibration, models
+
+t = np.logspace(-6, 0, 120)
+model = models.one_component_model(2e-7, 1e-6)
+truth = np.array([5.0, 0.1, 5e-6, 5e-5])
+curves = model(t, *truth) + np.random.default_rng(0).normal(0, 1e-2, (10, len(t)))
+
+
+def capped_model(t: 'np.array', n: float, triplet_frac: float, triplet_time: float, t_d: float) -> 'np.array':
+    """The one component model, which is NaN for more than 5.2 molecules, so fits of resamples past it do not converge"""
+    return np.where(n > 5.2, np.nan, model(t, n, triplet_frac, triplet_time, t_d))
+
+
+class TestBootstrapFit(unittest.TestCase):
+    """Tests for `bootstrap.bootstrap_fit`."""
+
+    def test_repeats(self):
+        """Resampled repeats give a spread of samples around the fit of their mean."""
+        result = bootstrap.bootstrap_fit(model, t, curves, truth, n_resamples = 100, seed = 0, max_workers = 1)
+        self.assertEqual(result['samples'].shape, (100, 4))
+        self.assertEqual(result['used'], 100)
+        np.testing.assert_allclose(result['stderr'], np.std(result['samples'], axis = 0, ddof = 1))
+        self.assertTrue(np.all((result['interval'][0] < result['parameters'][0]) & (result['parameters'][0] < result['interval'][1])))
+
+    def test_residuals(self):
+        """Resampled residuals give samples for each curve."""
+        quiet = model(t, *truth) + np.random.default_rng(1).normal(0, 1e-3, (3, len(t)))
+        result = bootstrap.bootstrap_fit(model, t, quiet, truth, n_resamples = 20, resample = 'residuals', seed = 0, max_workers = 1)
+        self.assertEqual(result['samples'].shape, (3, 20, 4))
+        np.testing.assert_array_equal(result['used'], [20, 20, 20])
+        self.assertEqual(result['stderr'].shape, (3, 4))
+        self.assertTrue(np.all(np.isfinite(result['stderr'])))
+
+    def test_seeded(self):
+        """The same seed gives the same samples."""
+        first = bootstrap.bootstrap_fit(model, t, curves, truth, n_resamples = 10, seed = 1, max_workers = 1)
+        second = bootstrap.bootstrap_fit(model, t, curves, truth, n_resamples = 10, seed = 1, max_workers = 1)
+        np.testing.assert_array_equal(first['samples'], second['samples'])
+
+    def test_unconverged_samples(self):
+        """Samples whose fits did not converge are left out of the standard error and interval."""
+        result = bootstrap.bootstrap_fit(capped_model, t, curves, truth, n_resamples = 100, seed = 0, max_workers = 1)
+        converged = np.all(np.isfinite(result['samples']), axis = -1)
+        self.assertTrue(0 < result['used'] < 100)
+        self.assertEqual(result['used'], converged.sum())
+        self.assertAlmostEqual(result['converged'], result['used']/100)
+        np.testing.assert_allclose(result['stderr'], np.std(result['samples'][converged], axis = 0, ddof = 1))
+        np.testing.assert_allclose(result['interval'], np.percentile(result['samples'][converged], [2.5, 97.5], axis = 0))
+
+
+class TestDerivedDistributions(unittest.TestCase):
+    """Tests for `bootstrap.derived_distributions`."""
+
+    def test_calibrated_samples(self):
+        """Each sample is calibrated as the scalar calibration functions would."""
+        samples = truth*np.array([[1.0], [1.1], [0.9]])
+        widths = calibration.confocal_widths(3.5e-5, calibration.given_d['Rhodamine 6G'], 5.0)
+        volume = calibration.confocal_volume(*widths)
+        derived = bootstrap.derived_distributions(samples, model, volume, widths)
+        for index, sample in enumerate(samples):
+            diff_co = calibration.calc_coeff(widths[0], sample[3])
+            self.assertAlmostEqual(derived['concentration'][index]/calibration.calibrated_conc(sample[0], volume), 1, places = 12)
+            self.assertAlmostEqual(derived['diffusion_coefficient']['t_d'][index]/diff_co, 1, places = 12)
+            self.assertAlmostEqual(derived['hydrodynamic_radius']['t_d'][index]/calibration.calc_hydrodynamic_radius(diff_co, calibration.mu_water, 297.15), 1, places = 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Tests for the result cache of `fcs_functions`."""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fcs_functions import cache, raw_functions
+
+from .fixtures import write_raw
+
+
+class TestResultCache(unittest.TestCase):
+    """Tests for `cache.ResultCache`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, 'run.raw')
+        write_raw(self.source, n_photons = 1000)
+        self.cache = cache.ResultCache(os.path.join(self.directory.name, 'cache'))
+        self.computed = 0
+
+    def tearDown(self):
+        cache.disable()
+        self.directory.cleanup()
+
+    def compute(self) -> dict:
+        self.computed += 1
+        return {'values': np.array([1.0, np.nan, np.inf]), 'counts': np.arange(5)}
+
+    def test_round_trip(self):
+        """A stored result is loaded unchanged, NaN included, rather than computed again."""
+        parameters = {'bin_size': 2e-7, 'autocorr_times': np.array([1e-6, np.nan])}
+        first = self.cache.cached(self.source, 'acf', parameters, self.compute)
+        second = self.cache.cached(self.source, 'acf', dict(parameters), self.compute)
+        self.assertEqual(self.computed, 1)
+        self.assertEqual(sorted(second), ['counts', 'values'])
+        np.testing.assert_array_equal(second['values'], first['values'])
+        self.assertTrue(np.array_equal(second['values'], first['values'], equal_nan = True))
+        np.testing.assert_array_equal(second['counts'], np.arange(5))
+
+    def test_parameters_in_key(self):
+        """Results of different parameters or computations are kept apart."""
+        key = self.cache.key(self.source, 'acf', {'bin_size': 2e-7})
+        self.assertNotEqual(key, self.cache.key(self.source, 'acf', {'bin_size': 1e-6}))
+        self.assertNotEqual(key, self.cache.key(self.source, 'pch', {'bin_size': 2e-7}))
+        self.assertNotEqual(self.cache.key(self.source, 'acf', {'times': np.arange(3)}), self.cache.key(self.source, 'acf', {'times': np.arange(3.0)}))
+
+    def test_modified_source(self):
+        """A result is computed again once its source file's modification time changes."""
+        self.cache.cached(self.source, 'acf', {}, self.compute)
+        stat = os.stat(self.source)
+        os.utime(self.source, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.cache.cached(self.source, 'acf', {}, self.compute)
+        self.assertEqual(self.computed, 2)
+
+    def test_hash_contents(self):
+        """With hash_contents, a touched but unchanged file keeps its results."""
+        hashed = cache.ResultCache(self.cache.directory, hash_contents = True)
+        hashed.cached(self.source, 'acf', {}, self.compute)
+        stat = os.stat(self.source)
+        os.utime(self.source, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        hashed.cached(self.source, 'acf', {}, self.compute)
+        self.assertEqual(self.computed, 1)
+
+    def test_eviction(self):
+        """The least recently used results are evicted once the cache is over its size limit."""
+        small = cache.ResultCache(self.cache.directory, max_bytes = 1)
+        small.cached(self.source, 'acf', {'bin_size': 1}, self.compute)
+        small.cached(self.source, 'acf', {'bin_size': 2}, self.compute)
+        self.assertLessEqual(len([name for name in os.listdir(small.directory) if name.endswith('.npz')]), 1)
+
+    def test_raw_file_results(self):
+        """RawConfoCor3 results are the same from the cache as computed."""
+        cache.enable(self.cache.directory)
+        raw = raw_functions.RawConfoCor3(self.source)
+        raw.bin(1e-5)
+        computed = raw.CountRateArray
+        raw.bin(1e-5)
+        np.testing.assert_array_equal(raw.CountRateArray, computed)
+        self.assertEqual(len([name for name in os.listdir(self.cache.directory) if name.endswith('.npz')]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
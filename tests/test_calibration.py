@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""Tests for the calibration of `fcs_functions`."""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fcs_functions import calibration, fcs_objects
+
+from .fixtures import fitted_parameters, write_fcs
+
+measured_n = np.array([2.0, 3.0, 5.0])
+measured_td = np.array([4e-5, 6e-5, 1e-4])
+calibration_td, calibration_sp = 3.5e-5, 5.0
+
+
+class TestCalibrateArrays(unittest.TestCase):
+    """Tests for `calibration.calibrate_arrays`."""
+
+    def test_matches_scalar_functions(self):
+        """Each element is calibrated as the scalar functions calibrate one fit."""
+        calibrated = calibration.calibrate_arrays(measured_n, measured_td, calibration_td, calibration_sp, 'Rhodamine 6G', ['nM', 'uM', 'nM'])
+        w1, w2 = calibration.confocal_widths(calibration_td, calibration.given_d['Rhodamine 6G'], calibration_sp)
+        volume = calibration.calibrate_fcs(calibration_td, calibration_sp, 'Rhodamine 6G')
+        for index, units in enumerate(['nM', 'uM', 'nM']):
+            diff_co = calibration.calc_coeff(w1, measured_td[index])
+            self.assertAlmostEqual(calibrated['concentration'][index]/calibration.calibrated_conc(measured_n[index], volume, units), 1, places = 12)
+            self.assertAlmostEqual(calibrated['diffusion_coefficient'][index]/diff_co, 1, places = 12)
+            self.assertAlmostEqual(calibrated['hydrodynamic_radius'][index]/calibration.calc_hydrodynamic_radius(diff_co, calibration.mu_water, 297.15), 1, places = 12)
+        self.assertAlmostEqual(calibrated['w2']/w2, 1, places = 12)
+        self.assertAlmostEqual(calibrated['confocal_volume']/volume, 1, places = 12)
+
+    def test_uncertainties(self):
+        """Propagated uncertainties match the spread of results calibrated from perturbed arguments."""
+        sigmas = {'measured_n': 0.05, 'measured_td': 1e-6, 'calibration_td': 5e-7, 'calibration_sp': 0.1, 'temperature': 0.5}
+        calibrated = calibration.calibrate_arrays(measured_n, measured_td, calibration_td, calibration_sp, uncertainties = sigmas)
+        rng = np.random.default_rng(0)
+        n_samples = 200000
+        samples = calibration.calibrate_arrays(
+            measured_n + rng.normal(0, sigmas['measured_n'], (n_samples, 1)),
+            measured_td + rng.normal(0, sigmas['measured_td'], (n_samples, 1)),
+            calibration_td + rng.normal(0, sigmas['calibration_td'], (n_samples, 1)),
+            calibration_sp + rng.normal(0, sigmas['calibration_sp'], (n_samples, 1)),
+            temperature = 297.15 + rng.normal(0, sigmas['temperature'], (n_samples, 1))
+        )
+        for name in ['concentration', 'diffusion_coefficient', 'hydrodynamic_radius']:
+            np.testing.assert_allclose(calibrated[name + '_sigma'], samples[name].std(axis = 0), rtol = 0.02)
+
+    def test_without_uncertainties(self):
+        """Standard deviations are only given when uncertainties are."""
+        calibrated = calibration.calibrate_arrays(measured_n, measured_td, calibration_td, calibration_sp)
+        self.assertNotIn('concentration_sigma', calibrated)
+
+
+class TestCalibrateTraces(unittest.TestCase):
+    """Tests for calibrating Confocor3FCS traces with the scalar functions."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'run.fcs')
+        write_fcs(path, repeats = 3)
+        self.calibration_trace = fcs_objects.Confocor3FCS(path)
+        self.calibration_trace.calibrate_by('Rhodamine 6G')
+        self.trace = fcs_objects.Confocor3FCS(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hydrodynamic_radii(self):
+        """Every fitted repeat gets a hydrodynamic radius."""
+        self.trace.calibrate(self.calibration_trace)
+        self.trace.calc_hydrodynamic_radii()
+        w1 = calibration.confocal_widths(fitted_parameters['Translation diffusion time species 1'], calibration.given_d['Rhodamine 6G'], fitted_parameters['Translation structural parameter'])[0]
+        expected = calibration.calc_hydrodynamic_radius(calibration.calc_coeff(w1, fitted_parameters['Translation diffusion time species 1']), calibration.mu_water, 297.15)
+        self.assertEqual(sorted(self.trace.hydrodynamic_radii), ['Average', 'Repeat 1', 'Repeat 2', 'Repeat 3'])
+        for radius in self.trace.hydrodynamic_radii.values():
+            self.assertAlmostEqual(radius/expected, 1, places = 12)
+
+    def test_experiment_takes_calibration(self):
+        """An Experiment takes the confocal volume and widths of a calibrated trace."""
+        experiment = fcs_objects.Experiment(self.calibration_trace)
+        self.assertEqual(experiment.confocal_volume, self.calibration_trace.confocal_volume)
+        self.assertEqual(experiment.confocal_widths, self.calibration_trace.confocal_widths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,7 @@
 
 import unittest
 
-from fcs_functions import fcs_functions
+import fcs_functions
 
 
 class TestFcs_functions(unittest.TestCase):
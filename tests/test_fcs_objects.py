@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""Tests for the fcs file parser of `fcs_objects`."""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fcs_functions import calibration, fcs_objects
+
+from .fixtures import write_fcs
+
+
+def reference_break_tab(field: list) -> list:
+    """The original recursive break_tab, which tokenize replaced"""
+    tabs = [len(x) - len(x.lstrip('\t')) for x in field]
+    if any(map(lambda x: x > 0, tabs)):
+        subfields = []
+        indented = []
+        for index, indent in enumerate(tabs):
+            if indent == 0:
+                if indented:
+                    subfields[-1].append(reference_break_tab([x[1:] for x in indented]))
+                    indented = []
+                subfields.append([field[index]])
+            else:
+                indented.append(field[index])
+        if indented:
+            subfields[-1].append(reference_break_tab([x[1:] for x in indented]))
+        return subfields
+    return field
+
+
+def reference_fields(lines: list) -> dict:
+    """The top level fields of an fcs file, read line by line with gen_field"""
+    fields = {}
+    for line in lines:
+        if line.startswith('\t') and not line.startswith('\t\t') and '=' in line and 'BEGIN' not in line:
+            fcs_objects.gen_field(line[1:], fields)
+    return fields
+
+
+def reference_average(data: list) -> dict:
+    """The original average_time_series, which intersected sets of times"""
+    times = set(data[0][:, 0])
+    for rep in data[1:]:
+        times = times.intersection(rep[:, 0])
+    times = np.array(sorted(times))
+    values = np.array([rep[np.isin(rep[:, 0], times), 1] for rep in data])
+    return {'time': times, 'mean': np.mean(values, axis = 0), 'stddev': np.std(values, axis = 0)}
+
+
+def assert_entries_equal(test: unittest.TestCase, first: 'fcs_objects.FcsData', second: 'fcs_objects.FcsData') -> None:
+    test.assertEqual(first.datalabels, second.datalabels)
+    test.assertEqual(first.acquisition, second.acquisition)
+    test.assertEqual(first.fit, second.fit)
+    test.assertEqual(sorted(first.data), sorted(second.data))
+    for key in first.data:
+        if isinstance(first.data[key], np.ndarray):
+            np.testing.assert_array_equal(first.data[key], second.data[key])
+        else:
+            test.assertEqual(first.data[key], second.data[key])
+
+
+class FcsFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'run.fcs')
+        write_fcs(self.path, repeats = 3)
+        with open(self.path) as f:
+            self.lines = f.readlines()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestParser(FcsFileTestCase):
+    """Tests that the single pass parser matches the original recursive one."""
+
+    def test_tokenize(self):
+        """tokenize, and so break_tab, gives the same tree as the original break_tab."""
+        self.assertEqual(fcs_objects.tokenize(self.lines), reference_break_tab(self.lines))
+        self.assertEqual(fcs_objects.break_tab(self.lines), reference_break_tab(self.lines))
+
+    def test_fields(self):
+        """The file's info matches its top level fields read with gen_field."""
+        fields = reference_fields(self.lines)
+        info = fcs_objects.Confocor3FCS(self.path).info
+        self.assertEqual(info['Name'], fields['Name'])
+        self.assertEqual(info['Comment'], fields['Comment'])
+        self.assertEqual(info['Sort Order'], fields['SortOrder'].split('-'))
+
+    def test_entries(self):
+        """Entries parsed from array spans match entries parsed from the original tree, whose arrays are converted row by row."""
+        fcs = fcs_objects.Confocor3FCS(self.path)
+        tree = reference_break_tab(self.lines)
+        entries = [item[1][0][1] for item in tree[1][1] if item[0][:5] == 'BEGIN']
+        self.assertEqual(len(entries), len(fcs.data) + 1)
+        for entry, repeat in zip(entries, list(fcs.data.values()) + [fcs.average]):
+            assert_entries_equal(self, fcs_objects.FcsData(entry), repeat)
+            header = [index for index, item in enumerate(entry) if item[0].startswith('CorrelationArray')][0]
+            n_rows = int(entry[header][0].split(' ')[-2])
+            rows = [[float(value) for value in item[0][:-3].split('\t')] for item in entry[header + 1:header + 1 + n_rows]]
+            np.testing.assert_array_equal(repeat.data['CorrelationArray'], np.array(rows))
+
+    def test_fit_parameters(self):
+        """Fitted parameters are read as numbers."""
+        fits = fcs_objects.Confocor3FCS(self.path).fits
+        self.assertEqual(fits['Repeat 1']['Number of molecules'], 3.0)
+
+    def test_lazy(self):
+        """Lazily parsed arrays are the same as eagerly parsed ones."""
+        eager = fcs_objects.Confocor3FCS(self.path)
+        lazy = fcs_objects.Confocor3FCS(self.path, lazy = True)
+        for repeat in eager.data:
+            assert_entries_equal(self, eager.data[repeat], lazy.data[repeat])
+
+
+class TestSnapshot(FcsFileTestCase):
+    """Tests for binary snapshots of parsed files."""
+
+    def test_round_trip(self):
+        """A loaded snapshot matches the parsed file."""
+        parsed = fcs_objects.Confocor3FCS(self.path, snapshot = True)
+        loaded = fcs_objects.Confocor3FCS(self.path)
+        self.assertTrue(loaded.load_snapshot())
+        self.assertEqual(loaded.info, parsed.info)
+        self.assertEqual(loaded.fits, parsed.fits)
+        for repeat in parsed.data:
+            assert_entries_equal(self, loaded.data[repeat], parsed.data[repeat])
+        assert_entries_equal(self, loaded.average, parsed.average)
+
+    def test_invalidated_by_changes(self):
+        """A snapshot is not used once the file's modification time or size changes."""
+        fcs_objects.Confocor3FCS(self.path, snapshot = True)
+        fcs = fcs_objects.Confocor3FCS(self.path)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertFalse(fcs.load_snapshot())
+        # Loading with snapshot = True parses the changed file and saves a new snapshot
+        fcs_objects.Confocor3FCS(self.path, snapshot = True)
+        self.assertTrue(fcs.load_snapshot())
+        write_fcs(self.path, repeats = 4, seed = 1)
+        self.assertFalse(fcs.load_snapshot())
+        self.assertEqual(len(fcs_objects.Confocor3FCS(self.path, snapshot = True).data), 4)
+
+    def test_missing(self):
+        """Loading a snapshot that was never saved fails without raising."""
+        self.assertFalse(fcs_objects.Confocor3FCS(self.path).load_snapshot())
+
+
+class TestAverageTimeSeries(unittest.TestCase):
+    """Tests for `fcs_objects.average_time_series`."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.times = np.linspace(1e-6, 1e-3, 50)
+        self.repeats = [np.column_stack((self.times, rng.normal(1.1, 0.01, 50))) for _ in range(4)]
+
+    def assert_average_equal(self, average: dict, reference: dict) -> None:
+        for key in ['time', 'mean', 'stddev']:
+            np.testing.assert_allclose(average[key], reference[key], rtol = 1e-12)
+
+    def test_shared_times(self):
+        """Repeats sharing their times are averaged as the original function did."""
+        self.assert_average_equal(fcs_objects.average_time_series(self.repeats), reference_average(self.repeats))
+
+    def test_different_times(self):
+        """Repeats with different times are averaged at the times they all have."""
+        repeats = [self.repeats[0][5:], self.repeats[1][:-5], self.repeats[2][::2], self.repeats[3]]
+        self.assert_average_equal(fcs_objects.average_time_series(repeats), reference_average(repeats))
+
+    def test_weights(self):
+        """Weights give the weighted mean and standard deviation."""
+        weights = np.array([1.0, 2.0, 3.0, 4.0])
+        average = fcs_objects.average_time_series(self.repeats, weights = weights)
+        values = np.stack([rep[:, 1] for rep in self.repeats])
+        np.testing.assert_allclose(average['mean'], weights@values/weights.sum(), rtol = 1e-12)
+
+    def test_include(self):
+        """Only the repeats included are averaged."""
+        average = fcs_objects.average_time_series(self.repeats, include = [True, False, True, False])
+        self.assert_average_equal(average, reference_average([self.repeats[0], self.repeats[2]]))
+        with self.assertRaises(ValueError):
+            fcs_objects.average_time_series(self.repeats, include = [False]*4)
+
+
+class TestExperiment(unittest.TestCase):
+    """Tests for the table of `fcs_objects.Experiment`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.traces = []
+        for seed in range(3):
+            path = os.path.join(self.directory.name, f'run_{seed}.fcs')
+            write_fcs(path, repeats = 3, seed = seed)
+            self.traces.append(fcs_objects.Confocor3FCS(path))
+        self.experiment = fcs_objects.Experiment(self.traces[0])
+        for trace, sample, condition in zip(self.traces, ['A', 'A', 'B'], ['cold', 'warm', 'cold']):
+            self.experiment.add_run(trace, sample = sample, condition = condition)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_table(self):
+        """The table has a row per repeat, with its fit parameters and values from its arrays."""
+        table = self.experiment.table
+        self.assertEqual(list(table['trace']), ['trace1']*3 + ['trace2']*3 + ['trace3']*3)
+        self.assertEqual(list(table['repeat'][:3]), ['Repeat 1', 'Repeat 2', 'Repeat 3'])
+        self.assertEqual(table['Number of molecules'].dtype, np.float64)
+        np.testing.assert_array_equal(table['Number of molecules'], 3.0)
+        correlation = self.traces[1].data['Repeat 2'].data['CorrelationArray']
+        self.assertEqual(table['G0'][4], correlation[0, 1])
+        self.assertEqual(table['max_G'][4], correlation[:, 1].max())
+
+    def test_select(self):
+        """Rows are selected by an include mask and column values together."""
+        selected = self.experiment.select(self.experiment.table['max_G'] > np.median(self.experiment.table['max_G']), sample = 'A')
+        expected = (self.experiment.table['max_G'] > np.median(self.experiment.table['max_G'])) & (self.experiment.table['sample'] == 'A')
+        np.testing.assert_array_equal(selected['G0'], self.experiment.table['G0'][expected])
+        self.assertEqual(len(self.experiment.select()['trace']), 9)
+
+    def test_group_stats(self):
+        """Each group's count, mean and standard deviation are those of its included rows."""
+        table = self.experiment.table
+        include = np.arange(9) != 0
+        stats = self.experiment.group_stats(['max_G'], include = include)
+        self.assertEqual(stats['groups'], [('A', 'cold'), ('A', 'warm'), ('B', 'cold')])
+        for index, (sample, condition) in enumerate(stats['groups']):
+            values = table['max_G'][include & (table['sample'] == sample) & (table['condition'] == condition)]
+            self.assertEqual(stats['count']['max_G'][index], len(values))
+            self.assertAlmostEqual(stats['mean']['max_G'][index], values.mean(), places = 12)
+            self.assertAlmostEqual(stats['std']['max_G'][index], values.std(ddof = 1), places = 12)
+        averages = self.experiment.get_average_parameters(['max_G'], by = ('sample',))
+        self.assertAlmostEqual(averages[('B',)]['max_G'][0], table['max_G'][6:].mean(), places = 12)
+
+    def test_calibrated_columns(self):
+        """Calibrating the experiment adds concentrations calculated as the scalar functions would."""
+        self.experiment.calibrate_by('Rhodamine 6G')
+        expected = calibration.calibrated_conc(3.0, self.experiment.confocal_volume, 'nM')
+        np.testing.assert_allclose(self.experiment.table['concentration'], expected, rtol = 1e-12)
+
+    def test_table_rebuilt(self):
+        """Adding a run rebuilds the table."""
+        self.assertEqual(len(self.experiment.table['trace']), 9)
+        self.experiment.add_run(self.traces[0], sample = 'C')
+        self.assertEqual(len(self.experiment.table['trace']), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
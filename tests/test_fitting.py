@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+"""Tests for fitting many curves with `fcs_functions`."""
+
+
+import copy
+import os
+import tempfile
+import unittest
+from typing import Callable
+
+import numpy as np
+
+from fcs_functions import fcs_objects, fitting, models
+
+from .fixtures import fitted_parameters, write_fcs
+
+try:
+    from scipy.optimize import curve_fit, least_squares
+except ImportError:
+    curve_fit = least_squares = None
+
+t = np.logspace(-6, 0, 120)
+w1, w2 = 2e-7, 1e-6
+one_component_truth = np.array([5.0, 0.1, 5e-6, 5e-5])
+two_component_truth = np.array([0.1, 5e-6, 5.0, 0.4, 3e-5, 1e-3])
+
+
+def noisy_curves(model: Callable, truth: 'np.array', n_curves: int, seed: int = 0) -> 'np.array':
+    return model(t, *truth) + np.random.default_rng(seed).normal(0, 1e-3, (n_curves, len(t)))
+
+
+def finite_differences(model: Callable, parameters: 'np.array') -> 'np.array':
+    """The time delays x parameters derivatives of a model, by central differences"""
+    derivatives = []
+    for index, value in enumerate(parameters):
+        step = 1e-5*abs(value)
+        above, below = parameters.copy(), parameters.copy()
+        above[index] += step
+        below[index] -= step
+        derivatives.append((model(t, *above) - model(t, *below))/(2*step))
+    return np.stack(derivatives, axis = -1)
+
+
+def assert_jacobian(jacobian: 'np.array', model: Callable, parameters: 'np.array') -> None:
+    """Compares derivatives scaled by their parameters, as the parameters span many orders of magnitude"""
+    np.testing.assert_allclose(jacobian*parameters, finite_differences(model, parameters)*parameters, rtol = 1e-6, atol = 1e-8)
+
+
+class TestCompiledModels(unittest.TestCase):
+    """Tests that the compiled models and their Jacobians match the numpy models."""
+
+    def test_one_component(self):
+        model, jacobian = models.compiled_one_component_model(w1, w2)
+        reference = models.one_component_model(w1, w2)
+        np.testing.assert_allclose(model(t, *one_component_truth), reference(t, *one_component_truth), rtol = 1e-12)
+        assert_jacobian(jacobian(t, *one_component_truth), reference, one_component_truth)
+
+    def test_two_component(self):
+        model, jacobian = models.compiled_two_component_model(w1, w2)
+        reference = models.two_component_model(w1, w2)
+        np.testing.assert_allclose(model(t, *two_component_truth), reference(t, *two_component_truth), rtol = 1e-12)
+        assert_jacobian(jacobian(t, *two_component_truth), reference, two_component_truth)
+
+    def test_second_component(self):
+        model, jacobian = models.compiled_add_second_component(5.0, 3e-5, w1, w2)
+        reference = models.add_second_component(5.0, 3e-5, w1, w2)
+        truth = np.array([0.1, 5e-6, 0.4, 1e-3])
+        np.testing.assert_allclose(model(t, *truth), reference(t, *truth), rtol = 1e-12)
+        assert_jacobian(jacobian(t, *truth), reference, truth)
+
+    def test_columns(self):
+        """Parameters given as columns give one curve per row."""
+        model, jacobian = models.compiled_one_component_model(w1, w2)
+        columns = np.stack([one_component_truth, one_component_truth*1.1])
+        curves = model(t, *columns.T[:, :, np.newaxis])
+        self.assertEqual(curves.shape, (2, len(t)))
+        np.testing.assert_allclose(curves[1], model(t, *columns[1]), rtol = 1e-12)
+        self.assertEqual(jacobian(t, *columns.T[:, :, np.newaxis]).shape, (2, len(t), 4))
+
+
+class TestFitCurves(unittest.TestCase):
+    """Tests for `fitting.fit_curves`."""
+
+    @unittest.skipIf(curve_fit is None, 'scipy is not installed')
+    def test_matches_curve_fit(self):
+        """Each curve's parameters and standard errors match curve_fit's, with numerical and analytic Jacobians."""
+        model = models.one_component_model(w1, w2)
+        compiled, jacobian = models.compiled_one_component_model(w1, w2)
+        curves = noisy_curves(model, one_component_truth, 4)
+        p0 = one_component_truth*1.2
+        numerical = fitting.fit_curves(model, t, curves, p0)
+        analytic = fitting.fit_curves(compiled, t, curves, p0, jacobian = jacobian)
+        self.assertTrue(numerical['converged'].all())
+        self.assertTrue(analytic['converged'].all())
+        for index, curve in enumerate(curves):
+            # curve_fit stops at a looser tolerance, so the parameters are compared relative to their standard errors
+            parameters, covariance = curve_fit(model, t, curve, p0 = p0)
+            stderr = np.sqrt(np.diag(covariance))
+            self.assertTrue(np.all(np.abs(numerical['parameters'][index] - parameters) < 1e-3*stderr))
+            self.assertTrue(np.all(np.abs(analytic['parameters'][index] - parameters) < 1e-3*stderr))
+            np.testing.assert_allclose(analytic['stderr'][index], stderr, rtol = 1e-3)
+
+    def test_recovers_parameters(self):
+        """Fits of noisy curves recover the parameters within a few standard errors."""
+        model = models.one_component_model(w1, w2)
+        result = fitting.fit_curves(model, t, noisy_curves(model, one_component_truth, 8), one_component_truth*1.2)
+        self.assertTrue(result['converged'].all())
+        self.assertTrue(np.all(np.abs(result['parameters'] - one_component_truth) < 5*result['stderr']))
+
+    def test_non_finite_curves(self):
+        """Curves containing NaN or inf are not fitted, and do not stop the others being fitted."""
+        model = models.one_component_model(w1, w2)
+        curves = noisy_curves(model, one_component_truth, 6)
+        curves[1, 5] = np.nan
+        curves[3, 7] = np.inf
+        result = fitting.fit_curves(model, t, curves, one_component_truth*1.2)
+        clean = fitting.fit_curves(model, t, curves[[0, 2, 4, 5]], one_component_truth*1.2)
+        np.testing.assert_array_equal(result['converged'], [True, False, True, False, True, True])
+        self.assertTrue(np.all(np.isnan(result['parameters'][[1, 3]])))
+        self.assertTrue(np.all(np.isnan(result['chi2'][[1, 3]])))
+        np.testing.assert_allclose(result['parameters'][[0, 2, 4, 5]], clean['parameters'], rtol = 1e-9)
+
+    def test_bounds(self):
+        """Parameters stay within their bounds."""
+        model = models.one_component_model(w1, w2)
+        lower = np.array([0.1, 0.0, 1e-7, 1e-6])
+        upper = np.array([np.inf, 0.05, np.inf, np.inf])
+        result = fitting.fit_curves(model, t, noisy_curves(model, one_component_truth, 3), [5.0, 0.01, 5e-6, 5e-5], bounds = (lower, upper))
+        self.assertTrue(np.all(result['parameters'][:, 1] <= 0.05))
+
+    def test_workers(self):
+        """Splitting the curves between processes gives the same fits."""
+        model = models.one_component_model(w1, w2)
+        curves = noisy_curves(model, one_component_truth, 2*fitting.min_curves_per_worker)
+        serial = fitting.fit_curves(model, t, curves, one_component_truth*1.2, max_workers = 1)
+        parallel = fitting.fit_curves(model, t, curves, one_component_truth*1.2, max_workers = 2)
+        np.testing.assert_allclose(parallel['parameters'], serial['parameters'], rtol = 1e-12)
+
+
+class TestGlobalFit(unittest.TestCase):
+    """Tests for `fitting.global_fit`."""
+
+    def setUp(self):
+        self.model = models.one_component_model(w1, w2)
+        # Curves with their own numbers of molecules and triplet states, and one diffusion time
+        self.truth = one_component_truth*np.array([[1.0, 1.0, 1.0, 1.0], [1.5, 1.2, 0.8, 1.0], [0.7, 0.9, 1.1, 1.0]])
+        rng = np.random.default_rng(0)
+        self.curves = np.stack([self.model(t, *parameters) for parameters in self.truth]) + rng.normal(0, 1e-3, (3, len(t)))
+
+    def test_shared_parameters(self):
+        """Shared parameters take one value for every curve, and the fit recovers the parameters."""
+        result = fitting.global_fit(self.model, t, self.curves, one_component_truth*1.2, shared = [3])
+        self.assertTrue(result['converged'])
+        self.assertTrue(np.all(result['parameters'][:, 3] == result['parameters'][0, 3]))
+        self.assertTrue(np.all(np.abs(result['parameters'] - self.truth) < 5*result['stderr']))
+        np.testing.assert_allclose(result['chi2'], result['curve_chi2'].sum())
+
+    @unittest.skipIf(least_squares is None, 'scipy is not installed')
+    def test_matches_least_squares(self):
+        """The fit matches least_squares of every curve's local parameters and the shared parameter together."""
+        result = fitting.global_fit(self.model, t, self.curves, one_component_truth*1.2, shared = [3])
+
+        def residuals(vector):
+            local = vector[:-1].reshape(3, 3)
+            return np.concatenate([self.model(t, *local[row], vector[-1]) - self.curves[row] for row in range(3)])
+        start = np.concatenate([np.tile(one_component_truth[:3]*1.2, 3), one_component_truth[3:]*1.2])
+        reference = least_squares(residuals, start, x_scale = np.abs(start), xtol = 1e-15, ftol = 1e-15, gtol = 1e-15)
+        expected = np.column_stack((reference.x[:-1].reshape(3, 3), np.full(3, reference.x[-1])))
+        self.assertTrue(np.all(np.abs(result['parameters'] - expected) < 1e-2*result['stderr']))
+        self.assertAlmostEqual(result['chi2']/(2*reference.cost), 1, places = 6)
+
+    def test_fcs_files(self):
+        """Repeats of several files are fitted together, identified by file and repeat."""
+        with tempfile.TemporaryDirectory() as directory:
+            traces = []
+            for seed in range(2):
+                path = os.path.join(directory, f'run_{seed}.fcs')
+                write_fcs(path, repeats = 2, seed = seed)
+                traces.append(fcs_objects.Confocor3FCS(path))
+            result = fitting.global_fit_fcs(traces, self.model, [3.0, 0.1, 3e-6, 3.5e-5], shared = [3])
+        self.assertEqual(result['ids'], [(0, 'Repeat 1'), (0, 'Repeat 2'), (1, 'Repeat 1'), (1, 'Repeat 2')])
+        self.assertTrue(result['converged'])
+        self.assertAlmostEqual(result['parameters'][0, 3]/3.5e-5, 1, delta = 0.05)
+
+
+class TestZenStartingValues(unittest.TestCase):
+    """Tests for `fitting.zen_starting_values` and `fitting.refit_fcs`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'run.fcs')
+        write_fcs(path, repeats = 3)
+        self.trace = fcs_objects.Confocor3FCS(path)
+        self.entries = [self.trace.data[entry_id] for entry_id in ('Repeat 1', 'Repeat 2', 'Repeat 3')]
+        self.model = models.one_component_model(w1, w2)
+        self.stored = np.array([fitted_parameters[fitting.zen_identifiers[name]] for name in fitting.model_parameters(self.model)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stored_fits(self):
+        """Parameters start from Zen's results, bounded by Zen's minima and maxima."""
+        starting, lower, upper = fitting.zen_starting_values(self.entries, self.model, np.ones(4))
+        np.testing.assert_allclose(starting, np.tile(self.stored, (3, 1)))
+        np.testing.assert_allclose(lower, np.tile(self.stored*0.01, (3, 1)))
+        np.testing.assert_allclose(upper, np.tile(self.stored*100, (3, 1)))
+
+    def test_invalid_results(self):
+        """Parameters whose results are not valid start from Zen's starting values."""
+        entry = copy.deepcopy(self.entries[0])
+        entry.fit['Parameters']['Number of molecules']['ResultValid'] = 0
+        starting = fitting.zen_starting_values([entry], self.model, np.ones(4))[0]
+        self.assertAlmostEqual(starting[0, 0], self.stored[0]*1.1)
+
+    def test_missing_fits(self):
+        """Entries without a fit take the median of the others, and parameters no entry has take p0 and bounds."""
+        entry = copy.deepcopy(self.entries[0])
+        entry.fit = None
+        entries = [entry] + self.entries[1:]
+        starting, lower, upper = fitting.zen_starting_values(entries, self.model, np.ones(4))
+        np.testing.assert_allclose(starting[0], self.stored)
+        np.testing.assert_allclose(upper[0], self.stored*100)
+        starting, lower, upper = fitting.zen_starting_values([entry], self.model, np.full(4, 2.0), (0, 10))
+        np.testing.assert_array_equal(starting, [[2.0, 2.0, 2.0, 2.0]])
+        np.testing.assert_array_equal(lower, [[0, 0, 0, 0]])
+        np.testing.assert_array_equal(upper, [[10, 10, 10, 10]])
+
+    def test_refit(self):
+        """Every repeat is refitted from Zen's results."""
+        result = fitting.refit_fcs(self.trace, self.model, np.ones(4), max_workers = 1)
+        self.assertEqual(result['ids'], ['Repeat 1', 'Repeat 2', 'Repeat 3'])
+        np.testing.assert_allclose(result['p0'], np.tile(self.stored, (3, 1)))
+        self.assertTrue(np.all(result['converged']))
+        np.testing.assert_allclose(result['parameters'][:, 3], fitted_parameters['Translation diffusion time species 1'], rtol = 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
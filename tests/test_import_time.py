@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+"""Import time benchmark for the `fcs_functions` package."""
+
+
+import os
+import subprocess
+import sys
+import unittest
+
+# The longest the package may take to import, in seconds, on top of numpy
+import_time_budget = 0.5
+
+package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_fresh(code: str) -> str:
+    """Runs code in a new interpreter, so no modules are already imported, and returns what it prints"""
+    environment = dict(os.environ, PYTHONPATH = package_root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.run([sys.executable, '-c', code], check = True, capture_output = True, text = True, env = environment).stdout
+
+
+class TestImportTime(unittest.TestCase):
+    """Tests that importing `fcs_functions` stays fast."""
+
+    def test_heavy_dependencies_not_imported(self):
+        """Importing every submodule does not import numba or matplotlib."""
+        output = run_fresh(
+            'import sys\n'
+            'import fcs_functions\n'
+            'from fcs_functions import calibration, fcs_objects, raw_functions, models, batch, cache, fitting, bootstrap\n'
+            'print(sorted(name for name in ("numba", "matplotlib") if name in sys.modules))\n'
+        )
+        self.assertEqual(output.strip(), '[]')
+
+    def test_submodules_imported_lazily(self):
+        """Using calibration does not import the other submodules."""
+        output = run_fresh(
+            'import sys\n'
+            'import fcs_functions\n'
+            'fcs_functions.calibration.calc_coeff(1e-7, 1e-5)\n'
+            'print("fcs_functions.fcs_objects" in sys.modules, "fcs_functions.raw_functions" in sys.modules)\n'
+        )
+        self.assertEqual(output.strip(), 'False False')
+
+    def test_import_time(self):
+        """Importing every submodule takes less than the budget once numpy is imported."""
+        output = run_fresh(
+            'import time\n'
+            'import numpy\n'
+            'start = time.perf_counter()\n'
+            'from fcs_functions import calibration, fcs_objects, raw_functions, models, batch, cache, fitting, bootstrap\n'
+            'print(time.perf_counter() - start)\n'
+        )
+        self.assertLess(float(output), import_time_budget)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""Tests for the directory indexer of `fcs_functions`."""
+
+
+import os
+import tempfile
+import unittest
+
+from fcs_functions import fcs_objects, indexer
+
+from .fixtures import write_fcs, write_raw
+
+
+class TestReadFcsHeader(unittest.TestCase):
+    """Tests for `fcs_objects.read_fcs_header`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'run.fcs')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_fields_and_repeats(self):
+        """The top level fields match the full parser, and the average is not counted as a repeat."""
+        write_fcs(self.path, repeats = 4)
+        header = fcs_objects.read_fcs_header(self.path)
+        fcs = fcs_objects.Confocor3FCS(self.path)
+        self.assertEqual(header['repeats'], 4)
+        self.assertEqual(header['Name'], fcs.info['Name'])
+        self.assertEqual(header['Comment'], fcs.info['Comment'])
+        self.assertEqual(header['Sort Order'], ['FcsRepeat', 'FcsChannel'])
+
+    def test_empty_field(self):
+        """An empty field, e.g. 'Comment = ', is read as an empty string."""
+        write_fcs(self.path, repeats = 2, fields = {'Comment': ''})
+        header = fcs_objects.read_fcs_header(self.path)
+        self.assertEqual(header['Comment'], '')
+        self.assertEqual(header['Name'], 'test')
+        self.assertEqual(header['repeats'], 2)
+
+    def test_not_fcs(self):
+        """Other files are refused."""
+        with open(self.path, 'w') as f:
+            f.write('not an fcs file\n')
+        with self.assertRaises(ValueError):
+            fcs_objects.read_fcs_header(self.path)
+
+
+class TestDirectoryIndex(unittest.TestCase):
+    """Tests for `indexer.DirectoryIndex`."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_run(self, name: str, repetitions: int, channels: int, sort_order: str = 'FcsRepeat-FcsChannel') -> None:
+        write_fcs(os.path.join(self.root, name + '.fcs'), repeats = repetitions*channels, fields = {'SortOrder': sort_order})
+        for repetition in range(1, repetitions + 1):
+            for channel in range(1, channels + 1):
+                write_raw(os.path.join(self.root, f'{name}_R{repetition}_P1_K1_Ch{channel}.raw'), n_photons = 100, repetition_number = repetition)
+
+    def test_pairs_repeats_in_order(self):
+        """Raw files are paired with the repeats of the fcs file their name starts with."""
+        self.write_run('run', 3, 1)
+        self.write_run('run_2', 2, 1)
+        index = indexer.index_directory(self.root)
+        self.assertEqual(index.pairs['run.fcs'], {'Repeat 1': 'run_R1_P1_K1_Ch1.raw', 'Repeat 2': 'run_R2_P1_K1_Ch1.raw', 'Repeat 3': 'run_R3_P1_K1_Ch1.raw'})
+        self.assertEqual(index.pairs['run_2.fcs'], {'Repeat 1': 'run_2_R1_P1_K1_Ch1.raw', 'Repeat 2': 'run_2_R2_P1_K1_Ch1.raw'})
+        self.assertEqual(index.unpaired, [])
+
+    def test_pairs_channels_in_sort_order(self):
+        """Two channel runs are paired in the fcs file's Sort Order."""
+        self.write_run('run', 2, 2)
+        self.write_run('other', 2, 2, sort_order = 'FcsChannel-FcsRepeat')
+        index = indexer.index_directory(self.root)
+        self.assertEqual([index.pairs['run.fcs'][f'Repeat {number}'] for number in range(1, 5)], ['run_R1_P1_K1_Ch1.raw', 'run_R1_P1_K1_Ch2.raw', 'run_R2_P1_K1_Ch1.raw', 'run_R2_P1_K1_Ch2.raw'])
+        self.assertEqual([index.pairs['other.fcs'][f'Repeat {number}'] for number in range(1, 5)], ['other_R1_P1_K1_Ch1.raw', 'other_R2_P1_K1_Ch1.raw', 'other_R1_P1_K1_Ch2.raw', 'other_R2_P1_K1_Ch2.raw'])
+
+    def test_refuses_mismatched_counts(self):
+        """An fcs file with more raw files than repeats is not paired."""
+        self.write_run('run', 2, 1)
+        write_raw(os.path.join(self.root, 'run_R3_P1_K1_Ch1.raw'), n_photons = 100, repetition_number = 3)
+        index = indexer.index_directory(self.root)
+        self.assertEqual(index.pairs['run.fcs'], {})
+        self.assertEqual(len(index.unpaired), 3)
+
+    def test_incremental_update(self):
+        """A saved index is reloaded with its pairs, and only changed files are read again."""
+        self.write_run('run', 2, 1)
+        index = indexer.index_directory(self.root)
+        self.assertEqual(indexer.DirectoryIndex(self.root).pairs, index.pairs)
+        os.remove(os.path.join(self.root, 'run_R2_P1_K1_Ch1.raw'))
+        updated = indexer.index_directory(self.root)
+        self.assertNotIn('run_R2_P1_K1_Ch1.raw', updated.raw)
+        self.assertEqual(updated.pairs['run.fcs'], {})
+
+    def test_load_fcs_links_raw(self):
+        """load_fcs links each repeat to its raw file."""
+        self.write_run('run', 2, 1)
+        fcs = indexer.index_directory(self.root).load_fcs('run.fcs')
+        self.assertEqual(fcs.data['Repeat 2'].raw_path, os.path.join(self.root, 'run_R2_P1_K1_Ch1.raw'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Tests for the lazily compiled kernels of `fcs_functions`."""
+
+
+import json
+import unittest
+
+import numpy as np
+
+from fcs_functions import jit
+
+from .test_import_time import run_fresh
+
+
+class TestLazyKernel(unittest.TestCase):
+    """Tests for `jit.njit` and `jit.LazyKernel`."""
+
+    def test_compiled_when_called(self):
+        """A kernel is compiled on its first call, and gives the same result as the Python function."""
+        @jit.njit(cache = False)
+        def total(values):
+            result = 0.0
+            for value in values:
+                result += value
+            return result
+        self.assertIsNone(total._dispatcher)
+        self.assertEqual(total(np.arange(5.0)), 10.0)
+        self.assertIsNotNone(total._dispatcher)
+        self.assertEqual(total.__name__, 'total')
+
+
+class TestWarmup(unittest.TestCase):
+    """Tests for `jit.warmup`."""
+
+    def test_warmup(self):
+        """Warming up a module compiles each of its kernels for their signatures, and the models then call them without compiling again."""
+        output = run_fresh(
+            'import json\n'
+            'import numpy as np\n'
+            'import fcs_functions\n'
+            'from fcs_functions import jit, models, raw_functions\n'
+            'fcs_functions.warmup(["models"])\n'
+            'kernels = [kernel for kernel in jit._kernels if kernel.function.__module__ == "fcs_functions.models"]\n'
+            'others = [kernel for kernel in jit._kernels if kernel.function.__module__ != "fcs_functions.models"]\n'
+            'compiled = [len(kernel._dispatcher.signatures) for kernel in kernels]\n'
+            'model, jacobian = models.compiled_one_component_model(2e-7, 1e-6)\n'
+            'model(np.logspace(-6, 0, 10), 5.0, 0.1, 5e-6, 5e-5)\n'
+            'jacobian(np.logspace(-6, 0, 10), 5.0, 0.1, 5e-6, 5e-5)\n'
+            'print(json.dumps({\n'
+            '    "signatures": [len(kernel.signatures) for kernel in kernels],\n'
+            '    "compiled": compiled,\n'
+            '    "after_calls": [len(kernel._dispatcher.signatures) for kernel in kernels],\n'
+            '    "others_compiled": any(kernel._dispatcher is not None for kernel in others)\n'
+            '}))\n'
+        )
+        result = json.loads(output)
+        self.assertTrue(result['signatures'])
+        self.assertEqual(result['compiled'], result['signatures'])
+        self.assertEqual(result['after_calls'], result['signatures'])
+        self.assertFalse(result['others_compiled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
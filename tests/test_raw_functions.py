@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""Tests for the raw file functions of `fcs_functions`."""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fcs_functions import raw_functions
+
+from .fixtures import write_raw
+
+# 1 us bins, with intervals spaced as a multiple tau correlator's over 5 levels
+bin_size = 1e-6
+intervals = np.concatenate([np.arange(1, 17), np.arange(18, 33, 2), np.arange(36, 65, 4), np.arange(72, 129, 8), np.arange(144, 257, 16)])
+autocorr_times = intervals*bin_size
+
+
+def binned_reference(detector_times: 'np.array', bin_ticks: int, intervals: 'np.array') -> 'np.array':
+    """The ACF of photon counts in bins of bin_ticks, written out with numpy, dropping the last bin as it may not be full"""
+    counts = np.bincount(detector_times.astype(np.int64)//bin_ticks)[:-1].astype(np.float64)
+    return np.array([np.mean(counts[:-interval]*counts[interval:]) for interval in intervals])/counts.mean()**2
+
+
+class RawFileTestCase(unittest.TestCase):
+    """Writes one raw file of 200000 photons, about 0.6 s at 20 MHz, for the tests of a class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'run_R1_P1_K1_Ch1.raw')
+        cls.distances = write_raw(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def setUp(self):
+        self.raw = raw_functions.RawConfoCor3(self.path)
+
+
+class TestRawConfoCor3(RawFileTestCase):
+    """Tests for reading raw files."""
+
+    def test_header(self):
+        """The header values are read."""
+        self.assertEqual(self.raw.sampling_frequency, 20000000)
+        self.assertEqual(self.raw.measurement_pos, 7)
+        self.assertEqual(self.raw.repetition_number, 1)
+
+    def test_detector_times(self):
+        """Detector times are the cumulative pulse distances."""
+        np.testing.assert_array_equal(self.raw.detector_times, np.cumsum(self.distances, dtype = np.uint64))
+
+    def test_memory_mapped(self):
+        """Pulse distances are mapped from the file rather than read into memory."""
+        distances = raw_functions.read_pulse_distances(self.path)
+        self.assertIsInstance(distances, np.memmap)
+        np.testing.assert_array_equal(distances, self.distances)
+
+    def test_streamed_times(self):
+        """Detector times streamed in chunks are the detector times read whole."""
+        np.testing.assert_array_equal(np.concatenate(list(raw_functions.iter_detector_times(self.path, 7919))), self.raw.detector_times)
+
+
+class TestAutocorrelation(RawFileTestCase):
+    """Tests that the ACF methods agree with each other and with a binned reference."""
+
+    def acf(self, **kwargs) -> 'np.array':
+        self.raw.make_acf(bin_size, autocorr_times, **kwargs)
+        return self.raw.acf[1]
+
+    def test_binned_methods(self):
+        """The direct and FFT ACFs match the reference."""
+        reference = binned_reference(self.raw.detector_times, 20, intervals)
+        np.testing.assert_allclose(self.acf(method = 'direct'), reference, rtol = 1e-12)
+        np.testing.assert_allclose(self.acf(method = 'fft'), reference, rtol = 1e-12)
+
+    def test_multi_tau(self):
+        """The multiple tau ACF matches the reference on its first level, and the reference on coarser bins at the others."""
+        multi_tau = self.acf(method = 'multitau')
+        levels, level_intervals = raw_functions.multi_tau_levels(intervals)
+        first = levels == 0
+        np.testing.assert_allclose(multi_tau[first], binned_reference(self.raw.detector_times, 20, intervals[first]), rtol = 1e-12)
+        coarse = [binned_reference(self.raw.detector_times, 20*2**level, [interval])[0] for level, interval in zip(levels, level_intervals)]
+        np.testing.assert_allclose(multi_tau, coarse, atol = 1e-4)
+
+    def test_segments(self):
+        """Segments leave the mean unchanged and give a finite standard error."""
+        self.raw.make_acf(bin_size, autocorr_times, segments = 10)
+        segmented = self.raw.acf
+        np.testing.assert_allclose(segmented[1], self.acf(method = 'multitau'), rtol = 1e-12)
+        self.assertTrue(np.all(np.isfinite(segmented[2])))
+        self.raw.make_acf(bin_size, autocorr_times, method = 'direct', segments = 10)
+        segmented = self.raw.acf
+        np.testing.assert_allclose(segmented[1], self.acf(method = 'direct'), rtol = 1e-12)
+        self.assertTrue(np.all(np.isfinite(segmented[2])))
+
+    def test_empty_segments(self):
+        """A segment of the trace holding no photons leaves the ACF and its standard error finite."""
+        times = self.raw.detector_times
+        gap = np.concatenate((times[times < 2000000], times[times > 6000000]))
+        ac_mean, ac_sigma = raw_functions.multi_tau_acf(gap, 20000000, autocorr_times, bin_size, segments = 10)
+        self.assertTrue(np.all(np.isfinite(ac_mean)))
+        self.assertTrue(np.all(np.isfinite(ac_sigma)))
+
+    def test_online_correlator(self):
+        """The online correlator matches multi_tau_acf on the first level and converges to it on the others, however the pulses are split."""
+        multi_tau = self.acf(method = 'multitau')
+        levels = raw_functions.multi_tau_levels(intervals)[0]
+        results = []
+        for block_size in (7919, 30011):
+            correlator = raw_functions.OnlineCorrelator(self.raw.sampling_frequency, autocorr_times, bin_size)
+            for start in range(0, len(self.distances), block_size):
+                correlator.update(self.distances[start:start + block_size])
+            results.append(correlator.acf()[1])
+        np.testing.assert_allclose(results[0], results[1], rtol = 1e-12)
+        np.testing.assert_allclose(results[0][levels == 0], multi_tau[levels == 0], rtol = 1e-12)
+        np.testing.assert_allclose(results[0], multi_tau, atol = 1e-4)
+        self.raw.make_acf(bin_size, autocorr_times, chunk_size = 30011)
+        np.testing.assert_allclose(self.raw.acf[1], results[1], rtol = 1e-12)
+
+
+class TestChunks(RawFileTestCase):
+    """Tests that streaming a file in chunks gives the same results as reading it whole."""
+
+    def test_bin(self):
+        """Chunked count rates are identical, for bin sizes of whole clock ticks and not."""
+        for size in (2e-7, 1e-6, 1.234e-7):
+            self.raw.bin(size)
+            whole = self.raw.CountRateArray
+            self.raw.bin(size, chunk_size = 7919)
+            np.testing.assert_array_equal(self.raw.CountRateArray, whole)
+
+    def test_pch(self):
+        """Chunked photon counting histograms are identical."""
+        pch_bins = np.arange(0, 2000000, 50000)
+        self.raw.make_pch(2e-5, pch_bins)
+        whole = self.raw.PhotonCountHistogram[0]
+        self.raw.make_pch(2e-5, pch_bins, chunk_size = 7919)
+        np.testing.assert_array_equal(self.raw.PhotonCountHistogram[0], whole)
+
+    def test_direct_acf(self):
+        """The chunked direct ACF is identical."""
+        self.raw.make_acf(bin_size, autocorr_times, method = 'direct')
+        whole = self.raw.acf[1]
+        self.raw.make_acf(bin_size, autocorr_times, method = 'direct', chunk_size = 7919)
+        np.testing.assert_allclose(self.raw.acf[1], whole, rtol = 1e-12)
+
+
+class TestPhotonCounts(RawFileTestCase):
+    """Tests for integer photon counting."""
+
+    def test_clock_ticks(self):
+        """Bin sizes are converted to whole clock ticks, or None when they are not whole."""
+        self.assertEqual(raw_functions.clock_ticks(2e-7, 20000000), 4)
+        self.assertEqual(raw_functions.clock_ticks(5*10**-6, 20000000), 100)
+        self.assertIsNone(raw_functions.clock_ticks(1.234e-7, 20000000))
+
+    def test_count_rates(self):
+        """Count rates binned by clock ticks hold every photon before the last, partial, bin."""
+        self.raw.bin(2e-7)
+        last_edge = len(self.raw.CountRateArray[1])*4
+        self.assertEqual(np.rint(self.raw.CountRateArray[1]*2e-7).sum(), np.sum(self.raw.detector_times < last_edge))
+
+    def test_rebinned_counts(self):
+        """Counts summed from finer counts are the counts of the coarser bins."""
+        self.raw.count_photons(1e-6, keep = True)
+        np.testing.assert_array_equal(self.raw.count_photons(5e-6), raw_functions.bin_clock(self.raw.detector_times, 100))
+
+    def test_counts_kept(self):
+        """Counts are only kept when asked for, and not by the methods that count photons for their own results."""
+        self.raw.bin(1e-6)
+        self.raw.make_acf(bin_size, autocorr_times, method = 'direct')
+        self.raw.make_pch_series((1e-6, 5e-6))
+        self.raw.count_photons(1e-6)
+        self.assertEqual(self.raw._photon_counts, {})
+        kept = self.raw.count_photons(1e-6, keep = True)
+        self.assertIs(self.raw.count_photons(1e-6), kept)
+        self.raw.clear_counts()
+        self.assertEqual(self.raw._photon_counts, {})
+
+    def test_pch_series(self):
+        """Each histogram of the series is the histogram of the counts at its bin size, keyed by the bin size asked for."""
+        self.raw.make_pch_series((1e-6, 5*10**-6, 2e-5))
+        self.assertEqual(sorted(self.raw.PhotonCountHistograms), [1e-6, 5e-6, 2e-5])
+        for size, ticks in ((1e-6, 20), (5e-6, 100), (2e-5, 400)):
+            np.testing.assert_array_equal(self.raw.PhotonCountHistograms[size], np.bincount(raw_functions.bin_clock(self.raw.detector_times, ticks)))
+
+    def test_pch_series_sizes(self):
+        """Bin sizes that are not multiples of the finest are refused."""
+        with self.assertRaises(ValueError):
+            self.raw.make_pch_series((2e-6, 5e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()